@@ -0,0 +1,185 @@
+"""Keeps fetched asset messages and their media on disk"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import struct
+import time
+import typing
+
+from legacytl.extensions import BinaryReader
+from legacytl.tl.types import Message
+
+from .tl_cache import CustomTelegramClient
+
+logger = logging.getLogger(__name__)
+
+MAX_TOTALSIZE = 1024 * 1024 * 64  # 64 MB
+# Cached messages are refetched after this time (seconds), because file
+# references of their media expire eventually
+MESSAGE_TTL = 60 * 60
+
+_TIMESTAMP = struct.Struct("<d")
+
+
+class AssetCache:
+    """
+    LRU cache of asset messages and their downloaded media, bounded by total size.
+    Media is addressed by asset id and id of the media itself, so replacing
+    media of asset never returns the stale file
+    """
+
+    def __init__(self, tg_id: int):
+        self._path = os.path.join(
+            os.path.expanduser("~"),
+            ".legacy",
+            "assets_cache",
+            str(tg_id),
+        )
+        os.makedirs(self._path, exist_ok=True)
+
+        # File name -> size, least recently used first
+        self._entries: typing.OrderedDict[str, int] = collections.OrderedDict()
+        self._size = 0
+
+        # Modification time is bumped on every hit, so LRU order survives restarts
+        for entry in sorted(os.scandir(self._path), key=lambda e: e.stat().st_mtime):
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+                continue
+
+            self._entries[entry.name] = entry.stat().st_size
+            self._size += self._entries[entry.name]
+
+    @staticmethod
+    def _media_id(message: Message) -> typing.Optional[int]:
+        media = getattr(message, "document", None) or getattr(message, "photo", None)
+        return getattr(media, "id", None)
+
+    def _read_file(self, name: str) -> typing.Optional[bytes]:
+        try:
+            with open(os.path.join(self._path, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, name: str, data: bytes):
+        path = os.path.join(self._path, name)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+
+        os.replace(f"{path}.tmp", path)
+
+    def _hit(self, name: str, data: typing.Optional[bytes]) -> typing.Optional[bytes]:
+        if data is None:
+            self._forget(name)
+            return None
+
+        self._entries.move_to_end(name)
+        with contextlib.suppress(OSError):
+            os.utime(os.path.join(self._path, name))
+
+        return data
+
+    def _add(self, name: str, size: int):
+        self._forget(name)
+        self._entries[name] = size
+        self._size += size
+
+        while self._size > MAX_TOTALSIZE and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _forget(self, name: str):
+        self._size -= self._entries.pop(name, 0)
+
+    def _remove(self, name: str):
+        self._forget(name)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self._path, name))
+
+    def get_message(
+        self,
+        asset_id: int,
+        client: CustomTelegramClient,
+    ) -> typing.Optional[Message]:
+        """
+        Get cached asset message
+        :param asset_id: Asset id
+        :param client: Client to bind message to
+        :return: Message or `None` if it's not cached or outdated
+        """
+        name = f"{asset_id}.msg"
+        if name not in self._entries or not (
+            data := self._hit(name, self._read_file(name))
+        ):
+            return None
+
+        (ts,) = _TIMESTAMP.unpack_from(data)
+        if ts + MESSAGE_TTL < time.time():
+            self._remove(name)
+            return None
+
+        try:
+            message = BinaryReader(data[_TIMESTAMP.size :]).tgread_object()
+            message._finish_init(client, {}, None)
+        except Exception:
+            logger.debug("Can't restore cached asset %s", asset_id, exc_info=True)
+            self._remove(name)
+            return None
+
+        return message
+
+    def put_message(self, message: Message):
+        """Cache asset message"""
+        data = _TIMESTAMP.pack(time.time()) + bytes(message)
+        self._write_file(f"{message.id}.msg", data)
+        self._add(f"{message.id}.msg", len(data))
+
+    async def get_media(self, message: Message) -> typing.Optional[bytes]:
+        """Get cached media of asset message"""
+        if (media_id := self._media_id(message)) is None:
+            return None
+
+        name = f"{message.id}-{media_id}.media"
+        if name not in self._entries:
+            return None
+
+        return self._hit(
+            name,
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._read_file,
+                name,
+            ),
+        )
+
+    async def put_media(self, message: Message, data: bytes):
+        """Cache downloaded media of asset message"""
+        if (media_id := self._media_id(message)) is None or len(data) > MAX_TOTALSIZE:
+            return
+
+        name = f"{message.id}-{media_id}.media"
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            self._write_file,
+            name,
+            data,
+        )
+        self._add(name, len(data))
+
+    def invalidate(self, asset_id: int):
+        """Drop everything cached for asset, e.g. when it's edited or deleted"""
+        for name in [
+            name
+            for name in self._entries
+            if name == f"{asset_id}.msg" or name.startswith(f"{asset_id}-")
+        ]:
+            self._remove(name)
@@ -0,0 +1,217 @@
+"""Bounded in-memory cache with expiration of entries"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import collections
+import logging
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class _Entry(typing.NamedTuple):
+    expires: float
+    value: typing.Any
+    size: int
+    aliases: typing.Tuple[typing.Hashable, ...]
+
+
+class TTLCache:
+    """
+    LRU cache, bounded by number of entries, which expire after `ttl` seconds.
+    Entry can be stored under several alias keys, which share the same record
+    and slot. Keeps counters of hits, misses, evictions, expirations and
+    total size of values, if `sizeof` is passed
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        sizeof: typing.Optional[typing.Callable[[typing.Any], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # Key -> entry, least recently used first
+        self._entries: typing.OrderedDict[typing.Hashable, _Entry] = (
+            collections.OrderedDict()
+        )
+        # Alias -> key of entry
+        self._aliases: typing.Dict[typing.Hashable, typing.Hashable] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        key = self._aliases.get(key, key)
+        return key in self._entries and self._entries[key].expires >= time.monotonic()
+
+    def __getitem__(self, key: typing.Hashable) -> typing.Any:
+        if (value := self.get(key, MISSING)) is MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Get value, which is not expired yet
+        :param key: Key or alias of entry
+        :param default: Value to return on cache miss
+        :return: Cached value or `default`
+        """
+        key = self._aliases.get(key, key)
+        if (entry := self._entries.get(key)) is None:
+            self.misses += 1
+            return default
+
+        if entry.expires < time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key: typing.Hashable) -> typing.Any:
+        """
+        Get value, which is not expired yet, without counting it as a hit
+        or making it recently used
+        :param key: Key or alias of entry
+        :return: Cached value or `None`
+        """
+        entry = self._entries.get(self._aliases.get(key, key))
+        return entry.value if entry and entry.expires >= time.monotonic() else None
+
+    def set(
+        self,
+        key: typing.Hashable,
+        value: typing.Any,
+        ttl: typing.Optional[float] = None,
+        aliases: typing.Iterable[typing.Hashable] = (),
+    ):
+        """
+        Cache value, evicting least recently used entries above the size limit
+        :param key: Key of entry
+        :param value: Value to cache
+        :param ttl: Time to live of entry, if it differs from the default one
+        :param aliases: Other keys, which should point to the same entry
+        """
+        # Key or aliases could belong to other entries before
+        aliases = tuple({alias for alias in aliases if alias != key})
+        for stale in (key, *aliases):
+            if (owner := self._aliases.pop(stale, None)) is not None:
+                self._unalias(owner, stale)
+
+            if stale in self._entries:
+                self._drop(stale)
+
+        entry = self._entries[key] = _Entry(
+            time.monotonic() + (self.ttl if ttl is None else ttl),
+            value,
+            self._sizeof(value) if self._sizeof else 0,
+            aliases,
+        )
+        self.bytes += entry.size
+        for alias in aliases:
+            self._aliases[alias] = key
+
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _unalias(self, key: typing.Hashable, alias: typing.Hashable):
+        if (entry := self._entries.get(key)) is not None:
+            self._entries[key] = entry._replace(
+                aliases=tuple(other for other in entry.aliases if other != alias)
+            )
+
+    def _drop(self, key: typing.Hashable) -> _Entry:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        for alias in entry.aliases:
+            if self._aliases.get(alias) == key:
+                del self._aliases[alias]
+
+        return entry
+
+    def pop(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """Drop entry with all its aliases and return its value"""
+        key = self._aliases.get(key, key)
+        if key not in self._entries:
+            return default
+
+        return self._drop(key).value
+
+    def prune(self, predicate: typing.Callable[[typing.Hashable], bool]) -> int:
+        """
+        Drop entries, key or any alias of which matches predicate
+        :param predicate: Function, which gets key or alias
+        :return: Number of dropped entries
+        """
+        stale = [
+            key
+            for key, entry in self._entries.items()
+            if predicate(key) or any(map(predicate, entry.aliases))
+        ]
+        for key in stale:
+            self._drop(key)
+
+        return len(stale)
+
+    def dump(
+        self,
+    ) -> typing.List[
+        typing.Tuple[
+            typing.Hashable,
+            typing.Any,
+            float,
+            typing.Tuple[typing.Hashable, ...],
+        ]
+    ]:
+        """
+        Get entries, which are not expired yet, least recently used first
+        :return: Key, value, remaining time to live and aliases of each entry
+        """
+        now = time.monotonic()
+        return [
+            (key, entry.value, entry.expires - now, entry.aliases)
+            for key, entry in self._entries.items()
+            if entry.expires >= now
+        ]
+
+    def clear(self):
+        """Drop all entries"""
+        self._entries.clear()
+        self._aliases.clear()
+        self.bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        """
+        Get counters of cache
+        :return: Current `size`, `maxsize` and `bytes`, and total number
+            of `hits`, `misses`, `evictions` and `expirations`
+        """
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,336 @@
+"""Filters command output by `| grep` clause of command"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import codecs
+import collections
+import functools
+import html
+import io
+import itertools
+import logging
+import re
+import typing
+
+from legacytl.tl.types import Message
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Same tags as `utils.remove_html` removes, but with a single literal prefix,
+# so the regex engine can skip to candidates quickly
+HTML_TAGS = re.compile(
+    r"</?(?:(?:a|pre|emoji|blockquote)[^>\n]*|b|i|u|strong|em|code|strike|del)>"
+)
+OPTION = re.compile(r"\s*(-[icE]+|-[ABC]\s*\d+)(?=\s|$)")
+# Attached files are read and filtered in chunks of this size
+FILE_CHUNK = 64 * 1024
+# Encodings of text files, detected by byte order mark. UTF-32 ones go first,
+# because their marks start with UTF-16 ones
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+]
+
+# Line is either (plain text, whether it matched) or `None`,
+# which separates non-adjacent groups of context lines
+Selected = typing.Optional[typing.Tuple[str, bool]]
+
+
+def iter_lines(chunks: typing.Iterable[str]) -> typing.Iterator[str]:
+    """
+    Split text, which comes in chunks, into lines without joining it first
+    :param chunks: Pieces of text, lines may span several of them
+    :return: Lines without line breaks
+    """
+    tail = ""
+    for chunk in chunks:
+        start = 0
+        while (end := chunk.find("\n", start)) != -1:
+            yield tail + chunk[start:end]
+            tail = ""
+            start = end + 1
+
+        tail += chunk[start:]
+
+    if tail:
+        yield tail
+
+
+class GrepFilter:
+    """
+    Selects lines of output like `grep` does.
+    Supports `-v` exclusion, `-i` to ignore case, `-c` to count lines,
+    `-E` to treat patterns as regular expressions and `-A`, `-B`, `-C`
+    to show context lines
+    """
+
+    def __init__(
+        self,
+        include: typing.Optional[str] = None,
+        exclude: typing.Optional[str] = None,
+        *,
+        ignore_case: bool = False,
+        count: bool = False,
+        regex: bool = False,
+        before: int = 0,
+        after: int = 0,
+    ):
+        self.include = include
+        self.exclude = exclude
+        self.ignore_case = ignore_case
+        self.count = count
+        self.regex = regex
+        self.before = before
+        self.after = after
+
+        self._include = self._compile(include)
+        self._exclude = self._compile(exclude)
+
+    def _compile(self, pattern: typing.Optional[str]) -> typing.Optional[re.Pattern]:
+        if not pattern:
+            return None
+
+        # Patterns are matched against plain text, HTML is unescaped before
+        return re.compile(
+            pattern if self.regex else re.escape(pattern),
+            re.IGNORECASE if self.ignore_case else 0,
+        )
+
+    @classmethod
+    def parse(cls, args: str) -> typing.Optional["GrepFilter"]:
+        """
+        Parse arguments of `| grep` clause
+        :param args: Options, pattern and optional `-v` exclusion, e.g.
+            `-i -C 2 error -v debug`
+        :return: Filter or `None` if there is nothing to filter by
+        """
+        options = {}
+        while match := OPTION.match(args):
+            option = match.group(1)
+            if option[1] in "ABC":
+                value = int(option[2:])
+                if option[1] != "A":
+                    options["before"] = value
+                if option[1] != "B":
+                    options["after"] = value
+            else:
+                options.update(
+                    ignore_case="i" in option or options.get("ignore_case", False),
+                    count="c" in option or options.get("count", False),
+                    regex="E" in option or options.get("regex", False),
+                )
+
+            args = args[match.end() :]
+
+        args = args.strip()
+        if args.startswith("-v "):
+            include, exclude = None, args[3:]
+        else:
+            include, _, exclude = args.partition(" -v ")
+
+        include, exclude = (include or "").strip(), exclude.strip()
+        if not include and not exclude:
+            return None
+
+        try:
+            return cls(include or None, exclude or None, **options)
+        except re.error:
+            logger.debug("Invalid grep pattern %s", args, exc_info=True)
+            return None
+
+    @staticmethod
+    def _plain(text: typing.Union[str, typing.Iterable[str]]) -> typing.Iterable[str]:
+        # Tags never span several lines, so the whole text is stripped at once
+        if isinstance(text, str):
+            return html.unescape(HTML_TAGS.sub("", text)).split("\n")
+
+        return (
+            html.unescape(HTML_TAGS.sub("", line)) for line in iter_lines(text)
+        )
+
+    def _filter(self, lines: typing.Iterable[str]) -> typing.Iterator[str]:
+        # Bound `search` methods keep the whole loop in C
+        if self._include is not None:
+            lines = filter(self._include.search, lines)
+
+        if self._exclude is not None:
+            lines = itertools.filterfalse(self._exclude.search, lines)
+
+        return lines
+
+    def _select(self, lines: typing.Iterable[str]) -> typing.Iterator[Selected]:
+        if not self.before and not self.after:
+            for plain in self._filter(lines):
+                yield plain, True
+
+            return
+
+        before = collections.deque(maxlen=self.before)
+        after = 0
+        gap = False
+        printed = False
+
+        for plain in lines:
+            if any(self._filter((plain,))):
+                if gap and printed:
+                    yield None
+
+                yield from before
+                before.clear()
+                yield plain, True
+                printed = True
+                gap = False
+                after = self.after
+            elif after:
+                after -= 1
+                yield plain, False
+            else:
+                # Line, which doesn't fit into context, is skipped
+                if len(before) == self.before:
+                    gap = True
+
+                before.append((plain, False))
+
+    @property
+    def description(self) -> str:
+        """Human-readable description of selected lines"""
+        verb = "match" if self.regex else "contain"
+        return " and ".join(
+            filter(
+                None,
+                [
+                    self.include
+                    and f"{verb} <b>{utils.escape_html(self.include)}</b>",
+                    self.exclude
+                    and f"do not {verb} <b>{utils.escape_html(self.exclude)}</b>",
+                ],
+            )
+        )
+
+    def _highlight(self, line: str) -> str:
+        """Escape plain line and underline matches of pattern in it"""
+        if self._include is None:
+            return utils.escape_html(line)
+
+        result = []
+        end = 0
+        for match in self._include.finditer(line):
+            if match.start() == match.end():
+                continue
+
+            result += [
+                utils.escape_html(line[end : match.start()]),
+                "<u>",
+                utils.escape_html(match.group()),
+                "</u>",
+            ]
+            end = match.end()
+
+        result.append(utils.escape_html(line[end:]))
+        return "".join(result)
+
+    def __call__(self, text: typing.Union[str, typing.Iterable[str]]) -> str:
+        """
+        Filter output
+        :param text: Text or its chunks
+        :return: HTML with selected lines and their matches underlined
+        """
+        selected = 0
+        result = []
+        for line in self._select(self._plain(text)):
+            if line is None:
+                result.append("--")
+                continue
+
+            line, matched = line
+            selected += matched
+            if self.count:
+                continue
+
+            result.append(
+                self._highlight(line) if matched else utils.escape_html(line)
+            )
+
+        if self.count:
+            return f"💬 <i>{selected} lines that {self.description}</i>"
+
+        if not selected:
+            return f"💬 <i>No lines that {self.description}</i>"
+
+        return f"<i>💬 Lines that {self.description}:</i>\n" + "\n".join(result)
+
+    def filter_file(
+        self,
+        file: typing.Any,
+        encoding: typing.Optional[str] = None,
+    ) -> typing.Any:
+        """
+        Filter attached text file chunk by chunk. Its content is plain text,
+        so it's matched as is
+        :param file: File-like object
+        :param encoding: Encoding of file. If not passed, it's detected by
+            byte order mark, defaulting to UTF-8
+        :return: New UTF-8 file with selected lines or the same file,
+            if it's not text
+        """
+        if not hasattr(file, "read") or not hasattr(file, "seek"):
+            return file
+
+        result = io.BytesIO()
+        result.name = getattr(file, "name", "command_result.txt")
+
+        try:
+            file.seek(0)
+            head = file.read(FILE_CHUNK)
+            encoding = encoding or next(
+                (name for bom, name in BOMS if head.startswith(bom)),
+                "utf-8",
+            )
+            chunks = itertools.chain([head], iter(lambda: file.read(FILE_CHUNK), b""))
+            for line in self._select(iter_lines(codecs.iterdecode(chunks, encoding))):
+                result.write(b"--\n" if line is None else f"{line[0]}\n".encode())
+        except (UnicodeError, LookupError, TypeError):
+            file.seek(0)
+            return file
+
+        result.seek(0)
+        return result
+
+    def apply(self, message: Message) -> Message:
+        """
+        Make message filter all text it sends
+        :param message: Message, which triggered command
+        :return: The same message
+        """
+        message.legacy_grep = self
+        message.legacy_grepped = True
+        message.edit = functools.partial(self._send, message.edit)
+        message.reply = functools.partial(self._send, message.reply)
+        message.respond = functools.partial(
+            self._send,
+            message.respond,
+            reply_to=utils.get_topic(message),
+        )
+        return message
+
+    async def _send(
+        self,
+        method: typing.Callable[..., typing.Awaitable[Message]],
+        text: typing.Optional[str] = None,
+        *args,
+        **kwargs,
+    ) -> Message:
+        if isinstance(text, str):
+            text = self(text)
+            kwargs["parse_mode"] = "HTML"
+
+        return await method(text, *args, **kwargs)
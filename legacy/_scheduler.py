@@ -0,0 +1,242 @@
+"""Runs watchers with bounded concurrency and commands in per-chat lanes"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+import collections
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+MAX_RUNNING = 256
+MAX_RUNNING_PER_WATCHER = 32
+MAX_QUEUED_PER_WATCHER = 512
+# Command, which runs longer (seconds), stops blocking the next ones in its chat
+LANE_DETACH_TIMEOUT = 10
+
+# Overflow policies of watcher queue
+DROP_NEW = "drop_new"
+DROP_OLD = "drop_old"
+COALESCE = "coalesce"
+OVERFLOW_POLICIES = {DROP_NEW, DROP_OLD, COALESCE}
+
+Job = typing.Callable[[], typing.Awaitable[typing.Any]]
+
+
+class _Lane:
+    """Queue and counters of a single watcher"""
+
+    __slots__ = (
+        "modname",
+        "limit",
+        "policy",
+        "queue",
+        "running",
+        "done",
+        "dropped",
+        "coalesced",
+    )
+
+    def __init__(self, modname: str, limit: int, policy: str):
+        self.modname = modname
+        self.limit = limit
+        self.policy = policy
+        # (chat id, job)
+        self.queue: typing.Deque[typing.Tuple[typing.Any, Job]] = collections.deque()
+        self.running = 0
+        self.done = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+
+class WatcherPool:
+    """
+    Runs watchers with global concurrency limit and per-watcher caps.
+    Work above the cap waits in a bounded queue of watcher. When the queue is full,
+    new work is dropped or replaces the oldest one, depending on the policy.
+    With `coalesce` policy the queued work for the same chat is replaced
+    with the new one, so the watcher only sees the latest event of chat
+    """
+
+    def __init__(
+        self,
+        max_running: int = MAX_RUNNING,
+        max_running_per_watcher: int = MAX_RUNNING_PER_WATCHER,
+        max_queued: int = MAX_QUEUED_PER_WATCHER,
+    ):
+        self._semaphore = asyncio.Semaphore(max_running)
+        self._max_running_per_watcher = max_running_per_watcher
+        self._max_queued = max_queued
+        self._lanes: typing.Dict[typing.Callable, _Lane] = {}
+        # Counters of reaped lanes, module name -> counter -> value
+        self._totals: typing.Dict[str, typing.Counter] = collections.defaultdict(
+            collections.Counter
+        )
+
+    def submit(
+        self,
+        func: typing.Callable,
+        modname: str,
+        chat_id: typing.Any,
+        job: Job,
+        limit: typing.Optional[int] = None,
+        policy: typing.Optional[str] = None,
+    ) -> bool:
+        """
+        Schedule watcher job
+        :param func: Watcher, jobs of which share the cap and the queue
+        :param modname: Name of module, used for stats
+        :param chat_id: Chat of event, used by `coalesce` policy
+        :param job: Coroutine function, which runs the watcher
+        :param limit: Max number of simultaneously running jobs of watcher
+        :param policy: What to do when the queue is full
+        :return: `False` if job was dropped
+        """
+        if (lane := self._lanes.get(func)) is None:
+            lane = self._lanes[func] = _Lane(
+                modname,
+                max(1, limit or self._max_running_per_watcher),
+                policy if policy in OVERFLOW_POLICIES else DROP_NEW,
+            )
+
+        if lane.running < lane.limit and not lane.queue:
+            self._start(func, lane, job)
+            return True
+
+        if lane.policy == COALESCE:
+            for i, (queued_chat_id, _) in enumerate(lane.queue):
+                if queued_chat_id == chat_id:
+                    lane.queue[i] = (chat_id, job)
+                    lane.coalesced += 1
+                    return True
+
+        if len(lane.queue) >= self._max_queued:
+            lane.dropped += 1
+            if lane.policy == DROP_NEW:
+                logger.debug("Watcher %s is overloaded, dropping event", func)
+                return False
+
+            lane.queue.popleft()
+
+        lane.queue.append((chat_id, job))
+        return True
+
+    def _start(self, func: typing.Callable, lane: _Lane, job: Job):
+        lane.running += 1
+        asyncio.ensure_future(self._worker(func, lane, job))
+
+    async def _worker(self, func: typing.Callable, lane: _Lane, job: Job):
+        try:
+            while True:
+                async with self._semaphore:
+                    try:
+                        await job()
+                    except Exception:
+                        logger.exception("Error running watcher %s", func)
+
+                lane.done += 1
+                if not lane.queue:
+                    break
+
+                _, job = lane.queue.popleft()
+        finally:
+            lane.running -= 1
+            if not lane.running and not lane.queue and self._lanes.get(func) is lane:
+                self._reap(func, lane)
+
+    def _reap(self, func: typing.Callable, lane: _Lane):
+        del self._lanes[func]
+        self._totals[lane.modname].update(
+            done=lane.done,
+            dropped=lane.dropped,
+            coalesced=lane.coalesced,
+        )
+
+    def stats(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """
+        Get counters of watchers work
+        :return: Module name -> counters: number of currently `queued` and `running`
+            jobs, and total number of `done`, `dropped` and `coalesced` ones
+        """
+        result = {
+            modname: {
+                "queued": 0,
+                "running": 0,
+                "done": totals["done"],
+                "dropped": totals["dropped"],
+                "coalesced": totals["coalesced"],
+            }
+            for modname, totals in self._totals.items()
+        }
+
+        for lane in self._lanes.values():
+            counters = result.setdefault(
+                lane.modname,
+                dict.fromkeys(("queued", "running", "done", "dropped", "coalesced"), 0),
+            )
+            counters["queued"] += len(lane.queue)
+            counters["running"] += lane.running
+            counters["done"] += lane.done
+            counters["dropped"] += lane.dropped
+            counters["coalesced"] += lane.coalesced
+
+        return result
+
+
+class ChatLanes:
+    """
+    Runs jobs of the same chat one by one in submission order, and jobs
+    of different chats in parallel. Lane of chat exists only while it has work.
+    Job, which runs longer than `detach_timeout`, stops blocking its lane
+    and continues in background, so long commands don't lock the chat
+    """
+
+    def __init__(self, detach_timeout: float = LANE_DETACH_TIMEOUT):
+        self._detach_timeout = detach_timeout
+        self._lanes: typing.Dict[typing.Any, typing.Deque[Job]] = {}
+
+    def __len__(self) -> int:
+        return len(self._lanes)
+
+    def submit(self, chat_id: typing.Any, job: Job):
+        """
+        Schedule job after all previously submitted jobs of the same chat
+        :param chat_id: Chat, which defines the lane
+        :param job: Coroutine function to run
+        """
+        if (lane := self._lanes.get(chat_id)) is not None:
+            lane.append(job)
+            return
+
+        self._lanes[chat_id] = collections.deque([job])
+        asyncio.ensure_future(self._worker(chat_id))
+
+    async def _worker(self, chat_id: typing.Any):
+        lane = self._lanes[chat_id]
+        try:
+            while lane:
+                job = lane.popleft()
+                task = asyncio.ensure_future(self._run(job))
+                if not (await asyncio.wait({task}, timeout=self._detach_timeout))[0]:
+                    # Next jobs of chat may now finish before this one
+                    logger.warning(
+                        "Job %s in chat %s runs longer than %ss, next jobs of"
+                        " chat won't wait for it",
+                        job,
+                        chat_id,
+                        self._detach_timeout,
+                    )
+        finally:
+            del self._lanes[chat_id]
+
+    @staticmethod
+    async def _run(job: Job):
+        try:
+            await job()
+        except Exception:
+            logger.exception("Error running job %s", job)
@@ -0,0 +1,110 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import logging
+import sqlite3
+import typing
+from pathlib import Path
+
+import ujson
+
+logger = logging.getLogger(__name__)
+
+Row = typing.Tuple[str, str, str]
+
+
+class SQLiteStorage:
+    """
+    Database storage with one row per (owner, key), so owners can be
+    loaded lazily and only changed keys are written
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        # Reader is used from event loop, writer - from worker threads under
+        # database write lock. WAL mode lets them work simultaneously
+        self._reader = self._connect()
+        self._writer: typing.Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self._path), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " owner TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (owner, key)"
+            ") WITHOUT ROWID"
+        )
+        connection.commit()
+        return connection
+
+    @property
+    def _write_connection(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = self._connect()
+
+        return self._writer
+
+    def owners(self) -> typing.Set[str]:
+        """Get all owners, which have at least one key stored"""
+        return {
+            owner
+            for owner, in self._reader.execute("SELECT DISTINCT owner FROM entries")
+        }
+
+    def load(self, owner: str) -> typing.Dict[str, str]:
+        """Load all keys of owner with their serialized values"""
+        return dict(
+            self._reader.execute(
+                "SELECT key, value FROM entries WHERE owner = ?",
+                (owner,),
+            )
+        )
+
+    def load_all(self) -> typing.Dict[str, typing.Dict[str, str]]:
+        """Load all owners at once with serialized values of their keys"""
+        result = {}
+        for owner, key, value in self._reader.execute(
+            "SELECT owner, key, value FROM entries"
+        ):
+            result.setdefault(owner, {})[key] = value
+
+        return result
+
+    def write(
+        self,
+        rows: typing.Iterable[Row],
+        removed: typing.Iterable[typing.Tuple[str, str]] = (),
+    ):
+        """Delete removed keys and insert or replace changed ones in one transaction"""
+        with self._write_connection as connection:
+            connection.executemany(
+                "DELETE FROM entries WHERE owner = ? AND key = ?",
+                removed,
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (owner, key, value) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def replace(self, rows: typing.Iterable[Row]):
+        """Replace the whole storage contents in one transaction"""
+        with self._write_connection as connection:
+            connection.execute("DELETE FROM entries")
+            connection.executemany(
+                "INSERT INTO entries (owner, key, value) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    @staticmethod
+    def rows(db: dict) -> typing.Iterator[Row]:
+        """Convert database dict to storage rows"""
+        for owner, keys in db.items():
+            for key, value in keys.items():
+                yield str(owner), str(key), ujson.dumps(value)
@@ -0,0 +1,155 @@
+"""Stores records of client caches on disk, so they survive restarts"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import contextlib
+import logging
+import os
+import struct
+import time
+import typing
+
+from legacytl.extensions import BinaryReader
+from legacytl.tl.alltlobjects import LAYER
+from legacytl.tl.tlobject import TLObject
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+# Snapshot is saved this often (seconds), so it's not lost on crash
+SAVE_INTERVAL = 10 * 60
+
+# Kinds of records
+ENTITY = 0
+PERMS = 1
+CHAT_PERMS = 2
+FULLCHANNEL = 3
+FULLUSER = 4
+
+_MAGIC = b"LTLC"
+# Magic, version of format and layer, TL objects are serialized with
+_HEADER = struct.Struct("<4sHI")
+# Kind, time of caching, time of expiration, key, subkey, number of aliases
+# and size of object
+_RECORD = struct.Struct("<BddqqHI")
+# Key and subkey of alias
+_ALIAS = struct.Struct("<qq")
+
+
+class Record(typing.NamedTuple):
+    kind: int
+    ts: float
+    expires: float
+    key: int
+    subkey: int
+    obj: TLObject
+    # Other (key, subkey), record is cached under
+    aliases: typing.Tuple[typing.Tuple[int, int], ...] = ()
+
+
+def get_path(tg_id: int) -> str:
+    """Get path of snapshot of account"""
+    return os.path.join(os.path.expanduser("~"), ".legacy", "tl_cache", f"{tg_id}.bin")
+
+
+def pack(records: typing.Iterable[Record]) -> bytes:
+    """
+    Serialize records
+    :param records: Records to serialize
+    :return: Snapshot
+    """
+    result = [_HEADER.pack(_MAGIC, VERSION, LAYER)]
+    for record in records:
+        try:
+            obj = bytes(record.obj)
+        except Exception:
+            logger.debug("Can't serialize %s", type(record.obj), exc_info=True)
+            continue
+
+        result += [
+            _RECORD.pack(
+                record.kind,
+                record.ts,
+                record.expires,
+                record.key,
+                record.subkey,
+                len(record.aliases),
+                len(obj),
+            ),
+            *(_ALIAS.pack(*alias) for alias in record.aliases),
+            obj,
+        ]
+
+    return b"".join(result)
+
+
+def unpack(data: bytes) -> typing.Iterator[Record]:
+    """
+    Deserialize records, which are not expired yet
+    :param data: Snapshot
+    :return: Records. Nothing, if snapshot is made by other version or layer
+    """
+    if len(data) < _HEADER.size or _HEADER.unpack_from(data) != (
+        _MAGIC,
+        VERSION,
+        LAYER,
+    ):
+        logger.debug("Snapshot is outdated, ignoring it")
+        return
+
+    now = time.time()
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        kind, ts, expires, key, subkey, aliases_count, size = _RECORD.unpack_from(
+            data,
+            offset,
+        )
+        offset += _RECORD.size
+        aliases = tuple(
+            _ALIAS.unpack_from(data, offset + i * _ALIAS.size)
+            for i in range(aliases_count)
+        )
+        offset += aliases_count * _ALIAS.size + size
+        if expires <= now or offset > len(data):
+            continue
+
+        try:
+            obj = BinaryReader(data[offset - size : offset]).tgread_object()
+        except Exception:
+            logger.debug("Can't restore record of %s", key, exc_info=True)
+            continue
+
+        yield Record(kind, ts, expires, key, subkey, obj, aliases)
+
+
+def save(path: str, data: bytes):
+    """
+    Write snapshot atomically. It contains access hashes,
+    so only the owner can read it
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    temp = f"{path}.tmp"
+    with contextlib.suppress(FileNotFoundError):
+        # Mode is applied only to new file
+        os.unlink(temp)
+
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp, path)
+
+
+def load(path: str) -> bytes:
+    """Read snapshot or get empty one, if there is none"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return b""
@@ -0,0 +1,508 @@
+"""Compiles tags of watchers and commands into predicate chains"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import logging
+import re
+import typing
+import weakref
+
+from legacytl.tl.types import Message
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+ALL_TAGS = [
+    "no_commands",
+    "only_commands",
+    "out",
+    "in",
+    "only_messages",
+    "editable",
+    "no_media",
+    "only_media",
+    "only_photos",
+    "only_videos",
+    "only_audios",
+    "only_docs",
+    "only_stickers",
+    "only_inline",
+    "only_channels",
+    "only_groups",
+    "only_pm",
+    "no_pm",
+    "no_channels",
+    "no_groups",
+    "no_inline",
+    "no_stickers",
+    "no_docs",
+    "no_audios",
+    "no_videos",
+    "no_photos",
+    "no_forwards",
+    "no_reply",
+    "no_mention",
+    "mention",
+    "only_reply",
+    "only_forwards",
+    "startswith",
+    "endswith",
+    "contains",
+    "regex",
+    "filter",
+    "from_id",
+    "chat_id",
+    "max_concurrency",
+    "overflow",
+    "thumb_url",
+    "alias",
+    "aliases",
+]
+
+# Tags, which depend only on the event itself. They are evaluated once per event
+# and represented as bits, so checking all of them for watcher is a single `&`
+SIMPLE_TAGS: typing.Dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+    "out": lambda m: getattr(m, "out", True),
+    "in": lambda m: not getattr(m, "out", True),
+    "only_messages": lambda m: isinstance(m, Message),
+    "editable": (
+        lambda m: not getattr(m, "out", False)
+        and not getattr(m, "fwd_from", False)
+        and not getattr(m, "sticker", False)
+        and not getattr(m, "via_bot_id", False)
+    ),
+    "no_media": lambda m: not isinstance(m, Message) or not getattr(m, "media", False),
+    "only_media": lambda m: isinstance(m, Message) and getattr(m, "media", False),
+    "only_photos": lambda m: utils.mime_type(m).startswith("image/"),
+    "only_videos": lambda m: utils.mime_type(m).startswith("video/"),
+    "only_audios": lambda m: utils.mime_type(m).startswith("audio/"),
+    "only_stickers": lambda m: getattr(m, "sticker", False),
+    "only_docs": lambda m: getattr(m, "document", False),
+    "only_inline": lambda m: getattr(m, "via_bot_id", False),
+    "only_channels": lambda m: (
+        getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
+    ),
+    "no_channels": lambda m: not getattr(m, "is_channel", False),
+    "no_groups": (
+        lambda m: not getattr(m, "is_group", False)
+        or getattr(m, "is_private", False)
+        or getattr(m, "is_channel", False)
+    ),
+    "only_groups": (
+        lambda m: getattr(m, "is_group", False)
+        or not getattr(m, "is_private", False)
+        and not getattr(m, "is_channel", False)
+    ),
+    "no_pm": lambda m: not getattr(m, "is_private", False),
+    "only_pm": lambda m: getattr(m, "is_private", False),
+    "no_inline": lambda m: not getattr(m, "via_bot_id", False),
+    "no_stickers": lambda m: not getattr(m, "sticker", False),
+    "no_docs": lambda m: not getattr(m, "document", False),
+    "no_audios": lambda m: not utils.mime_type(m).startswith("audio/"),
+    "no_videos": lambda m: not utils.mime_type(m).startswith("video/"),
+    "no_photos": lambda m: not utils.mime_type(m).startswith("image/"),
+    "no_forwards": lambda m: not getattr(m, "fwd_from", False),
+    "no_reply": lambda m: not getattr(m, "reply_to_msg_id", False),
+    "only_forwards": lambda m: getattr(m, "fwd_from", False),
+    "only_reply": lambda m: getattr(m, "reply_to_msg_id", False),
+    "mention": lambda m: getattr(m, "mentioned", False),
+    "no_mention": lambda m: not getattr(m, "mentioned", False),
+}
+
+TAG_BITS = {tag: 1 << i for i, tag in enumerate(SIMPLE_TAGS)}
+_SIMPLE_CHECKS = [(TAG_BITS[tag], predicate) for tag, predicate in SIMPLE_TAGS.items()]
+
+Check = typing.Callable[["EventContext"], typing.Any]  # type: ignore  # noqa: F821
+# Text tags, which can be matched by `TextMatcher`, e.g. ("contains", "hello")
+TextKey = typing.Tuple[str, typing.Union[str, re.Pattern]]
+
+
+def evaluate_tags(ctx: "EventContext", mask: int) -> int:  # type: ignore  # noqa: F821
+    """
+    Evaluate simple tags of event, which are not evaluated yet
+    :param ctx: Event context
+    :param mask: Bits of tags to evaluate
+    :return: Bits of all passed tags, evaluated so far
+    """
+    if missing := mask & ~ctx.tags_evaluated:
+        m = ctx.message
+        for bit, predicate in _SIMPLE_CHECKS:
+            if missing & bit and predicate(m):
+                ctx.tags_passed |= bit
+
+        ctx.tags_evaluated |= missing
+
+    return ctx.tags_passed
+
+
+def _normalize_chat_id(chat_id: typing.Any) -> typing.Any:
+    return int(str(chat_id)[4:]) if str(chat_id).startswith("-100") else chat_id
+
+
+class TagFilter:
+    """Tags of watcher or command, compiled into predicate chain"""
+
+    def __init__(self, func: typing.Callable):
+        self.mask = 0
+        self.no_commands = bool(getattr(func, "no_commands", False))
+        self.only_commands = bool(getattr(func, "only_commands", False))
+        # Tags with values, which are checked against the event one by one
+        self.checks: typing.List[typing.Tuple[str, Check]] = []
+        # Text tags, which are matched for all watchers at once instead
+        self.text: typing.List[TextKey] = []
+        # Whole chain in `ALL_TAGS` order. Items are either bits of simple tags
+        # or checks
+        self._chain: typing.List[typing.Tuple[str, typing.Union[int, Check]]] = []
+        self.chat_id: typing.Optional[int] = None
+        self.from_id: typing.Optional[int] = None
+
+        for tag in ALL_TAGS[2:]:
+            if not (value := getattr(func, tag, False)):
+                continue
+
+            if tag in TAG_BITS:
+                self.mask |= TAG_BITS[tag]
+                self._chain.append((tag, TAG_BITS[tag]))
+            elif check := self._compile(tag, value, func):
+                self._chain.append((tag, check))
+                if key := self._text_key(tag, value):
+                    self.text.append(key)
+                else:
+                    self.checks.append((tag, check))
+
+    def _compile(
+        self,
+        tag: str,
+        value: typing.Any,
+        func: typing.Callable,
+    ) -> typing.Optional[Check]:
+        if tag == "startswith":
+            return lambda ctx: (
+                isinstance(ctx.message, Message)
+                and ctx.message.raw_text.startswith(value)
+            )
+
+        if tag == "endswith":
+            return lambda ctx: (
+                isinstance(ctx.message, Message)
+                and ctx.message.raw_text.endswith(value)
+            )
+
+        if tag == "contains":
+            return lambda ctx: (
+                isinstance(ctx.message, Message) and value in ctx.message.raw_text
+            )
+
+        if tag == "regex":
+            try:
+                pattern = re.compile(value)
+            except (re.error, TypeError):
+                logger.error("Invalid regex %s of %s, it will never match", value, func)
+                return lambda _: False
+
+            return lambda ctx: (
+                isinstance(ctx.message, Message)
+                and pattern.search(ctx.message.raw_text)
+            )
+
+        if tag == "filter":
+            return lambda ctx: callable(value) and value(ctx.message)
+
+        if tag == "from_id":
+            if isinstance(value, int):
+                self.from_id = value
+
+            return lambda ctx: getattr(ctx.message, "sender_id", None) == value
+
+        if tag == "chat_id":
+            chat_id = _normalize_chat_id(value)
+            if isinstance(chat_id, int):
+                self.chat_id = chat_id
+
+            return lambda ctx: ctx.chat_id == chat_id
+
+        return None
+
+    @staticmethod
+    def _text_key(tag: str, value: typing.Any) -> typing.Optional[TextKey]:
+        if tag in {"startswith", "endswith", "contains"} and isinstance(value, str):
+            return tag, value
+
+        if tag == "regex":
+            try:
+                return tag, re.compile(value)
+            except (re.error, TypeError):
+                return None
+
+        return None
+
+    def check(self, ctx: "EventContext") -> bool:  # type: ignore  # noqa: F821
+        """
+        Check tags with values, assuming simple and text tags are already passed
+        """
+        return all(check(ctx) for _, check in self.checks)
+
+    def failed(
+        self,
+        ctx: "EventContext",  # type: ignore  # noqa: F821
+    ) -> typing.Optional[str]:
+        """
+        Check all tags except for command ones
+        :return: The first tag, which is not passed, or `None`
+        """
+        passed = evaluate_tags(ctx, self.mask)
+        for tag, check in self._chain:
+            if not (passed & check if isinstance(check, int) else check(ctx)):
+                return tag
+
+        return None
+
+
+_filters: "weakref.WeakKeyDictionary[typing.Callable, TagFilter]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def compile_tags(func: typing.Callable) -> TagFilter:
+    """Get compiled tags of function. Result is cached until function is collected"""
+    key = getattr(func, "__func__", func)
+    try:
+        return _filters[key]
+    except KeyError:
+        _filters[key] = result = TagFilter(func)
+        return result
+    except TypeError:
+        # Not weak referenceable
+        return TagFilter(func)
+
+
+class TextMatcher:
+    """
+    Matches text against text tags of all watchers at once.
+    Literals are bucketed by their first or last character, and regexes
+    are prefiltered with a single combined pattern, because most messages
+    match none of them
+    """
+
+    def __init__(self, keys: typing.Iterable[TextKey]):
+        # Each distinct text tag is represented as a bit of match result
+        self.bits: typing.Dict[TextKey, int] = {}
+        self._startswith: typing.Dict[str, typing.List[typing.Tuple[str, int]]] = {}
+        self._endswith: typing.Dict[str, typing.List[typing.Tuple[str, int]]] = {}
+        self._contains: typing.List[typing.Tuple[str, int]] = []
+        # Regexes, which can be safely combined into one pattern
+        self._combinable: typing.List[typing.Tuple[re.Pattern, int]] = []
+        self._separate: typing.List[typing.Tuple[re.Pattern, int]] = []
+        self._combined: typing.Optional[re.Pattern] = None
+
+        for key in keys:
+            if key in self.bits:
+                continue
+
+            self.bits[key] = bit = 1 << len(self.bits)
+            tag, value = key
+            if tag == "startswith":
+                self._startswith.setdefault(value[:1], []).append((value, bit))
+            elif tag == "endswith":
+                self._endswith.setdefault(value[-1:], []).append((value, bit))
+            elif tag == "contains":
+                self._contains.append((value, bit))
+            elif self._is_combinable(value):
+                self._combinable.append((value, bit))
+            else:
+                self._separate.append((value, bit))
+
+        if self._combinable:
+            try:
+                self._combined = re.compile(
+                    "|".join(
+                        f"(?:{pattern.pattern})" for pattern, _ in self._combinable
+                    )
+                )
+            except re.error:
+                self._separate += self._combinable
+                self._combinable = []
+
+    @staticmethod
+    def _is_combinable(pattern: re.Pattern) -> bool:
+        # Flags can't be set for the part of pattern, group names may clash
+        # and group references would point to the wrong groups after combining
+        return (
+            isinstance(pattern.pattern, str)
+            and not pattern.flags & ~re.UNICODE
+            and not pattern.groupindex
+            and not re.search(r"\\[1-9]|\(\?P=|\(\?\(", pattern.pattern)
+        )
+
+    def mask(self, keys: typing.Iterable[TextKey]) -> int:
+        """Get bits of text tags"""
+        result = 0
+        for key in keys:
+            result |= self.bits[key]
+
+        return result
+
+    def match(self, text: str) -> int:
+        """
+        Scan text once
+        :return: Bits of text tags, which are passed
+        """
+        matches = 0
+
+        # Empty literals are bucketed under the empty string and always match
+        for first in {"", text[:1]}:
+            for prefix, bit in self._startswith.get(first, ()):
+                if text.startswith(prefix):
+                    matches |= bit
+
+        for last in {"", text[-1:]}:
+            for suffix, bit in self._endswith.get(last, ()):
+                if text.endswith(suffix):
+                    matches |= bit
+
+        for literal, bit in self._contains:
+            if literal in text:
+                matches |= bit
+
+        if self._combined is not None and self._combined.search(text):
+            for pattern, bit in self._combinable:
+                if pattern.search(text):
+                    matches |= bit
+
+        for pattern, bit in self._separate:
+            if pattern.search(text):
+                matches |= bit
+
+        return matches
+
+
+class Watcher:
+    """Registered watcher with everything needed to dispatch it precomputed"""
+
+    __slots__ = (
+        "func",
+        "filter",
+        "modname",
+        "module",
+        "position",
+        "text_mask",
+        "max_concurrency",
+        "overflow",
+    )
+
+    def __init__(self, func: typing.Callable, position: int):
+        self.func = func
+        self.filter = compile_tags(func)
+        self.modname = str(func.__self__.__class__.strings["name"])
+        self.module = func.__self__.__module__
+        self.position = position
+        self.max_concurrency: typing.Optional[int] = getattr(
+            func, "max_concurrency", None
+        )
+        self.overflow: typing.Optional[str] = getattr(func, "overflow", None)
+        # Bits of text tags in registry's `TextMatcher`
+        self.text_mask = 0
+
+
+class WatcherRegistry:
+    """
+    Watchers, indexed by their cheap discriminators: simple tags, `chat_id`
+    and `from_id`. Event is checked only against watchers, which could match it
+    """
+
+    def __init__(self):
+        self._funcs: typing.List[typing.Callable] = []
+        self._generic: typing.List[Watcher] = []
+        self._by_chat: typing.Dict[int, typing.List[Watcher]] = {}
+        self._by_sender: typing.Dict[int, typing.List[Watcher]] = {}
+        # Union of simple tags of all watchers
+        self._mask = 0
+        # Passed simple tags -> generic watchers, which require only them
+        self._candidates: typing.Dict[int, typing.List[Watcher]] = {}
+        self._matcher = TextMatcher([])
+
+    def __len__(self) -> int:
+        return len(self._funcs)
+
+    def rebuild(self, funcs: typing.Iterable[typing.Callable]):
+        """Recompile registry, if the set of watchers has changed"""
+        if (funcs := list(funcs)) == self._funcs:
+            return
+
+        self._funcs = funcs
+        self._generic = []
+        self._by_chat = {}
+        self._by_sender = {}
+        self._mask = 0
+        self._candidates = {}
+        text_keys = []
+
+        for position, func in enumerate(funcs):
+            try:
+                watcher = Watcher(func, position)
+            except Exception:
+                logger.exception("Can't compile tags of watcher %s", func)
+                continue
+
+            self._mask |= watcher.filter.mask
+            text_keys += watcher.filter.text
+            if watcher.filter.chat_id is not None:
+                self._by_chat.setdefault(watcher.filter.chat_id, []).append(watcher)
+            elif watcher.filter.from_id is not None:
+                self._by_sender.setdefault(watcher.filter.from_id, []).append(watcher)
+            else:
+                self._generic.append(watcher)
+
+        self._matcher = TextMatcher(text_keys)
+        for watcher in self._generic + [
+            watcher
+            for watchers in [*self._by_chat.values(), *self._by_sender.values()]
+            for watcher in watchers
+        ]:
+            watcher.text_mask = self._matcher.mask(watcher.filter.text)
+
+    def candidates(
+        self,
+        ctx: "EventContext",  # type: ignore  # noqa: F821
+    ) -> typing.List[Watcher]:
+        """
+        Get watchers, whose simple tags, text tags, `chat_id` and `from_id` match
+        the event, in registration order. Other tags are left to be checked
+        by caller
+        :param ctx: Event context
+        """
+        passed = evaluate_tags(ctx, self._mask) & self._mask
+        if (generic := self._candidates.get(passed)) is None:
+            generic = self._candidates[passed] = [
+                watcher
+                for watcher in self._generic
+                if not watcher.filter.mask & ~passed
+            ]
+
+        indexed = [
+            watcher
+            for watcher in self._by_chat.get(ctx.chat_id, [])
+            + self._by_sender.get(getattr(ctx.message, "sender_id", None), [])
+            if not watcher.filter.mask & ~passed
+        ]
+
+        watchers = (
+            sorted(generic + indexed, key=lambda watcher: watcher.position)
+            if indexed
+            else generic
+        )
+
+        if not any(watcher.text_mask for watcher in watchers):
+            return watchers
+
+        matches = (
+            self._matcher.match(ctx.message.raw_text or "")
+            if isinstance(ctx.message, Message)
+            else 0
+        )
+        return [watcher for watcher in watchers if not watcher.text_mask & ~matches]
@@ -5,17 +5,28 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
+import atexit
 import collections
+import contextlib
+import contextvars
+import io
 import ujson
 import logging
+import os
+import threading
 import time
 
 import typing
+from pathlib import Path
 
+from legacytl import events
+from legacytl.errors import FloodWaitError
 from legacytl.errors.rpcerrorlist import ChannelsTooMuchError
 from legacytl.tl.types import Message, User
 
 from . import main, utils
+from ._asset_cache import AssetCache
+from ._sqlite_storage import SQLiteStorage
 from .pointers import (
     BaseSerializingMiddlewareDict,
     BaseSerializingMiddlewareList,
@@ -39,28 +50,257 @@ __all__ = [
 
 logger = logging.getLogger(__name__)
 
+# Journal is compacted into a full snapshot once it outgrows this size (bytes)
+JOURNAL_MAX_SIZE = 1024 * 1024
+# ...and at least once per this interval (seconds) if it has any records
+JOURNAL_COMPACT_INTERVAL = 5 * 60
+# Changes are coalesced and written at most once per this window (seconds).
+# Can be overridden with `db_save_window` key in config.json
+SAVE_WINDOW = 1
+# Failed writes are retried with exponential backoff up to this delay (seconds)
+MAX_RETRY_DELAY = 60
+# Changes made within this interval (seconds) are grouped into one revision
+REVISION_INTERVAL = 3
+# Rollback history is bounded both by number of revisions and their total size
+MAX_REVISIONS = 15
+MAX_REVISIONS_SIZE = 4 * 1024 * 1024
+
 
 class NoAssetsChannel(Exception):
     """Raised when trying to read/store asset with no asset channel present"""
 
 
+# Telegram doesn't allow more media in one album
+ALBUM_SIZE = 10
+UPLOAD_CONCURRENCY = 4
+FLOOD_RETRIES = 3
+
+
+class Revision:
+    """Reversible diff of database changes, made within a short period of time"""
+
+    def __init__(self):
+        self.ts = time.time()
+        # (owner, key) -> serialized value before the change
+        # or `None` if the key didn't exist
+        self.changes: typing.Dict[typing.Tuple[str, str], typing.Optional[str]] = {}
+        self.size = 0
+
+    def __repr__(self) -> str:
+        return f"Revision(ts={self.ts}, changes={len(self.changes)}, size={self.size})"
+
+
+class _Transaction:
+    """Keys, changed within transaction of the current task"""
+
+    __slots__ = ("changes", "open")
+
+    def __init__(self):
+        self.changes: typing.Set[typing.Tuple[str, str]] = set()
+        # Tasks, spawned within transaction, inherit it and must not write
+        # into it after it's committed
+        self.open = True
+
+
 class Database(dict):
     def __init__(self, client: CustomTelegramClient):
         super().__init__()
         self._client: CustomTelegramClient = client
         self._next_revision_call: int = 0
-        self._revisions: typing.List[dict] = []
+        self._revisions: typing.Deque[Revision] = collections.deque()
+        self._revisions_size: int = 0
         self._assets: int = None
+        self._asset_cache: typing.Optional[AssetCache] = None
         self._me: User = None
         self._saving_task: asyncio.Future = None
+        self._compaction_task: asyncio.Future = None
+        self._journal: typing.Optional[typing.TextIO] = None
+        self._journal_size: int = 0
+        # (owner, key, serialized value)
+        self._pending_records: typing.List[typing.Tuple[str, str, str]] = []
+        self._pending_writes: int = 0
+        self._undetached_writes: int = 0
+        # (owner, key) of keys, removed bypassing `set`. Only SQLite storage
+        # can remove single keys, JSON one requires snapshot for this
+        self._pending_removals: typing.List[typing.Tuple[str, str]] = []
+        # (records, whether snapshot is required, removals)
+        self._detached: typing.Deque[
+            typing.Tuple[
+                typing.List[typing.Tuple[str, str, str]],
+                bool,
+                typing.List[typing.Tuple[str, str]],
+            ]
+        ] = collections.deque()
+        self._snapshot_required: bool = False
+        self._save_window: float = SAVE_WINDOW
+        # Number of failed writes in a row, defines the retry delay
+        self._failed_flushes: int = 0
+        self._last_flush: typing.Optional[float] = None
+        self._write_lock = threading.Lock()
+        # Owners, modified bypassing `set`, which must be validated before save
+        self._dirty_owners: typing.Set[str] = set()
+        # (owner, key) -> the last serialized value, which is stored on disk.
+        # Values are usually mutated in place before `set`, so this is
+        # the only reliable source of their previous state
+        self._persisted: typing.Dict[typing.Tuple[str, str], str] = {}
+        # Transaction is bound to the task, so writes of other tasks, made
+        # while it awaits, are not deferred along with it
+        self._transaction: contextvars.ContextVar[typing.Optional[_Transaction]] = (
+            contextvars.ContextVar(f"db_transaction_{id(self)}", default=None)
+        )
+        self._sqlite: typing.Optional[SQLiteStorage] = None
+        # Owners, which exist in SQLite storage, but are not loaded yet
+        self._unloaded_owners: typing.Set[str] = set()
+        self._listeners: typing.List[
+            typing.Callable[[str, typing.Optional[str]], None]
+        ] = []
 
     def __repr__(self):
         return object.__repr__(self)
 
+    def __missing__(self, owner: str) -> dict:
+        if owner not in self._unloaded_owners:
+            raise KeyError(owner)
+
+        return self._load_owner(owner)
+
+    def __contains__(self, owner: str) -> bool:
+        return super().__contains__(owner) or owner in self._unloaded_owners
+
+    def __iter__(self) -> typing.Iterator[str]:
+        self._load_all()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self._unloaded_owners)
+
+    def keys(self) -> typing.KeysView:
+        self._load_all()
+        return super().keys()
+
+    def values(self) -> typing.ValuesView:
+        self._load_all()
+        return super().values()
+
+    def items(self) -> typing.ItemsView:
+        self._load_all()
+        return super().items()
+
+    def copy(self) -> dict:
+        self._load_all()
+        return super().copy()
+
+    def __delitem__(self, owner: str):
+        self._ensure_loaded(owner)
+        super().__delitem__(owner)
+        self._notify(owner)
+
+    def pop(self, owner: str, *args) -> typing.Any:
+        self._ensure_loaded(owner)
+        value = super().pop(owner, *args)
+        self._notify(owner)
+        return value
+
+    def clear(self):
+        self._unloaded_owners.clear()
+        super().clear()
+        self._notify(None)
+
+    def __setitem__(self, owner: str, value: typing.Any):
+        self._unloaded_owners.discard(owner)
+        self._dirty_owners.add(owner)
+        super().__setitem__(owner, value)
+        self._notify(owner)
+
+    def setdefault(self, owner: str, default: typing.Any = None) -> typing.Any:
+        self._ensure_loaded(owner)
+        self._dirty_owners.add(owner)
+        return super().setdefault(owner, default)
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        self._unloaded_owners.difference_update(changes)
+        self._dirty_owners.update(changes)
+        super().update(changes)
+        for owner in changes:
+            self._notify(owner)
+
+    def _load_owner(self, owner: str) -> dict:
+        self._unloaded_owners.discard(owner)
+        value = self._deserialize_owner(owner, self._sqlite.load(owner))
+        super().__setitem__(owner, value)
+        return value
+
+    def _deserialize_owner(self, owner: str, serialized: typing.Dict[str, str]) -> dict:
+        for key, value in serialized.items():
+            self._persisted[(owner, key)] = value
+
+        return {key: ujson.loads(value) for key, value in serialized.items()}
+
+    def _ensure_loaded(self, owner: str):
+        if owner in self._unloaded_owners:
+            self._load_owner(owner)
+
+    def _load_all(self):
+        if not self._unloaded_owners:
+            return
+
+        loaded = self._sqlite.load_all()
+        for owner in self._unloaded_owners:
+            super().__setitem__(
+                owner,
+                self._deserialize_owner(owner, loaded.get(owner, {})),
+            )
+
+        self._unloaded_owners.clear()
+
+    def _owner(self, owner: str) -> dict:
+        """Get keys of owner, creating them if necessary, without marking it dirty"""
+        self._ensure_loaded(owner)
+        return super().setdefault(owner, {})
+
+    def add_listener(
+        self,
+        listener: typing.Callable[[typing.Optional[str], typing.Optional[str]], None],
+    ):
+        """
+        Subscribe to database changes, made through `set`, pointers, transactions
+        and rollbacks. Listener is called synchronously right after the change
+        :param listener: Callable, which accepts owner and key of changed value.
+            Key is `None` if the whole owner was replaced, both are `None`
+            if the whole database was
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(
+        self,
+        listener: typing.Callable[[typing.Optional[str], typing.Optional[str]], None],
+    ):
+        """Unsubscribe from database changes"""
+        with contextlib.suppress(ValueError):
+            self._listeners.remove(listener)
+
+    def _notify(self, owner: typing.Optional[str], key: typing.Optional[str] = None):
+        for listener in self._listeners:
+            try:
+                listener(owner, key)
+            except Exception:
+                logger.exception("Database change listener %s failed", listener)
+
     async def init(self):
         """Asynchronous initialization unit"""
         self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
+        self._journal_file = main.BASE_PATH / f"config-{self._client.tg_id}.journal"
+        self._save_window = float(main.get_config_key("db_save_window") or SAVE_WINDOW)
+
+        if main.get_config_key("db_backend") == "sqlite":
+            self._sqlite = SQLiteStorage(
+                main.BASE_PATH / f"config-{self._client.tg_id}.db"
+            )
+
         self.read()
+        self._compaction_task = asyncio.ensure_future(self._compaction_loop())
+        atexit.register(self.flush)
 
         try:
             self._assets, _ = await utils.asset_channel(
@@ -70,6 +310,15 @@ class Database(dict):
                 avatar=f"{main.ASSETS_PATH}",
                 _folder="legacy",
             )
+            self._asset_cache = AssetCache(self._client.tg_id)
+            self._client.add_event_handler(
+                self._on_asset_changed,
+                events.MessageEdited(chats=self._assets),
+            )
+            self._client.add_event_handler(
+                self._on_asset_changed,
+                events.MessageDeleted(chats=self._assets),
+            )
         except ChannelsTooMuchError:
             self._assets = None
             logger.error(
@@ -82,6 +331,51 @@ class Database(dict):
 
     def read(self):
         """Read database and stores it in self"""
+        if self._sqlite:
+            self._read_sqlite()
+            return
+
+        replayed = self._read_json()
+        self._remember_persisted()
+        if replayed:
+            self.save()
+
+    def _remember_persisted(self):
+        """Remember serialized values of all loaded keys as the persisted ones"""
+        self._persisted = {
+            (owner, key): ujson.dumps(value)
+            for owner, values in super().items()
+            if isinstance(values, dict)
+            for key, value in values.items()
+        }
+
+    def _read_sqlite(self):
+        """Discover stored owners, so they can be loaded on first access"""
+        self._unloaded_owners = self._sqlite.owners()
+        if self._unloaded_owners or not (
+            self._db_file.exists() or self._journal_file.exists()
+        ):
+            return
+
+        # One-shot migration from JSON storage
+        self._read_json()
+        self._remember_persisted()
+        self._sqlite.replace(SQLiteStorage.rows(self))
+        self._dirty_owners.clear()
+
+        with contextlib.suppress(FileNotFoundError):
+            self._db_file.rename(self._db_file.with_name(f"{self._db_file.name}.bak"))
+
+        with contextlib.suppress(FileNotFoundError):
+            self._journal_file.unlink()
+
+        logger.info("Database migrated to SQLite, old one is kept as backup")
+
+    def _read_json(self) -> int:
+        """
+        Read JSON snapshot and replay the journal on top of it
+        :return: Number of replayed journal records
+        """
         try:
             self.update(**ujson.loads(self._db_file.read_text()))
         except ValueError:
@@ -89,11 +383,294 @@ class Database(dict):
         except FileNotFoundError:
             logger.debug("Database file not found, creating new one...")
 
-    def process_db_autofix(self, db: dict) -> bool:
-        if not utils.is_serializable(db):
+        return self._replay_journal()
+
+    def _replay_journal(self) -> int:
+        """
+        Apply records from write-ahead journal on top of the snapshot
+        :return: Number of replayed records
+        """
+        try:
+            lines = self._journal_file.read_text().splitlines()
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        for line in lines:
+            if not line:
+                continue
+
+            try:
+                record = ujson.loads(line)
+                owner, key, value = record["o"], record["k"], record["v"]
+            except (ValueError, KeyError, TypeError):
+                # Most likely the process was killed in the middle of write,
+                # so everything after this record is unreliable
+                logger.warning("Database journal is broken, dropping its tail")
+                break
+
+            self._owner(owner)[key] = value
+            replayed += 1
+
+        logger.debug("Replayed %s database journal records", replayed)
+        return replayed
+
+    @property
+    def pending_writes(self) -> int:
+        """Number of changes, which are not written to disk yet"""
+        return self._pending_writes
+
+    @property
+    def last_flush(self) -> typing.Optional[float]:
+        """Time of the last successful write to disk or `None` if there was none"""
+        return self._last_flush
+
+    def _flush_delay(self) -> float:
+        return min(self._save_window * 2**self._failed_flushes, MAX_RETRY_DELAY)
+
+    def _mark_dirty(self):
+        """Count the change as pending and schedule a coalesced write"""
+        self._pending_writes += 1
+        self._undetached_writes += 1
+        self._schedule_flush()
+
+    def _current_transaction(self) -> typing.Optional[_Transaction]:
+        if (transaction := self._transaction.get()) is not None and transaction.open:
+            return transaction
+
+        return None
+
+    def _schedule_flush(self):
+        if self._current_transaction():
+            # Will be scheduled once transaction is committed
+            return
+
+        if self._saving_task and not self._saving_task.done():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            # Called outside of event loop, so there is nothing to defer write to
+            self.flush()
+            return
+
+        self._saving_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Failed write is retried until it succeeds, so changes don't wait
+        # for the next unrelated `set`
+        while True:
+            await asyncio.sleep(self._flush_delay())
+
+            writes = 0
+            try:
+                if not (writes := self._detach()):
+                    return
+
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    self._write_detached,
+                )
+            except Exception:
+                self._write_failed(writes)
+                continue
+
+            self._flushed(writes)
+            return
+
+    def flush(self) -> bool:
+        """
+        Synchronously write all pending changes to disk
+        :return: `True` on success, otherwise `False`
+        """
+        writes = 0
+        try:
+            writes = self._detach()
+            self._write_detached()
+        except Exception:
+            self._write_failed(writes)
+            self._retry_flush()
             return False
 
-        for key, value in db.copy().items():
+        self._flushed(writes)
+        return True
+
+    def _retry_flush(self):
+        """Schedule retry of failed synchronous write, if there is a loop to run it"""
+        if self._saving_task and not self._saving_task.done():
+            return
+
+        with contextlib.suppress(RuntimeError):
+            self._saving_task = asyncio.get_running_loop().create_task(
+                self._delayed_flush()
+            )
+
+    def _detach(self) -> int:
+        """
+        Detach pending changes, so the new ones can be collected during the write
+        :return: Number of coalesced writes
+        """
+        if (
+            not self._pending_records
+            and not self._pending_removals
+            and not self._snapshot_required
+        ):
+            writes, self._undetached_writes = self._undetached_writes, 0
+            return writes
+
+        snapshot = self._snapshot_required or (
+            not self._sqlite
+            and self._journal_size
+            + sum(len(value) for _, _, value in self._pending_records)
+            > JOURNAL_MAX_SIZE
+        )
+
+        if snapshot and self._sqlite:
+            # Unloaded owners can't change, so only changed keys
+            # of loaded ones are written instead of the whole storage
+            self._check_integrity()
+            self._collect_mutated()
+            snapshot = False
+        elif snapshot:
+            # Storage is rewritten completely, so nothing must be left behind
+            self._load_all()
+            self._check_integrity()
+
+        self._detached.append(
+            (self._pending_records, snapshot, self._pending_removals)
+        )
+        self._pending_records = []
+        self._pending_removals = []
+        self._snapshot_required = False
+
+        writes, self._undetached_writes = self._undetached_writes, 0
+        return writes
+
+    def _write_detached(self):
+        """Write detached changes to disk in order. Safe to run in worker thread"""
+        with self._write_lock:
+            while self._detached:
+                # Changes are dropped only once they are written,
+                # so SQLite storage can retry them after failure
+                records, snapshot, removed = self._detached[0]
+                # ujson doesn't release GIL while dumping, so the snapshot is
+                # consistent even if event loop mutates database meanwhile
+                if snapshot:
+                    self._atomic_write(self._db_file, ujson.dumps(self, indent=4))
+                    self._truncate_journal()
+                elif self._sqlite:
+                    self._sqlite.write(
+                        (
+                            (str(owner), str(key), value)
+                            for owner, key, value in records
+                        ),
+                        [(str(owner), str(key)) for owner, key in removed],
+                    )
+                else:
+                    self._append_journal(records)
+
+                self._detached.popleft()
+
+    def _write_failed(self, writes: int):
+        """Keep failed changes pending, so they are written with the next snapshot"""
+        self._failed_flushes += 1
+        logger.exception(
+            "Database save failed! Retrying in %ss",
+            self._flush_delay(),
+        )
+        # Some value might have been broken in-place, so validate everything
+        self._dirty_owners.update(super().keys())
+        self._snapshot_required = True
+        if not self._sqlite:
+            # Snapshot includes all of them
+            self._detached.clear()
+        self._undetached_writes += writes
+
+    def _flushed(self, writes: int):
+        self._failed_flushes = 0
+        self._last_flush = time.time()
+        if not writes:
+            return
+
+        self._pending_writes = max(self._pending_writes - writes, 0)
+        logger.debug(
+            "Flushed %s database writes, %s pending",
+            writes,
+            self._pending_writes,
+        )
+
+    @staticmethod
+    def _atomic_write(path: Path, data: str):
+        """Write file so it's never left half-written, even on power loss"""
+        temp = path.with_name(f"{path.name}.tmp")
+        with temp.open("w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp, path)
+
+    def _append_journal(self, records: typing.List[typing.Tuple[str, str, str]]):
+        """Append delta records to the write-ahead journal"""
+        if self._journal is None:
+            self._journal = self._journal_file.open("a", encoding="utf-8")
+            self._journal_size = self._journal.tell()
+
+        data = "".join(
+            '{{"o":{},"k":{},"v":{}}}\n'.format(
+                ujson.dumps(str(owner)),
+                ujson.dumps(str(key)),
+                value,
+            )
+            for owner, key, value in records
+        )
+        self._journal.write(data)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_size += len(data)
+
+    def _truncate_journal(self):
+        """Drop journal records, which are already included in snapshot"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        self._journal_file.write_text("")
+        self._journal_size = 0
+
+    async def _compaction_loop(self):
+        """Periodically merges the journal into the full snapshot"""
+        while True:
+            await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+            if self._journal_size or self._pending_writes:
+                self.save()
+
+    def process_db_autofix(self, db: dict) -> bool:
+        """
+        Validate database and drop malformed keys.
+        For this database only owners, modified bypassing `set`, are checked,
+        because values written with `set` are validated on write
+        :param db: Database to check
+        :return: `True` if database can be saved, otherwise `False`
+        """
+        if db is self:
+            owners = [owner for owner in self._dirty_owners if owner in self]
+            if not all(utils.is_serializable({owner: self[owner]}) for owner in owners):
+                return False
+
+            self._dirty_owners.clear()
+        else:
+            if not utils.is_serializable(db):
+                return False
+
+            owners = list(db)
+
+        for key in owners:
+            value = db[key]
             if not isinstance(key, (str, int)):
                 logger.warning(
                     "DbAutoFix: Dropped key %s, because it is not string or int",
@@ -112,7 +689,7 @@ class Database(dict):
                 )
                 continue
 
-            for subkey in value:
+            for subkey in list(value):
                 if not isinstance(subkey, (str, int)):
                     del db[key][subkey]
                     logger.warning(
@@ -127,71 +704,389 @@ class Database(dict):
 
         return True
 
+    def _collect_mutated(self) -> int:
+        """
+        Add keys of loaded owners, changed in place without `set`, to pending
+        records, and removed ones - to pending removals.
+        Keys, which can't be serialized, are left for integrity check
+        :return: Number of changed and removed keys
+        """
+        changed = 0
+        for owner, values in list(super().items()):
+            if not isinstance(values, dict):
+                self._dirty_owners.add(owner)
+                self._snapshot_required = True
+                continue
+
+            for key, value in list(values.items()):
+                try:
+                    serialized = ujson.dumps(value)
+                except Exception:
+                    self._dirty_owners.add(owner)
+                    self._snapshot_required = True
+                    continue
+
+                if self._persisted.get((owner, key)) != serialized:
+                    self._remember_revision(owner, key)
+                    self._persisted[(owner, key)] = serialized
+                    self._pending_records.append((owner, key, serialized))
+                    changed += 1
+
+        removed = set()
+        for owner, key in list(self._persisted):
+            if owner in self._unloaded_owners:
+                continue
+
+            if not isinstance(values := super().get(owner), dict) or key not in values:
+                self._remember_revision(owner, key)
+                del self._persisted[(owner, key)]
+                removed.add((owner, key))
+
+        if removed:
+            # Removal is written before records, so the older records of removed
+            # keys must not resurrect them
+            self._pending_records = [
+                record
+                for record in self._pending_records
+                if (record[0], record[1]) not in removed
+            ]
+            self._pending_removals += removed
+
+        return changed + len(removed)
+
+    def save_mutated(self) -> int:
+        """
+        Persist values, which were changed in place without `set`.
+        Only keys, serialized value of which differs from the stored one,
+        are written, so it's much cheaper than the full snapshot
+        :return: Number of changed and removed keys
+        """
+        changed = self._collect_mutated()
+        if self._pending_removals and not self._sqlite:
+            # Journal can't express removal
+            self._snapshot_required = True
+
+        for _ in range(changed):
+            self._mark_dirty()
+
+        if self._snapshot_required and not changed:
+            self._mark_dirty()
+
+        return changed
+
     def save(self) -> bool:
-        """Save database"""
-        if not self.process_db_autofix(self):
-            try:
-                rev = self._revisions.pop()
-                while not self.process_db_autofix(rev):
-                    rev = self._revisions.pop()
-            except IndexError:
-                raise RuntimeError(
-                    "Can't find revision to restore broken database from "
-                    "database is most likely broken and will lead to problems, "
-                    "so its save is forbidden."
-                )
+        """Schedule full database snapshot write"""
+        self._snapshot_required = True
+        self._mark_dirty()
+        return True
 
-            self.clear()
-            self.update(**rev)
+    def _check_integrity(self):
+        """
+        Ensure database can be saved, otherwise restore keys, which can't,
+        to their last persisted values
+        """
+        if self.process_db_autofix(self):
+            return
 
+        if broken := self._restore_broken():
+            logger.error(
+                "Restored broken database keys %s to their last saved values",
+                ", ".join(broken),
+            )
+
+        if not self.process_db_autofix(self):
             raise RuntimeError(
-                "Rewriting database to the last revision because new one destructed it"
+                "Can't restore broken database, "
+                "database is most likely broken and will lead to problems, "
+                "so its save is forbidden."
             )
 
-        if self._next_revision_call < time.time():
-            self._revisions += [dict(self)]
-            self._next_revision_call = time.time() + 3
+    def _restore_value(self, owner: str, key: str):
+        """Restore key to its last persisted value or drop it, if it wasn't saved"""
+        if (old := self._persisted.get((owner, key))) is not None:
+            self._owner(owner)[key] = ujson.loads(old)
+        else:
+            self._ensure_loaded(owner)
+            if isinstance(super().get(owner), dict):
+                self[owner].pop(key, None)
 
-        while len(self._revisions) > 15:
-            self._revisions.pop()
-        try:
-            self._db_file.write_text(ujson.dumps(self, indent=4))
-        except Exception:
-            logger.exception("Database save failed!")
-            return False
+        self._notify(owner, key)
 
-        return True
+    def _restore_broken(self) -> typing.List[str]:
+        """
+        Restore keys of dirty owners, which can't be serialized
+        :return: Names of restored keys
+        """
+        broken = []
+        for owner in list(self._dirty_owners):
+            if not isinstance(values := super().get(owner), dict):
+                if utils.is_serializable(values):
+                    # Autofix drops it
+                    continue
+
+                super().__setitem__(owner, {})
+                for persisted_owner, key in list(self._persisted):
+                    if persisted_owner == owner:
+                        self._restore_value(owner, key)
+
+                broken.append(str(owner))
+                continue
+
+            for key in list(values):
+                if not utils.is_serializable({key: values[key]}):
+                    self._restore_value(owner, key)
+                    broken.append(f"{owner}.{key}")
+
+        return broken
+
+    def _remember_revision(self, owner: str, key: str):
+        """Store the persisted value of key, so the change can be reverted"""
+        if not self._revisions or self._next_revision_call < time.time():
+            self._revisions.append(Revision())
+            self._next_revision_call = time.time() + REVISION_INTERVAL
+
+        revision = self._revisions[-1]
+        if (owner, key) in revision.changes:
+            # Only the value before the first change of revision matters
+            return
+
+        old = self._persisted.get((owner, key))
+        size = len(str(owner)) + len(str(key)) + len(old or "")
+        revision.changes[(owner, key)] = old
+        revision.size += size
+        self._revisions_size += size
+
+        while len(self._revisions) > 1 and (
+            len(self._revisions) > MAX_REVISIONS
+            or self._revisions_size > MAX_REVISIONS_SIZE
+        ):
+            self._revisions_size -= self._revisions.popleft().size
+
+    def revisions(self) -> typing.List[dict]:
+        """
+        Get available database revisions
+        :return: List of revisions info, starting from the most recent one.
+            Pass its position + 1 to `rollback` to revert the database to
+            the state before this revision
+        """
+        return [
+            {
+                "time": revision.ts,
+                "keys": list(revision.changes),
+                "size": revision.size,
+            }
+            for revision in reversed(self._revisions)
+        ]
+
+    def rollback(self, n: int = 1) -> int:
+        """
+        Revert the last `n` database revisions.
+        Existing pointers are not updated and must be recreated
+        :param n: Number of revisions to revert
+        :return: Number of actually reverted revisions
+        """
+        if n < 1:
+            raise ValueError(f"Invalid number of revisions: {n}")
+
+        reverted = 0
+        # (owner, key) -> value before the oldest reverted revision
+        restored: typing.Dict[typing.Tuple[str, str], typing.Optional[str]] = {}
+        while self._revisions and reverted < n:
+            revision = self._revisions.pop()
+            self._revisions_size -= revision.size
+            restored.update(revision.changes)
+            reverted += 1
+
+        if restored:
+            # Reverted values are written after the pending ones,
+            # which must not override them
+            self._pending_records = [
+                record
+                for record in self._pending_records
+                if (record[0], record[1]) not in restored
+            ]
+
+        for (owner, key), old in restored.items():
+            if old is not None:
+                self._owner(owner)[key] = ujson.loads(old)
+                self._persisted[(owner, key)] = old
+                self._pending_records.append((owner, key, old))
+            else:
+                self._ensure_loaded(owner)
+                if isinstance(super().get(owner), dict):
+                    self[owner].pop(key, None)
+
+                self._persisted.pop((owner, key), None)
+                self._pending_removals.append((owner, key))
+
+            self._notify(owner, key)
+
+        if reverted:
+            logger.debug("Reverted %s database revisions", reverted)
+            # Don't mix further changes into already reverted revision
+            self._next_revision_call = 0
+            self.save()
+
+        return reverted
 
     async def store_asset(self, message: Message) -> int:
         """
         Save assets
         returns asset_id as integer
         """
+        return (await self.store_assets([message]))[0]
+
+    async def store_assets(
+        self,
+        assets: typing.Iterable[typing.Union[Message, typing.Any]],
+    ) -> typing.List[int]:
+        """
+        Save several assets at once
+        Local files and bytes are uploaded concurrently, then all files are sent
+        as albums. Other files (URLs, documents, photos, input media) are sent
+        as is. Messages are sent concurrently one by one
+        :param assets: Messages or files (anything, that `send_file` accepts)
+        :return: Asset ids in the same order as assets
+        """
         if not self._assets:
             raise NoAssetsChannel("Tried to save asset to non-existing asset channel")
 
-        return (
-            (await self._client.send_message(self._assets, message)).id
-            if isinstance(message, Message)
-            else (
-                await self._client.send_message(
+        assets = list(assets)
+        ids: typing.List[int] = [None] * len(assets)
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def upload(asset: typing.Any) -> typing.Any:
+            async with semaphore:
+                return await self._flood_safe(lambda: self._client.upload_file(asset))
+
+        async def send_message(i: int):
+            async with semaphore:
+                ids[i] = (
+                    await self._flood_safe(
+                        lambda: self._client.send_message(self._assets, assets[i])
+                    )
+                ).id
+
+        files = [i for i, asset in enumerate(assets) if not isinstance(asset, Message)]
+        uploads = [i for i in files if self._is_local_file(assets[i])]
+        uploaded, _ = await asyncio.gather(
+            asyncio.gather(*[upload(assets[i]) for i in uploads]),
+            asyncio.gather(
+                *[
+                    send_message(i)
+                    for i, asset in enumerate(assets)
+                    if isinstance(asset, Message)
+                ]
+            ),
+        )
+
+        handles = dict(zip(uploads, uploaded))
+        # Albums are sent in order, so assets get ascending ids
+        for album in utils.chunks(
+            [(i, handles.get(i, assets[i])) for i in files],
+            ALBUM_SIZE,
+        ):
+            handles = [handle for _, handle in album]
+            sent = await self._flood_safe(
+                lambda: self._client.send_file(
                     self._assets,
-                    file=message,
+                    file=handles if len(handles) > 1 else handles[0],
                     force_document=True,
                 )
-            ).id
+            )
+            for (i, _), message in zip(
+                album,
+                sent if isinstance(sent, list) else [sent],
+            ):
+                ids[i] = message.id
+
+        return ids
+
+    @staticmethod
+    def _is_local_file(asset: typing.Any) -> bool:
+        """Check if asset is bytes, file-like object or path of existing file"""
+        return isinstance(asset, (bytes, bytearray, io.IOBase, Path)) or (
+            isinstance(asset, str) and os.path.isfile(asset)
         )
 
+    @staticmethod
+    async def _flood_safe(
+        request: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        for attempt in range(FLOOD_RETRIES + 1):
+            try:
+                return await request()
+            except FloodWaitError as e:
+                if attempt == FLOOD_RETRIES:
+                    raise
+
+                logger.warning(
+                    "Got FloodWait while storing assets, waiting %ss",
+                    e.seconds,
+                )
+                await asyncio.sleep(e.seconds + 1)
+
+    async def _on_asset_changed(
+        self,
+        event: typing.Union[events.MessageEdited.Event, events.MessageDeleted.Event],
+    ):
+        for asset_id in getattr(event, "deleted_ids", None) or [event.message.id]:
+            self._asset_cache.invalidate(asset_id)
+
     async def fetch_asset(self, asset_id: int) -> typing.Optional[Message]:
         """Fetch previously saved asset by its asset_id"""
+        return (await self.fetch_assets([asset_id]))[0]
+
+    async def fetch_assets(
+        self,
+        asset_ids: typing.Iterable[int],
+    ) -> typing.List[typing.Optional[Message]]:
+        """
+        Fetch several previously saved assets at once
+        Assets, which are cached locally, are not requested at all, the rest
+        of them are requested in one call
+        :param asset_ids: Asset ids
+        :return: Assets in the same order as ids, `None` for missing ones
+        """
         if not self._assets:
             raise NoAssetsChannel(
                 "Tried to fetch asset from non-existing asset channel"
             )
 
-        asset = await self._client.get_messages(self._assets, ids=[asset_id])
+        asset_ids = list(asset_ids)
+        assets = {
+            asset_id: message
+            for asset_id in set(asset_ids)
+            if (message := self._asset_cache.get_message(asset_id, self._client))
+        }
+
+        if missing := [
+            asset_id for asset_id in dict.fromkeys(asset_ids) if asset_id not in assets
+        ]:
+            for message in await self._client.get_messages(self._assets, ids=missing):
+                if message:
+                    self._asset_cache.put_message(message)
+                    assets[message.id] = message
+
+        return [assets.get(asset_id) for asset_id in asset_ids]
+
+    async def download_asset(self, asset_id: int) -> typing.Optional[bytes]:
+        """
+        Download media of previously saved asset
+        Media is cached locally, so repeated downloads don't hit Telegram
+        :param asset_id: Asset id
+        :return: Media contents or `None` if asset doesn't exist or has no media
+        """
+        if not (message := await self.fetch_asset(asset_id)) or not message.media:
+            return None
+
+        if (data := await self._asset_cache.get_media(message)) is not None:
+            return data
 
-        return asset[0] if asset else None
+        if (data := await message.download_media(bytes)) is not None:
+            await self._asset_cache.put_media(message, data)
+
+        return data
 
     def get(
         self,
@@ -207,29 +1102,138 @@ class Database(dict):
 
     def set(self, owner: str, key: str, value: JSONSerializable) -> bool:
         """Set database key"""
-        if not utils.is_serializable(owner):
+        if not isinstance(owner, (str, int)) and not utils.is_serializable(owner):
             raise RuntimeError(
                 "Attempted to write object to "
                 f"{owner=} ({type(owner)=}) of database. It is not "
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(key):
+        if not isinstance(key, (str, int)) and not utils.is_serializable(key):
             raise RuntimeError(
                 "Attempted to write object to "
                 f"{key=} ({type(key)=}) of database. It is not "
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(value):
+        if transaction := self._current_transaction():
+            transaction.changes.add((owner, key))
+            self._owner(owner)[key] = value
+            self._notify(owner, key)
+            return True
+
+        try:
+            # Serializing the record is the validation itself
+            serialized = ujson.dumps(value)
+        except Exception:
             raise RuntimeError(
                 "Attempted to write object of "
                 f"{key=} ({type(value)=}) to database. It is not "
                 "JSON-serializable value which will cause errors"
             )
 
-        super().setdefault(owner, {})[key] = value
-        return self.save()
+        self._remember_revision(owner, key)
+        self._persisted[(owner, key)] = serialized
+        self._owner(owner)[key] = value
+        self._pending_records.append((owner, key, serialized))
+        self._mark_dirty()
+        self._notify(owner, key)
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Defer validation and persistence of changes until the block exits,
+        so multiple `set` calls and pointer mutations result in a single
+        write per key. Changes are visible immediately. If the block raises,
+        its changes are reverted to the persisted values and nothing is written.
+        Nested transactions are part of the outermost one.
+        Transaction belongs to the current task, writes of other tasks
+        are not deferred
+
+        >>> with db.transaction():
+        ...     for rule in expired:
+        ...         pointer.remove(rule)
+        """
+        if self._current_transaction():
+            yield self
+            return
+
+        transaction = _Transaction()
+        token = self._transaction.set(transaction)
+        try:
+            yield self
+        except BaseException:
+            self._abort(transaction, token)
+            raise
+
+        if broken := self._commit(transaction, token):
+            raise RuntimeError(
+                "Attempted to write non JSON-serializable values to "
+                f"{', '.join(broken)} within transaction. They were reverted"
+            )
+
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        """Asynchronous version of `transaction`"""
+        with self.transaction():
+            yield self
+
+    def _commit(
+        self,
+        transaction: _Transaction,
+        token: contextvars.Token,
+    ) -> typing.List[str]:
+        """
+        Validate and persist keys, changed within transaction
+        :return: Names of keys, which were reverted, because they are broken
+        """
+        self._close(transaction, token)
+        broken = []
+
+        for owner, key in transaction.changes:
+            try:
+                value = self[owner][key]
+            except KeyError:
+                # Dropped directly from the dict, nothing to write
+                continue
+
+            try:
+                serialized = ujson.dumps(value)
+            except Exception:
+                # Restore the last valid value, as `set` would have never
+                # written the broken one
+                self._restore_value(owner, key)
+                broken.append(f"{owner}.{key}")
+                continue
+
+            self._remember_revision(owner, key)
+            self._persisted[(owner, key)] = serialized
+            self._pending_records.append((owner, key, serialized))
+            self._mark_dirty()
+
+        if self._undetached_writes:
+            self._schedule_flush()
+
+        return broken
+
+    def _abort(self, transaction: _Transaction, token: contextvars.Token):
+        """Revert keys, changed within interrupted transaction"""
+        self._close(transaction, token)
+        for owner, key in transaction.changes:
+            self._restore_value(owner, key)
+
+        if transaction.changes:
+            logger.debug(
+                "Reverted %s keys of interrupted transaction",
+                len(transaction.changes),
+            )
+
+    def _close(self, transaction: _Transaction, token: contextvars.Token):
+        transaction.open = False
+        with contextlib.suppress(ValueError):
+            # Block might be exited in other context than it was entered in
+            self._transaction.reset(token)
 
     def pointer(
         self,
@@ -23,8 +23,10 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
+import collections.abc
 import contextlib
 import copy
+import functools
 import inspect
 import logging
 import re
@@ -37,6 +39,15 @@ from legacytl.errors import FloodWaitError, RPCError
 from legacytl.tl.types import Message
 
 from . import main, security, utils
+from ._grep import GrepFilter
+from ._scheduler import (
+    MAX_QUEUED_PER_WATCHER,
+    MAX_RUNNING,
+    MAX_RUNNING_PER_WATCHER,
+    ChatLanes,
+    WatcherPool,
+)
+from ._watchers import ALL_TAGS, compile_tags  # noqa: F401
 from .database import Database
 from .loader import Modules
 from .tl_cache import CustomTelegramClient
@@ -46,50 +57,209 @@ logger = logging.getLogger(__name__)
 # Keys for layout switch
 ru_keys = 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,'
 en_keys = "`qwertyuiop[]asdfghjkl;'zxcvbnm,./~@#$%^&QWERTYUIOP{}ASDFGHJKL:\"|ZXCVBNM<>?"
-ALL_TAGS = [
-    "no_commands",
-    "only_commands",
-    "out",
-    "in",
-    "only_messages",
-    "editable",
-    "no_media",
-    "only_media",
-    "only_photos",
-    "only_videos",
-    "only_audios",
-    "only_docs",
-    "only_stickers",
-    "only_inline",
-    "only_channels",
-    "only_groups",
-    "only_pm",
-    "no_pm",
-    "no_channels",
-    "no_groups",
-    "no_inline",
-    "no_stickers",
-    "no_docs",
-    "no_audios",
-    "no_videos",
-    "no_photos",
-    "no_forwards",
-    "no_reply",
-    "no_mention",
-    "mention",
-    "only_reply",
-    "only_forwards",
-    "startswith",
-    "endswith",
-    "contains",
-    "regex",
-    "filter",
-    "from_id",
-    "chat_id",
-    "thumb_url",
-    "alias",
-    "aliases",
-]
+LAYOUT_SWITCH = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+# Database keys of main module, which routing of events depends on
+ROUTING_KEYS = {
+    "command_prefix",
+    "blacklist_chats",
+    "whitelist_chats",
+    "whitelist_modules",
+    "disabled_watchers",
+    "no_nickname",
+    "nonickcmds",
+    "nonickusers",
+    "nonickchats",
+    "grep",
+}
+# `| grep` clause of command, which filters its output
+GREP_ARGS = re.compile(r".+\| ?grep (.+)")
+GREP_CLAUSE = re.compile(r"\| ?grep.+")
+GREP_ESCAPED = re.compile(r"\|\| ?grep")
+
+
+def _freeze(value: typing.Any) -> typing.FrozenSet[typing.Any]:
+    return frozenset(
+        item for item in (value or []) if isinstance(item, collections.abc.Hashable)
+    )
+
+
+class RoutingTable:
+    """
+    Snapshot of database settings, which routing of events depends on.
+    Dispatcher rebuilds it only when one of `ROUTING_KEYS` changes
+    """
+
+    def __init__(self, db: Database, tg_id: int):
+        key = main.__name__
+        prefixes = db.get(key, "command_prefix", None)
+        if not isinstance(prefixes, dict):
+            # Migrate from the single prefix format
+            prefixes = {f"{tg_id}": prefixes or "."}
+            db.set(key, "command_prefix", prefixes)
+
+        self.prefixes: typing.Dict[str, str] = dict(prefixes)
+        self.own_prefix: str = self.prefixes.get(f"{tg_id}", ".")
+        self._translated: typing.Dict[str, str] = {}
+
+        self.blacklist_chats = _freeze(db.get(key, "blacklist_chats", []))
+        self.whitelist_chats = _freeze(db.get(key, "whitelist_chats", []))
+        self.whitelist_modules = _freeze(db.get(key, "whitelist_modules", []))
+        self.disabled_watchers: typing.Dict[str, typing.FrozenSet[typing.Any]] = {
+            module: _freeze(chats)
+            for module, chats in db.get(key, "disabled_watchers", {}).items()
+        }
+        self.no_nickname: bool = db.get(key, "no_nickname", False)
+        self.nonickcmds = _freeze(db.get(key, "nonickcmds", []))
+        self.nonickusers = _freeze(db.get(key, "nonickusers", []))
+        self.nonickchats = _freeze(db.get(key, "nonickchats", []))
+        self.grep: bool = db.get(key, "grep", False)
+
+    def prefix(self, sender_id: int, out: bool) -> str:
+        """Get command prefix of sender"""
+        return self.prefixes.get(f"{sender_id}", self.own_prefix if out else ".")
+
+    def translate(self, text: str) -> str:
+        """Switch keyboard layout of short text, e.g. prefix"""
+        if text not in self._translated:
+            self._translated[text] = text.translate(LAYOUT_SWITCH)
+
+        return self._translated[text]
+
+
+class EventContext:
+    """
+    Event, wrapped once and shared by commands, watchers and tag filters,
+    so it's censored and checked for prefix only once
+    """
+
+    def __init__(
+        self,
+        event: typing.Union[events.NewMessage, events.ChatAction, Message],
+        routing: RoutingTable,
+    ):
+        self.event = event
+        self.routing = routing
+        self.message = utils.censor(
+            event if isinstance(event, Message) else getattr(event, "message", event)
+        )
+        self.chat_id: int = utils.get_chat_id(self.message)
+        self.sender_id: typing.Optional[int] = getattr(event, "sender_id", None)
+        # Prefix and command token, if message looks like a command
+        self.prefix: typing.Optional[str] = None
+        self.command: typing.Optional[str] = None
+        # Message starts with doubled prefix, so it's an escaped command
+        self.escaped: bool = False
+        # Bits of simple tags, evaluated for this event and passed by it
+        self.tags_evaluated: int = 0
+        self.tags_passed: int = 0
+        # Result of command resolution, `None` until it's done
+        self.resolved: typing.Union[
+            None,
+            bool,
+            typing.Tuple[Message, str, str, callable],
+        ] = None
+        self._parse()
+
+    def _parse(self):
+        message = self.message
+        if not isinstance(getattr(message, "message", None), str) or not (
+            text := message.message
+        ):
+            return
+
+        prefix = self.routing.prefix(self.sender_id, getattr(self.event, "out", False))
+        translated = self.routing.translate(prefix)
+
+        if (
+            message.out
+            and len(text) > len(prefix) * 2
+            and (
+                text.startswith(prefix * 2)
+                and any(s != prefix for s in text)
+                or text.startswith(translated * 2)
+                and any(s != translated for s in text)
+            )
+            and prefix != "s"  # To avoid bug with setprefix command
+        ):
+            self.prefix = prefix
+            self.escaped = True
+            return
+
+        if text.startswith(translated) and translated != prefix:
+            message.text = message.text.translate(LAYOUT_SWITCH)
+        elif not text.startswith(prefix):
+            return
+
+        if len(text) == len(prefix) or not (
+            tokens := text[len(prefix) :].strip().split(maxsplit=1)
+        ):
+            return  # Message is just the prefix
+
+        self.prefix = prefix
+        self.command = tokens[0]
+
+
+class RawHandlers:
+    """
+    Registered raw handlers, indexed by update types they handle.
+    Handlers of concrete update type are resolved once through its MRO
+    and cached until handlers change
+    """
+
+    def __init__(self):
+        # Handler id -> handler, in registration order
+        self._handlers: typing.Dict[str, callable] = {}
+        self._by_type: typing.Dict[type, typing.Dict[str, callable]] = {}
+        self._resolved: typing.Dict[type, typing.Tuple[callable, ...]] = {}
+
+    def __iter__(self) -> typing.Iterator[callable]:
+        return iter(list(self._handlers.values()))
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def __contains__(self, handler: callable) -> bool:
+        return getattr(handler, "id", None) in self._handlers
+
+    def append(self, handler: callable):
+        """Register raw handler"""
+        if handler in self:
+            self.remove(handler)
+
+        self._handlers[handler.id] = handler
+        for update in handler.updates:
+            self._by_type.setdefault(update, {})[handler.id] = handler
+
+        self._resolved.clear()
+
+    def remove(self, handler: callable):
+        """Unregister raw handler"""
+        if self._handlers.pop(getattr(handler, "id", None), None) is None:
+            raise ValueError(f"Raw handler {handler} is not registered")
+
+        for update in handler.updates:
+            if (handlers := self._by_type.get(update)) is not None:
+                handlers.pop(handler.id, None)
+                if not handlers:
+                    del self._by_type[update]
+
+        self._resolved.clear()
+
+    def resolve(self, update_type: type) -> typing.Tuple[callable, ...]:
+        """Get handlers of update type in registration order"""
+        try:
+            return self._resolved[update_type]
+        except KeyError:
+            pass
+
+        ids = set()
+        for cls in update_type.__mro__:
+            ids.update(self._by_type.get(cls, ()))
+
+        self._resolved[update_type] = handlers = tuple(
+            handler for id_, handler in self._handlers.items() if id_ in ids
+        )
+        return handlers
 
 
 class CommandDispatcher:
@@ -107,6 +277,7 @@ class CommandDispatcher:
         self.security = security.SecurityManager(client, db)
 
         self.check_security = self.security.check
+        self.check_security_many = self.security.check_many
         self._me = self._client.legacy_me.id
         self._cached_usernames = [
             (
@@ -120,172 +291,119 @@ class CommandDispatcher:
             getattr(self._client.legacy_me, "usernames", None) or []
         )
 
-        self.raw_handlers = []
+        self.raw_handlers = RawHandlers()
+
+        self.watcher_pool = WatcherPool(
+            int(main.get_config_key("watchers_concurrency") or MAX_RUNNING),
+            int(
+                main.get_config_key("watchers_concurrency_per_watcher")
+                or MAX_RUNNING_PER_WATCHER
+            ),
+            int(main.get_config_key("watchers_queue_size") or MAX_QUEUED_PER_WATCHER),
+        )
+        # Commands of the same chat run in order, commands of different chats
+        # run in parallel
+        self.command_lanes = ChatLanes()
+
+        self._routing: typing.Optional[RoutingTable] = None
+        self._db.add_listener(self._on_db_change)
+
+    def _on_db_change(self, owner: typing.Optional[str], key: typing.Optional[str]):
+        if owner in {None, main.__name__} and (key is None or key in ROUTING_KEYS):
+            self._routing = None
+
+    @property
+    def routing(self) -> RoutingTable:
+        """Snapshot of current routing settings"""
+        if self._routing is None:
+            self._routing = RoutingTable(self._db, self.client.tg_id)
+
+        return self._routing
 
     def _handle_grep(self, message: Message) -> Message:
+        if "grep" not in message.raw_text:
+            return message
+
         # Allow escaping grep with double stick
         if "||grep" in message.text or "|| grep" in message.text:
-            message.raw_text = re.sub(r"\|\| ?grep", "| grep", message.raw_text)
-            message.text = re.sub(r"\|\| ?grep", "| grep", message.text)
-            message.message = re.sub(r"\|\| ?grep", "| grep", message.message)
+            message.raw_text = GREP_ESCAPED.sub("| grep", message.raw_text)
+            message.text = GREP_ESCAPED.sub("| grep", message.text)
+            message.message = GREP_ESCAPED.sub("| grep", message.message)
             return message
 
         if getattr(message, "legacy_grepped", False):
             return message
 
-        grep = False
-        if not re.search(r".+\| ?grep (.+)", message.raw_text):
+        if not (args := GREP_ARGS.search(message.raw_text)) or not (
+            grep := GrepFilter.parse(args.group(1))
+        ):
             return message
 
-        grep = re.search(r".+\| ?grep (.+)", message.raw_text).group(1)
-        message.text = re.sub(r"\| ?grep.+", "", message.text)
-        message.raw_text = re.sub(r"\| ?grep.+", "", message.raw_text)
-        message.message = re.sub(r"\| ?grep.+", "", message.message)
-
-        ungrep = False
-
-        if re.search(r"-v (.+)", grep):
-            ungrep = re.search(r"-v (.+)", grep).group(1)
-            grep = re.sub(r"(.+) -v .+", r"\g<1>", grep)
-
-        grep = utils.escape_html(grep).strip() if grep else False
-        ungrep = utils.escape_html(ungrep).strip() if ungrep else False
-
-        old_edit = message.edit
-        old_reply = message.reply
-        old_respond = message.respond
-
-        def process_text(text: str) -> str:
-            nonlocal grep, ungrep
-            res = []
-
-            for line in text.split("\n"):
-                if (
-                    grep
-                    and grep in utils.remove_html(line)
-                    and (not ungrep or ungrep not in utils.remove_html(line))
-                ):
-                    res.append(
-                        utils.remove_html(line, escape=True).replace(
-                            grep, f"<u>{grep}</u>"
-                        )
-                    )
-
-                if not grep and ungrep and ungrep not in utils.remove_html(line):
-                    res.append(utils.remove_html(line, escape=True))
+        message.text = GREP_CLAUSE.sub("", message.text)
+        message.raw_text = GREP_CLAUSE.sub("", message.raw_text)
+        message.message = GREP_CLAUSE.sub("", message.message)
 
-            cont = (
-                (f"contain <b>{grep}</b>" if grep else "")
-                + (" and" if grep and ungrep else "")
-                + ((" do not contain <b>" + ungrep + "</b>") if ungrep else "")
-            )
+        return grep.apply(message)
 
-            if res:
-                text = f"<i>💬 Lines that {cont}:</i>\n" + "\n".join(res)
-            else:
-                text = f"💬 <i>No lines that {cont}</i>"
-
-            return text
-
-        async def my_edit(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
-            return await old_edit(text, *args, **kwargs)
-
-        async def my_reply(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
-            return await old_reply(text, *args, **kwargs)
-
-        async def my_respond(text, *args, **kwargs):
-            text = process_text(text)
-            kwargs["parse_mode"] = "HTML"
-            kwargs.setdefault("reply_to", utils.get_topic(message))
-            return await old_respond(text, *args, **kwargs)
-
-        message.edit = my_edit
-        message.reply = my_reply
-        message.respond = my_respond
-        message.legacy_grepped = True
+    def _wrap(
+        self,
+        event: typing.Union[EventContext, events.NewMessage, events.ChatAction],
+    ) -> EventContext:
+        if isinstance(event, EventContext):
+            return event
 
-        return message
+        return EventContext(event, self.routing)
 
     async def _handle_command(
         self,
-        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        event: typing.Union[EventContext, events.NewMessage, events.MessageDeleted],
         watcher: bool = False,
     ) -> typing.Union[bool, typing.Tuple[Message, str, str, callable]]:
-        if not hasattr(event, "message") or not hasattr(event.message, "message"):
-            return False
-
-        key = main.__name__
-        default = "."
-        prefix = self._db.get(key, "command_prefix", default)
-        if prefix:
-            if isinstance(prefix, str):
-                self._db.set(key, "command_prefix", {f"{self.client.tg_id}": prefix})
-        set_default_prefix = (
-            self._db.get(key, "command_prefix").get(f"{self.client.tg_id}")
-            if event.out
-            else default
-        )
-        prefix = self._db.get(key, "command_prefix", {}).get(
-            f"{event.sender_id}", set_default_prefix
-        )
-
-        change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
-        message = utils.censor(event.message)
-
-        if not event.message.message:
-            return False
-
-        if (
-            message.out
-            and len(message.message) > len(prefix) * 2
-            and (
-                message.message.startswith(prefix * 2)
-                and any(s != prefix for s in message.message)
-                or message.message.startswith(str.translate(prefix * 2, change))
-                and any(s != str.translate(prefix, change) for s in message.message)
-            )
-            and prefix != "s"  # To avoid bug with setprefix command
-        ):
-            # Allow escaping commands using .'s
-            if not watcher:
+        ctx = self._wrap(event)
+        if ctx.resolved is None:
+            ctx.resolved = await self._resolve_command(ctx)
+
+        if not ctx.resolved:
+            if ctx.escaped and not watcher:
+                # Allow escaping commands using .'s
+                message = ctx.message
                 await message.edit(
-                    message.message[len(prefix) :],
+                    message.message[len(ctx.prefix) :],
                     parse_mode=lambda s: (
                         s,
                         utils.relocate_entities(message.entities, -1, message.message)
                         or (),
                     ),
                 )
-            return False
 
-        if (
-            event.message.message.startswith(str.translate(prefix, change))
-            and str.translate(prefix, change) != prefix
-        ):
-            message.text = str.translate(message.text, change)
-        elif not event.message.message.startswith(prefix):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-        chat_id = utils.get_chat_id(message)
+        message, prefix, txt, func = ctx.resolved
+        if ctx.routing.grep and not watcher:
+            message = self._handle_grep(message)
+
+        return message, prefix, txt, func
 
-        if chat_id in blacklist_chats or (
-            whitelist_chats and chat_id not in whitelist_chats
-        ):
+    async def _resolve_command(
+        self,
+        ctx: EventContext,
+    ) -> typing.Union[bool, typing.Tuple[Message, str, str, callable]]:
+        if not ctx.command:
             return False
 
-        if not message.message or len(message.message) == len(prefix):
-            return False  # Message is just the prefix
+        event = ctx.event
+        message = ctx.message
+        routing = ctx.routing
+        prefix = ctx.prefix
+        command = ctx.command
+        chat_id = ctx.chat_id
 
-        initiator = getattr(event, "sender_id", 0)
+        if chat_id in routing.blacklist_chats or (
+            routing.whitelist_chats and chat_id not in routing.whitelist_chats
+        ):
+            return False
 
-        command = message.message[len(prefix) :].strip().split(maxsplit=1)[0]
+        initiator = ctx.sender_id or 0
         tag = command.split("@", maxsplit=1)
 
         if len(tag) == 2:
@@ -310,12 +428,11 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not routing.no_nickname
+            and command not in routing.nonickcmds
+            and initiator not in routing.nonickusers
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
+            and chat_id not in routing.nonickchats
         ):
             return False
 
@@ -331,47 +448,79 @@ class CommandDispatcher:
         message.message = prefix + txt + message.message[len(prefix + command) :]
 
         if (
-            f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
-            or whitelist_modules
-            and f"{chat_id}.{func.__self__.__module__}" not in whitelist_modules
+            f"{str(chat_id)}.{func.__self__.__module__}" in routing.blacklist_chats
+            or routing.whitelist_modules
+            and f"{chat_id}.{func.__self__.__module__}"
+            not in routing.whitelist_modules
         ):
             return False
 
-        if await self._handle_tags(event, func):
+        # Tags of command itself may ask whether the event is a command
+        ctx.resolved = message, prefix, txt, func
+        if await self._handle_tags(ctx, func):
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
-            message = self._handle_grep(message)
-
-        return message, prefix, txt, func
+        return ctx.resolved
 
     async def handle_raw(self, event: events.Raw):
         """Handle raw events."""
-        for handler in self.raw_handlers:
-            if isinstance(event, tuple(handler.updates)):
-                try:
-                    await handler(event)
-                except Exception as e:
-                    logger.exception("Error in raw handler %s: %s", handler.id, e)
+        if not (handlers := self.raw_handlers.resolve(type(event))):
+            return
+
+        if len(handlers) == 1:
+            await self._run_raw_handler(handlers[0], event)
+            return
+
+        await asyncio.gather(
+            *[self._run_raw_handler(handler, event) for handler in handlers]
+        )
+
+    @staticmethod
+    async def _run_raw_handler(handler: callable, event: events.Raw):
+        try:
+            await handler(event)
+        except Exception as e:
+            logger.exception("Error in raw handler %s: %s", handler.id, e)
+
+    async def handle_event(
+        self,
+        event: typing.Union[events.NewMessage, events.ChatAction],
+    ):
+        """
+        Single entry point for new messages, edits and chat actions.
+        Event is wrapped once and shared by watchers and commands
+        """
+        ctx = EventContext(event, self.routing)
+
+        if not isinstance(event, events.MessageEdited.Event):
+            await self.handle_incoming(ctx)
+
+        if isinstance(event, events.MessageEdited.Event) or (
+            isinstance(event, events.NewMessage.Event)
+            and not getattr(ctx.message, "fwd_from", None)
+        ):
+            await self.handle_command(ctx)
 
     async def handle_command(
         self,
-        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        event: typing.Union[EventContext, events.NewMessage, events.MessageDeleted],
     ):
         """Handle all commands"""
-        message = await self._handle_command(event)
+        ctx = self._wrap(event)
+        # Position in lane is taken before anything is awaited, so commands
+        # of the same chat run in order of arrival
+        self.command_lanes.submit(
+            ctx.chat_id,
+            functools.partial(self._run_command, ctx),
+        )
+
+    async def _run_command(self, ctx: EventContext):
+        message = await self._handle_command(ctx)
         if not message:
             return
 
         message, _, _, func = message
-
-        asyncio.ensure_future(
-            self.future_dispatcher(
-                func,
-                message,
-                self.command_exc,
-            )
-        )
+        await self.future_dispatcher(func, message, self.command_exc)
 
     async def command_exc(self, _, message: Message):
         """Handle command exceptions."""
@@ -434,14 +583,14 @@ class CommandDispatcher:
 
     async def _handle_tags(
         self,
-        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        event: typing.Union[EventContext, events.NewMessage, events.MessageDeleted],
         func: callable,
     ) -> bool:
         return bool(await self._handle_tags_ext(event, func))
 
     async def _handle_tags_ext(
         self,
-        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        event: typing.Union[EventContext, events.NewMessage, events.MessageDeleted],
         func: callable,
     ) -> typing.Optional[str]:
         """
@@ -450,110 +599,30 @@ class CommandDispatcher:
         :param func: The function to handle.
         :return: The reason for the tag to fail.
         """
-        m = event if isinstance(event, Message) else getattr(event, "message", event)
-
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "is_private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "is_private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "is_private", False),
-            "only_pm": lambda: getattr(m, "is_private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": (
-                lambda: utils.get_chat_id(m)
-                == (
-                    func.chat_id
-                    if not str(func.chat_id).startswith("-100")
-                    else int(str(func.chat_id)[4:])
-                )
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
+        ctx = self._wrap(event)
+        tags = compile_tags(func)
 
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
-            )
-        )
+        if tags.no_commands and await self._handle_command(ctx, watcher=True):
+            return "no_commands"
+
+        if tags.only_commands and not await self._handle_command(ctx, watcher=True):
+            return "only_commands"
+
+        return tags.failed(ctx)
 
     async def handle_incoming(
         self,
-        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        event: typing.Union[EventContext, events.NewMessage, events.MessageDeleted],
     ):
         """Handle all incoming messages"""
-        message = utils.censor(getattr(event, "message", event))
+        ctx = self._wrap(event)
+        message = ctx.message
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-        chat_id = utils.get_chat_id(message)
+        routing = ctx.routing
+        blacklist_chats = routing.blacklist_chats
+        whitelist_chats = routing.whitelist_chats
+        whitelist_modules = routing.whitelist_modules
+        chat_id = ctx.chat_id
 
         if (blacklist_chats and chat_id in blacklist_chats) or (
             whitelist_chats and chat_id not in whitelist_chats
@@ -561,9 +630,11 @@ class CommandDispatcher:
             logger.debug("Message is blacklisted")
             return
 
-        for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
-            modname = str(func.__self__.__class__.strings["name"])
+        bl = routing.disabled_watchers
+        placeholders_set = False
+        for watcher in self._modules.watcher_registry.candidates(ctx):
+            modname = watcher.modname
+            tags = watcher.filter
 
             if (
                 modname in bl
@@ -574,31 +645,44 @@ class CommandDispatcher:
                     or ("only_chats" in bl[modname] and message.is_private)
                     or ("only_pm" in bl[modname] and not message.is_private)
                 )
-                or f"{str(chat_id)}.{func.__self__.__module__}" in blacklist_chats
+                or f"{str(chat_id)}.{watcher.module}" in blacklist_chats
                 or whitelist_modules
-                and f"{str(chat_id)}.{func.__self__.__module__}"
-                not in whitelist_modules
-                or await self._handle_tags(event, func)
+                and f"{str(chat_id)}.{watcher.module}" not in whitelist_modules
+                or tags.no_commands
+                and await self._handle_command(ctx, watcher=True)
+                or tags.only_commands
+                and not await self._handle_command(ctx, watcher=True)
+                or not tags.check(ctx)
             ):
                 continue
 
-            # Avoid weird AttributeErrors in weird dochub modules by settings placeholder
-            # of attributes
-            for placeholder in {"text", "raw_text", "out"}:
-                try:
-                    if not hasattr(message, placeholder):
-                        setattr(message, placeholder, "")
-                except UnicodeDecodeError:
-                    pass
-
-            # Run watcher via ensure_future so in case user has a lot
-            # of watchers with long actions, they can run simultaneously
-            asyncio.ensure_future(
-                self.future_dispatcher(
-                    func,
+            if not placeholders_set:
+                # Avoid weird AttributeErrors in weird dochub modules by settings
+                # placeholder of attributes
+                for placeholder in {"text", "raw_text", "out"}:
+                    try:
+                        if not hasattr(message, placeholder):
+                            setattr(message, placeholder, "")
+                    except UnicodeDecodeError:
+                        pass
+
+                placeholders_set = True
+
+            # Watchers run simultaneously, so in case user has a lot of watchers
+            # with long actions they don't block each other. Pool limits their
+            # number, so bursts of events don't pile up unlimited tasks
+            self.watcher_pool.submit(
+                watcher.func,
+                watcher.modname,
+                chat_id,
+                functools.partial(
+                    self.future_dispatcher,
+                    watcher.func,
                     message,
                     self.watcher_exc,
-                )
+                ),
+                watcher.max_concurrency,
+                watcher.overflow,
             )
 
     async def future_dispatcher(
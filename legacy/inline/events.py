@@ -386,11 +386,12 @@ class Events(InlineUnit):
 
     async def _query_help(self, inline_query: InlineQuery):
         _help = []
-        for name, fun in self._allmodules.inline_handlers.items():
-            if not await self.check_inline_security(
-                func=fun,
-                user=inline_query.from_user.id,
-            ):
+        allowed = await self.check_inline_security_many(
+            funcs=list(self._allmodules.inline_handlers.values()),
+            user=inline_query.from_user.id,
+        )
+        for i, (name, fun) in enumerate(self._allmodules.inline_handlers.items()):
+            if not allowed >> i & 1:
                 continue
 
             try:
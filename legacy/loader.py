@@ -27,6 +27,7 @@ from uuid import uuid4
 from legacytl.tl.tlobject import TLObject
 
 from . import security, utils, validators
+from ._watchers import WatcherRegistry
 from .database import Database
 from .inline.core import InlineManager
 from .translations import Strings, Translator
@@ -388,6 +389,10 @@ def tag(*tags, **kwarg_tags):
         • `filter` - Capture only messages that pass given function
         • `from_id` - Capture only messages from given user
         • `chat_id` - Capture only messages from given chat
+        • `max_concurrency` - Max number of simultaneously running calls of watcher
+        • `overflow` - What to do with events, when too many calls of watcher are
+            queued: `drop_new` (default), `drop_old` or `coalesce` (keep only
+            the latest event of each chat)
         • `thumb_url` - Works for inline command handlers. Will be shown in help
         • `alias` - Set single alias for a command
         • `aliases` - Set multiple aliases for a command
@@ -505,6 +510,9 @@ class Modules:
         self.modules = []  # skipcq: PTC-W0052
         self.libraries = []
         self.watchers = []
+        # Watchers with compiled tags, which dispatcher uses. Must be rebuilt
+        # whenever `watchers` change
+        self.watcher_registry = WatcherRegistry()
         self._log_handlers = []
         self._core_commands = []
         self.__approve = []
@@ -538,6 +546,7 @@ class Modules:
             self.inline_handlers = inline_handlers
             self.callback_handlers = callback_handlers
             self.watchers = watchers
+            self.watcher_registry.rebuild(watchers)
 
             logger.debug(
                 (
@@ -794,13 +803,15 @@ class Modules:
         with contextlib.suppress(AttributeError):
             _legacy_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
 
-        for _watcher in self.watchers:
+        for _watcher in self.watchers.copy():
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
                 logger.debug("Removing watcher %s for update", _watcher)
                 self.watchers.remove(_watcher)
         for _watcher in instance.legacy_watchers.values():
             self.watchers += [_watcher]
 
+        self.watcher_registry.rebuild(self.watchers)
+
     def lookup(
         self,
         modname: str,
@@ -1129,9 +1140,11 @@ class Modules:
                 )
                 self.watchers.remove(_watcher)
 
+        self.watcher_registry.rebuild(self.watchers)
+
     def unregister_raw_handlers(self, instance: Module, purpose: str):
         """Unregister event handlers for a module"""
-        for handler in self.client.dispatcher.raw_handlers:
+        for handler in list(self.client.dispatcher.raw_handlers):
             if handler.__self__.__class__.__name__ == instance.__class__.__name__:
                 self.client.dispatcher.raw_handlers.remove(handler)
                 logger.debug(
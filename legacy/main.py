@@ -793,6 +793,7 @@ class Legacy:
             client._tg_id = me.id
             client.tg_id = me.id
             client.legacy_me = me
+            client.legacy_load_cache()
             while await self.amain(first, client):
                 first = False
 
@@ -868,26 +869,12 @@ class Legacy:
         dispatcher = CommandDispatcher(modules, client, db)
         client.dispatcher = dispatcher
         modules.check_security = dispatcher.check_security
+        modules.check_security_many = dispatcher.check_security_many
 
-        client.add_event_handler(
-            dispatcher.handle_incoming,
-            events.NewMessage(),
-        )
-
-        client.add_event_handler(
-            dispatcher.handle_incoming,
-            events.ChatAction(),
-        )
-
-        client.add_event_handler(
-            dispatcher.handle_command,
-            events.NewMessage(forwards=False),
-        )
-
-        client.add_event_handler(
-            dispatcher.handle_command,
-            events.MessageEdited(),
-        )
+        # Each update is handled by the single entry point, so it's parsed once
+        # for both watchers and commands
+        for event in (events.NewMessage(), events.MessageEdited(), events.ChatAction()):
+            client.add_event_handler(dispatcher.handle_event, event)
 
         client.add_event_handler(
             dispatcher.handle_raw,
@@ -926,6 +913,12 @@ class Legacy:
         modules.send_config()
         await modules.send_ready()
 
+        logging.debug(
+            "Startup took %s API requests, most frequent: %s",
+            sum(client.legacy_api_calls.values()),
+            dict(client.legacy_api_calls.most_common(5)),
+        )
+
         if first:
             await self._badge(client)
 
@@ -956,6 +949,10 @@ class Legacy:
         """Shutdown handler"""
         logging.info("Bye")
         for client in self.clients:
+            if (db := getattr(client, "legacy_db", None)) is not None:
+                db.flush()
+
+            client.legacy_save_cache()
             client.disconnect()
 
         sys.exit(0)
@@ -169,10 +169,14 @@ class Help(loader.Module):
                 + "\n</i>"
             )
 
+        allowed = await self.allmodules.check_security_many(
+            message,
+            list(module.commands.values()),
+        )
         commands = {
             name: func
-            for name, func in module.commands.items()
-            if await self.allmodules.check_security(message, func)
+            for i, (name, func) in enumerate(module.commands.items())
+            if allowed >> i & 1
         }
 
         if hasattr(module, "inline_handlers"):
@@ -251,6 +255,34 @@ class Help(loader.Module):
         core_ = []
         no_commands_ = []
 
+        permitted = set()
+        if not force:
+            # Permissions of all commands are checked at once, so sender's rights
+            # are resolved only one time
+            funcs = [
+                func
+                for mod in self.allmodules.modules
+                if hasattr(mod, "commands")
+                for func in mod.commands.values()
+            ]
+            inline_funcs = [
+                func
+                for mod in self.allmodules.modules
+                if hasattr(mod, "commands")
+                for func in mod.inline_handlers.values()
+            ]
+            allowed = await self.allmodules.check_security_many(message, funcs)
+            inline_allowed = await self.inline.check_inline_security_many(
+                funcs=inline_funcs,
+                user=message.sender_id,
+            )
+            permitted.update(
+                func for i, func in enumerate(funcs) if allowed >> i & 1
+            )
+            permitted.update(
+                func for i, func in enumerate(inline_funcs) if inline_allowed >> i & 1
+            )
+
         for mod in self.allmodules.modules:
             if not hasattr(mod, "commands"):
                 logger.debug("Module %s is not inited yet", mod.__class__.__name__)
@@ -283,7 +315,7 @@ class Help(loader.Module):
             commands = [
                 name
                 for name, func in mod.commands.items()
-                if await self.allmodules.check_security(message, func) or force
+                if force or func in permitted
             ]
 
             for cmd in commands:
@@ -296,11 +328,7 @@ class Help(loader.Module):
             icommands = [
                 name
                 for name, func in mod.inline_handlers.items()
-                if await self.inline.check_inline_security(
-                    func=func,
-                    user=message.sender_id,
-                )
-                or force
+                if force or func in permitted
             ]
 
             for cmd in icommands:
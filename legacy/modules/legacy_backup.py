@@ -129,7 +129,8 @@ class LegacyBackupMod(loader.Module):
                 self.get("last_backup") + self.get("period") - time.time()
             )
 
-            db_dump = ujson.dumps(self._db).encode()
+            # Copy makes sure lazily stored owners are loaded too
+            db_dump = ujson.dumps(self._db.copy()).encode()
 
             result = io.BytesIO()
 
@@ -237,7 +238,8 @@ class LegacyBackupMod(loader.Module):
 
     @loader.command()
     async def backup(self, message):
-        db_dump = ujson.dumps(self._db).encode()
+        # Copy makes sure lazily stored owners are loaded too
+        db_dump = ujson.dumps(self._db.copy()).encode()
 
         result = io.BytesIO()
 
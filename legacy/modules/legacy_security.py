@@ -280,6 +280,8 @@ class LegacySecurityMod(loader.Module):
             await utils.answer(message, self.strings("sgroup_not_found").format(args))
             return
 
+        users = await self._client.get_entities(group.users, exp=0)
+
         await utils.answer(
             message,
             self.strings("sgroup_info").format(
@@ -289,14 +291,8 @@ class LegacySecurityMod(loader.Module):
                         "\n".join(
                             [
                                 self.strings("li").format(
-                                    utils.get_entity_url(
-                                        await self._client.get_entity(user, exp=0)
-                                    ),
-                                    utils.escape_html(
-                                        get_display_name(
-                                            await self._client.get_entity(user, exp=0)
-                                        )
-                                    ),
+                                    utils.get_entity_url(users[user]),
+                                    utils.escape_html(get_display_name(users[user])),
                                     (
                                         self._db.get(
                                             main.__name__, "command_prefix", {}
@@ -305,6 +301,7 @@ class LegacySecurityMod(loader.Module):
                                     ),
                                 )
                                 for user in group.users
+                                if user in users
                             ]
                         )
                     )
@@ -619,10 +616,9 @@ class LegacySecurityMod(loader.Module):
 
         if user.id in self._client.dispatcher.security.owner:
             self._client.dispatcher.security.owner.remove(user.id)
-        try:
-            self._db.get(main.__name__, "command_prefix", {}).pop(f"{user.id}")
-        except KeyError:
-            pass
+        prefixes = self._db.get(main.__name__, "command_prefix", {})
+        if prefixes.pop(f"{user.id}", None) is not None:
+            self._db.set(main.__name__, "command_prefix", prefixes)
 
         await utils.answer(
             message,
@@ -634,10 +630,14 @@ class LegacySecurityMod(loader.Module):
 
     @loader.command()
     async def ownerlist(self, message: Message):
-        _resolved_users = []
-        for user in set(self._client.dispatcher.security.owner + [self.tg_id]):
-            with contextlib.suppress(Exception):
-                _resolved_users += [await self._client.get_entity(user, exp=0)]
+        _resolved_users = list(
+            (
+                await self._client.get_entities(
+                    self._client.dispatcher.security.owner + [self.tg_id],
+                    exp=0,
+                )
+            ).values()
+        )
 
         if not _resolved_users:
             await utils.answer(message, self.strings["no_owner"])
@@ -1202,7 +1202,7 @@ class LegacySecurityMod(loader.Module):
                         self.strings(rule["rule_type"]),
                         rule["rule"],
                     )
-                    for rule in self._client.dispatcher.security.tsec_chat
+                    for rule in self._client.dispatcher.security.get_rules("chat")
                 ]
                 + [
                     "<emoji document_id=6037122016849432064>👤</emoji> <b><a"
@@ -1214,7 +1214,7 @@ class LegacySecurityMod(loader.Module):
                         self.strings(rule["rule_type"]),
                         rule["rule"],
                     )
-                    for rule in self._client.dispatcher.security.tsec_user
+                    for rule in self._client.dispatcher.security.get_rules("user")
                 ]
                 + [
                     "\n".join(
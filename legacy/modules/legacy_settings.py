@@ -798,23 +798,23 @@ class LegacySettingsMod(loader.Module):
                 result = (
                     f"Dropped {len(self._client._legacy_entity_cache)} cache records"
                 )
-                self._client._legacy_entity_cache = {}
+                self._client._legacy_entity_cache.clear()
             elif method == "flush_fulluser_cache":
                 result = (
                     f"Dropped {len(self._client._legacy_fulluser_cache)} cache records"
                 )
-                self._client._legacy_fulluser_cache = {}
+                self._client._legacy_fulluser_cache.clear()
             elif method == "flush_fullchannel_cache":
                 result = (
                     f"Dropped {len(self._client._legacy_fullchannel_cache)} cache"
                     " records"
                 )
-                self._client._legacy_fullchannel_cache = {}
+                self._client._legacy_fullchannel_cache.clear()
             elif method == "flush_perms_cache":
                 result = (
                     f"Dropped {len(self._client._legacy_perms_cache)} cache records"
                 )
-                self._client._legacy_perms_cache = {}
+                self._client._legacy_perms_cache.clear()
             elif method == "flush_loader_cache":
                 result = (
                     f"Dropped {await self.lookup('loader').flush_cache()} cache records"
@@ -830,9 +830,9 @@ class LegacySettingsMod(loader.Module):
                     " records\nDropped"
                     f" {count} loader links cache records"
                 )
-                self._client._legacy_entity_cache = {}
-                self._client._legacy_fulluser_cache = {}
-                self._client._legacy_fullchannel_cache = {}
+                self._client._legacy_entity_cache.clear()
+                self._client._legacy_fulluser_cache.clear()
+                self._client._legacy_fullchannel_cache.clear()
                 self._client.legacy_me = await self._client.get_me()
             elif method == "reload_core":
                 core_quantity = await self.lookup("loader").reload_core()
@@ -109,37 +109,47 @@ class LoaderMod(loader.Module):
 
     @loader.loop(interval=3, wait_before=True, autostart=True)
     async def _config_autosaver(self):
-        for mod in self.allmodules.modules:
-            if (
-                not hasattr(mod, "config")
-                or not mod.config
-                or not isinstance(mod.config, loader.ModuleConfig)
-            ):
-                continue
-
-            for option, config in mod.config._config.items():
-                if not hasattr(config, "_save_marker"):
+        with self._db.transaction():
+            for mod in self.allmodules.modules:
+                if (
+                    not hasattr(mod, "config")
+                    or not mod.config
+                    or not isinstance(mod.config, loader.ModuleConfig)
+                ):
                     continue
 
-                delattr(mod.config._config[option], "_save_marker")
-                mod.pointer("__config__", {})[option] = config.value
+                for option, config in mod.config._config.items():
+                    if not hasattr(config, "_save_marker"):
+                        continue
 
-        for lib in self.allmodules.libraries:
-            if (
-                not hasattr(lib, "config")
-                or not lib.config
-                or not isinstance(lib.config, loader.ModuleConfig)
-            ):
-                continue
+                    delattr(mod.config._config[option], "_save_marker")
+                    # Failure would revert the whole transaction
+                    try:
+                        mod.pointer("__config__", {})[option] = config.value
+                    except Exception:
+                        logger.exception("Can't save config option %s", option)
 
-            for option, config in lib.config._config.items():
-                if not hasattr(config, "_save_marker"):
+            for lib in self.allmodules.libraries:
+                if (
+                    not hasattr(lib, "config")
+                    or not lib.config
+                    or not isinstance(lib.config, loader.ModuleConfig)
+                ):
                     continue
 
-                delattr(lib.config._config[option], "_save_marker")
-                lib._lib_pointer("__config__", {})[option] = config.value
+                for option, config in lib.config._config.items():
+                    if not hasattr(config, "_save_marker"):
+                        continue
+
+                    delattr(lib.config._config[option], "_save_marker")
+                    # Failure would revert the whole transaction
+                    try:
+                        lib._lib_pointer("__config__", {})[option] = config.value
+                    except Exception:
+                        logger.exception("Can't save config option %s", option)
 
-        self._db.save()
+        # Values could be changed in place, bypassing `set`
+        self._db.save_mutated()
 
     def update_modules_in_db(self):
         self.set(
@@ -364,6 +364,18 @@ class TestMod(loader.Module):
 
             return
 
+        # Unsaved database changes are the first suspect, when settings are lost
+        logs = (
+            f"Database: {self._db.pending_writes} pending writes, last flush: "
+            + (
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_flush))
+                if (last_flush := self._db.last_flush)
+                else "never"
+            )
+            + "\n\n"
+            + logs
+        )
+
         logs = self.lookup("evaluator").censor(logs)
 
         logs = BytesIO(logs.encode("utf-16"))
@@ -120,6 +120,14 @@ class UpdaterMod(loader.Module):
         handler = logging.getLogger().handlers[0]
         handler.setLevel(logging.CRITICAL)
 
+        for client in self.allclients:
+            # Make sure no coalesced database writes are lost on restart
+            if (db := getattr(client, "legacy_db", None)) is not None:
+                db.flush()
+
+            # Warm caches spare API requests at startup
+            client.legacy_save_cache()
+
         for client in self.allclients:
             # Terminate main loop of all running clients
             # Won't work if not all clients are ready
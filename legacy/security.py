@@ -22,6 +22,9 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import functools
+import heapq
 import logging
 import time
 import typing
@@ -32,6 +35,7 @@ from legacytl.tl.types import ChatParticipantAdmin, ChatParticipantCreator, Mess
 from legacytl.utils import get_display_name
 
 from . import main, utils
+from ._cache import MISSING, TTLCache
 from .database import Database
 from .tl_cache import CustomTelegramClient
 from .types import Command
@@ -83,6 +87,20 @@ PUBLIC_PERMISSIONS = GROUP_OWNER | GROUP_ADMIN_ANY | GROUP_MEMBER | PM
 
 ALL = (1 << 13) - 1
 
+# Max number of cached chats, participants and admin sets of groups
+CACHE_SIZE = 4096
+# Time (seconds), after which cached rights are refetched
+CACHE_TTL = 5 * 60
+# Number of admin log events to look through, when channel is checked first time
+ADMIN_LOG_LIMIT = 10
+# Max number of new admin log events to fetch on subsequent checks
+ADMIN_LOG_MAX_NEW = 100
+
+
+# (target type, target id, rule type, rule), where target type is `user`, `chat`
+# or `sgroup` for the rules, which users get from their security groups
+RuleKey = typing.Tuple[str, int, str, str]
+
 
 class SecurityGroup(typing.NamedTuple):
     """Represents a security group"""
@@ -168,7 +186,12 @@ class SecurityManager:
     def __init__(self, client: CustomTelegramClient, db: Database):
         self._client = client
         self._db = db
-        self._cache: typing.Dict[int, dict] = {}
+        self._cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+        # (channel id, message id, edit date) -> id of admin, who made this edit
+        self._post_editors = TTLCache(CACHE_SIZE, CACHE_TTL)
+        # Channel id -> id of the last seen edit event of admin log
+        self._admin_log_cursors = TTLCache(CACHE_SIZE, CACHE_TTL)
+        self._admin_log_fetches: typing.Dict[int, asyncio.Future] = {}
         self._last_warning: int = 0
         self._sgroups: typing.Dict[str, SecurityGroup] = {}
 
@@ -178,11 +201,33 @@ class SecurityManager:
         self._tsec_user = self.tsec_user = db.pointer(__name__, "tsec_user", [])
         self._owner = self.owner = db.pointer(__name__, "owner", [])
 
+        # Security masks of commands and bounding mask, reloaded after they change
+        self._masks: typing.Optional[typing.Dict[str, int]] = None
+        self._bounding_mask = DEFAULT_PERMISSIONS
+
+        # Index of targeted security rules, rebuilt lazily after they change
+        self._rules: typing.Optional[typing.Set[RuleKey]] = None
+        self._rule_targets: typing.Set[typing.Tuple[str, int]] = set()
+        # Expiration times of rules, the earliest one on top
+        self._expirations: typing.List[int] = []
+        db.add_listener(self._on_db_change)
+
         self._reload_rights()
 
+    def _on_db_change(self, owner: typing.Optional[str], key: typing.Optional[str]):
+        if owner not in {None, __name__}:
+            return
+
+        if key in {None, "tsec_user", "tsec_chat"}:
+            self._rules = None
+
+        if key in {None, "masks", "bounding_mask"}:
+            self._masks = None
+
     def apply_sgroups(self, sgroups: typing.Dict[str, SecurityGroup]):
         """Apply security groups"""
         self._sgroups = sgroups
+        self._rules = None
 
     def _reload_rights(self):
         """
@@ -193,13 +238,95 @@ class SecurityManager:
         if self._client.tg_id not in self._owner:
             self._owner.append(self._client.tg_id)
 
-        for info in self._tsec_user.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_user.remove(info)
+        self._get_rules()
+
+    def _build_rules(self):
+        rules = set()
+        targets = set()
+        expirations = []
+
+        for target_type, pointer in (
+            ("user", self._tsec_user),
+            ("chat", self._tsec_chat),
+        ):
+            for info in pointer:
+                target = info["target"]
+                rules.add((target_type, target, info["rule_type"], info["rule"]))
+                targets.add((target_type, target))
+                if info["expires"]:
+                    expirations.append(info["expires"])
+
+        for group in self._sgroups.values():
+            for permission in group.permissions:
+                for user_id in group.users:
+                    rules.add(
+                        ("sgroup", user_id, permission["rule_type"], permission["rule"])
+                    )
+
+        heapq.heapify(expirations)
+        self._rules, self._rule_targets, self._expirations = (
+            rules,
+            targets,
+            expirations,
+        )
+
+    def _get_rules(self) -> typing.Set[RuleKey]:
+        """
+        Get index of targeted security rules, purging expired ones
+        only when the earliest of them expires
+        """
+        if self._rules is None:
+            self._build_rules()
+
+        if self._expirations and self._expirations[0] < time.time():
+            now = time.time()
+            with self._db.transaction():
+                for pointer in (self._tsec_user, self._tsec_chat):
+                    actual = [
+                        info
+                        for info in pointer
+                        if not info["expires"] or info["expires"] >= now
+                    ]
+                    if len(actual) != len(pointer):
+                        pointer[:] = actual
+
+            self._build_rules()
+
+        return self._rules
+
+    def _match_rules(
+        self,
+        user_id: int,
+        chat_id: typing.Optional[int],
+        command: typing.Optional[str],
+        module: typing.Optional[str],
+    ) -> bool:
+        rules = self._get_rules()
+        for target_type, target in (
+            ("sgroup", user_id),
+            ("user", user_id),
+            ("chat", chat_id),
+        ):
+            if not target:
+                continue
+
+            for rule_type, rule in (("command", command), ("module", module)):
+                if rule and (target_type, target, rule_type, rule) in rules:
+                    logger.debug("tsec %s match for %s %s", target_type, target, rule)
+                    return True
+
+        return False
+
+    def get_rules(self, target_type: str) -> typing.List[dict]:
+        """
+        Gets actual targeted security rules
+
+        :param target_type: "user" or "chat"
+        :return: list of rules
+        """
 
-        for info in self._tsec_chat.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_chat.remove(info)
+        self._get_rules()
+        return list(self._tsec_user if target_type == "user" else self._tsec_chat)
 
     def add_rule(
         self,
@@ -230,16 +357,27 @@ class SecurityManager:
         if duration < 0:
             raise ValueError(f"Invalid duration: {duration}")
 
-        (self._tsec_chat if target_type == "chat" else self._tsec_user).append(
-            {
-                "target": target.id,
-                "rule_type": rule.split("/")[0],
-                "rule": rule.split("/", maxsplit=1)[1],
-                "expires": int(time.time() + duration) if duration else 0,
-                "entity_name": get_display_name(target),
-                "entity_url": utils.get_entity_url(target),
-            }
-        )
+        rule_type, rule = rule.split("/", maxsplit=1)
+        pointer = self._tsec_chat if target_type == "chat" else self._tsec_user
+        info = {
+            "target": target.id,
+            "rule_type": rule_type,
+            "rule": rule,
+            "expires": int(time.time() + duration) if duration else 0,
+            "entity_name": get_display_name(target),
+            "entity_url": utils.get_entity_url(target),
+        }
+
+        # Adding the same rule again only updates its expiration
+        if (target_type, target.id, rule_type, rule) in self._get_rules():
+            pointer[:] = [
+                existing
+                for existing in pointer
+                if (existing["target"], existing["rule_type"], existing["rule"])
+                != (target.id, rule_type, rule)
+            ] + [info]
+        else:
+            pointer.append(info)
 
     def remove_rules(self, target_type: str, target_id: int) -> bool:
         """
@@ -250,20 +388,7 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
-
-        if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id:
-                    self.tsec_user.remove(rule)
-                    any_ = True
-        elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
-
-        return any_
+        return self._remove_rules(target_type, target_id, None)
 
     def remove_rule(self, target_type: str, target_id: int, rule_cont: str) -> bool:
         """
@@ -275,20 +400,34 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
+        return self._remove_rules(target_type, target_id, rule_cont)
 
-        if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_user.remove(rule)
-                    any_ = True
-        elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
+    def _remove_rules(
+        self,
+        target_type: str,
+        target_id: int,
+        rule_cont: typing.Optional[str],
+    ) -> bool:
+        if target_type not in {"user", "chat"}:
+            return False
 
-        return any_
+        self._get_rules()
+        if (target_type, target_id) not in self._rule_targets:
+            return False
+
+        pointer = self._tsec_user if target_type == "user" else self._tsec_chat
+        rules = [
+            rule
+            for rule in pointer
+            if rule["target"] != target_id
+            or rule_cont is not None
+            and rule["rule"] != rule_cont
+        ]
+        if len(rules) == len(pointer):
+            return False
+
+        pointer[:] = rules
+        return True
 
     def get_flags(self, func: typing.Union[Command, int]) -> int:
         """
@@ -298,6 +437,8 @@ class SecurityManager:
         :return: security flags
         """
 
+        masks = self._get_masks()
+
         if isinstance(func, int):
             config = func
         else:
@@ -305,7 +446,7 @@ class SecurityManager:
             # every time he changes permissions. It doesn't
             # decrease security at all, bc user anyway can
             # access this attribute
-            config = self._db.get(__name__, "masks", {}).get(
+            config = masks.get(
                 f"{func.__module__}.{func.__name__}",
                 getattr(func, "security", self._default),
             )
@@ -314,7 +455,18 @@ class SecurityManager:
             logger.error("Security config contains unknown bits")
             return False
 
-        return config & self._db.get(__name__, "bounding_mask", DEFAULT_PERMISSIONS)
+        return config & self._bounding_mask
+
+    def _get_masks(self) -> typing.Dict[str, int]:
+        if self._masks is None:
+            self._masks = self._db.get(__name__, "masks", {})
+            self._bounding_mask = self._db.get(
+                __name__,
+                "bounding_mask",
+                DEFAULT_PERMISSIONS,
+            )
+
+        return self._masks
 
     def _check_tsec_inline(self, user_id: int, command: str) -> bool:
         """
@@ -325,39 +477,21 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        return command and any(
-            (
-                rule["target"] == user_id
-                and rule["rule_type"] == "inline"
-                and rule["rule"] == command
-            )
-            for rule in self._tsec_user
+        return bool(command) and ("user", user_id, "inline", command) in (
+            self._get_rules()
         )
 
     def check_tsec(self, user_id: int, command: str) -> bool:
-        for info in self._sgroups.copy().values():
-            if user_id in info.users:
-                for permission in info.permissions:
-                    if (
-                        permission["rule_type"] == "command"
-                        and permission["rule"] == command
-                        or permission["rule_type"] == "module"
-                        and permission["rule"] == command
-                    ):
-                        return True
-
-        for info in self._tsec_user.copy():
-            if info["target"] == user_id and (
-                info["rule_type"] == "command"
-                and info["rule"] == command
-                or info["rule_type"] == "module"
-                and command in self._client.loader.commands
-                and info["rule"]
-                == self._client.loader.commands[command].__qualname__.split(".")[0]
-            ):
-                return True
-
-        return False
+        return self._match_rules(
+            user_id,
+            None,
+            command,
+            (
+                func.__qualname__.split(".")[0]
+                if (func := self._client.loader.commands.get(command))
+                else None
+            ),
+        )
 
     async def check(
         self,
@@ -378,10 +512,47 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        self._reload_rights()
+        return bool(
+            await self.check_many(
+                message,
+                [func],
+                user_id,
+                [inline_cmd],
+                usernames=usernames,
+            )
+        )
 
-        if not (config := self.get_flags(func)):
-            return False
+    async def check_many(
+        self,
+        message: typing.Optional[Message],
+        funcs: typing.Sequence[typing.Union[Command, int]],
+        user_id: typing.Optional[int] = None,
+        inline_cmds: typing.Optional[typing.Sequence[typing.Optional[str]]] = None,
+        *,
+        usernames: typing.Optional[typing.List[str]] = None,
+    ) -> int:
+        """
+        Checks if message sender is permitted to execute several functions.
+        Sender, chat and rights of participant are resolved once for all of them
+
+        :param message: Message to check or None if you manually pass user_id
+        :param funcs: functions or flags
+        :param user_id: user ID
+        :param inline_cmds: Inline command names of functions if it's inline query
+        :return: Bitmap, where bit `i` is set if `funcs[i]` is permitted
+
+        :example:
+            >>> allowed = await security.check_many(message, funcs)
+            >>> [func for i, func in enumerate(funcs) if allowed >> i & 1]
+        """
+
+        self._get_rules()
+
+        configs = [self.get_flags(func) for func in funcs]
+        if not (
+            candidates := sum(1 << i for i, config in enumerate(configs) if config)
+        ):
+            return 0
 
         if not user_id:
             user_id = message.sender_id
@@ -394,25 +565,20 @@ class SecurityManager:
             and not message.is_group
             and message.edit_date
         ):
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    user_id = event.user_id
-                    is_channel = True
+            if (editor := await self._get_post_editor(message)) is not None:
+                user_id = editor
+                is_channel = True
 
         if (
             user_id == self._client.tg_id
             or getattr(message, "out", False)
             and not is_channel
         ):
-            return True
+            return candidates
 
-        logger.debug("Checking security match for %s", config)
+        logger.debug("Checking security match for %s", configs)
 
-        if config & SUDO or config & SUPPORT:
+        if any(config & SUDO or config & SUPPORT for config in configs):
             if not self._last_warning or time.time() - self._last_warning > 60 * 60:
                 import warnings
 
@@ -425,36 +591,24 @@ class SecurityManager:
                 )
                 self._last_warning = time.time()
 
-        f_group_owner = config & GROUP_OWNER
-        f_group_admin_add_admins = config & GROUP_ADMIN_ADD_ADMINS
-        f_group_admin_change_info = config & GROUP_ADMIN_CHANGE_INFO
-        f_group_admin_ban_users = config & GROUP_ADMIN_BAN_USERS
-        f_group_admin_delete_messages = config & GROUP_ADMIN_DELETE_MESSAGES
-        f_group_admin_pin_messages = config & GROUP_ADMIN_PIN_MESSAGES
-        f_group_admin_invite_users = config & GROUP_ADMIN_INVITE_USERS
-        f_group_admin = config & GROUP_ADMIN
-        f_group_member = config & GROUP_MEMBER
-        f_pm = config & PM
-
-        f_group_admin_any = (
-            f_group_admin_add_admins
-            or f_group_admin_change_info
-            or f_group_admin_ban_users
-            or f_group_admin_delete_messages
-            or f_group_admin_pin_messages
-            or f_group_admin_invite_users
-            or f_group_admin
-        )
-
         if user_id in self._owner:
-            return True
+            return candidates
 
         if user_id in self._db.get(main.__name__, "blacklist_users", []):
-            return False
+            return 0
 
         if message is None:  # In case of checking inline query security map
-            return self._check_tsec_inline(user_id, inline_cmd) or bool(
-                config & EVERYONE
+            return sum(
+                1 << i
+                for i, config in enumerate(configs)
+                if config
+                and (
+                    self._check_tsec_inline(
+                        user_id,
+                        inline_cmds[i] if inline_cmds else None,
+                    )
+                    or config & EVERYONE
+                )
             )
 
         try:
@@ -470,75 +624,51 @@ class SecurityManager:
         except Exception:
             cmd = None
 
-        if callable(func):
-            command = self._client.loader.find_alias(cmd, include_legacytl=True) or cmd
-
-            for info in self._sgroups.copy().values():
-                if user_id in info.users:
-                    for permission in info.permissions:
-                        if (
-                            permission["rule_type"] == "command"
-                            and permission["rule"] == command
-                        ):
-                            logger.debug("sgroup match for %s", command)
-                            return True
-
-                        if (
-                            permission["rule_type"] == "module"
-                            and permission["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "sgroup match for %s", func.__self__.__class__.__name__
-                            )
-                            return True
-
-            for info in self._tsec_user.copy():
-                if info["target"] == user_id:
-                    if info["rule_type"] == "command" and info["rule"] == command:
-                        logger.debug("tsec match for user %s", command)
-                        return True
+        command = None
+        allowed = 0
+        # Functions, which depend on rights of sender in chat
+        pending = []
 
-                    if (
-                        info["rule_type"] == "module"
-                        and info["rule"] == func.__self__.__class__.__name__
-                    ):
-                        logger.debug(
-                            "tsec match for user %s",
-                            func.__self__.__class__.__name__,
-                        )
-                        return True
-
-            if chat:
-                for info in self._tsec_chat.copy():
-                    if info["target"] == chat:
-                        if info["rule_type"] == "command" and info["rule"] == command:
-                            logger.debug("tsec match for %s", command)
-                            return True
-
-                        if (
-                            info["rule_type"] == "module"
-                            and info["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "tsec match for %s",
-                                func.__self__.__class__.__name__,
-                            )
-                            return True
-
-        if f_group_member and message.is_group or f_pm and message.is_private:
-            return True
+        for i, (func, config) in enumerate(zip(funcs, configs)):
+            if not config:
+                continue
+
+            if callable(func):
+                if command is None:
+                    command = (
+                        self._client.loader.find_alias(cmd, include_legacytl=True)
+                        or cmd
+                    )
+
+                if self._match_rules(
+                    user_id,
+                    chat,
+                    command,
+                    func.__self__.__class__.__name__,
+                ):
+                    allowed |= 1 << i
+                    continue
+
+            if (
+                config & GROUP_MEMBER
+                and message.is_group
+                or config & PM
+                and message.is_private
+            ):
+                allowed |= 1 << i
+                continue
+
+            pending.append((i, config))
+
+        if not pending:
+            return allowed
 
         if message.is_channel:
             if not message.is_group:
                 chat_id = utils.get_chat_id(message)
-                if (
-                    chat_id in self._cache
-                    and self._cache[chat_id]["exp"] >= time.time()
-                ):
-                    chat = self._cache[chat_id]["chat"]
-                else:
+                if (chat := self._cache.get(("chat", chat_id), MISSING)) is MISSING:
                     chat = await message.get_chat()
-                    self._cache[chat_id] = {"chat": chat, "exp": time.time() + 5 * 60}
+                    self._cache.set(("chat", chat_id), chat)
 
                 if (
                     not chat.creator
@@ -546,87 +676,183 @@ class SecurityManager:
                     or not chat.creator
                     and not chat.admin_rights.post_messages
                 ):
-                    return False
+                    return allowed
 
-                if self._any_admin and f_group_admin_any or f_group_admin:
-                    return True
-            elif f_group_admin_any or f_group_owner:
-                chat_id = utils.get_chat_id(message)
-                cache_obj = f"{chat_id}/{user_id}"
-                if (
-                    cache_obj in self._cache
-                    and self._cache[cache_obj]["exp"] >= time.time()
-                ):
-                    participant = self._cache[cache_obj]["user"]
-                else:
-                    participant = await message.client.get_permissions(
-                        message.peer_id,
-                        user_id,
-                    )
-                    self._cache[cache_obj] = {
-                        "user": participant,
-                        "exp": time.time() + 5 * 60,
-                    }
-
-                if (
-                    participant.is_creator
-                    or participant.is_admin
-                    and (
+                for i, config in pending:
+                    if (
                         self._any_admin
-                        and f_group_admin_any
-                        or f_group_admin
-                        or f_group_admin_add_admins
-                        and participant.add_admins
-                        or f_group_admin_change_info
-                        and participant.change_info
-                        or f_group_admin_ban_users
-                        and participant.ban_users
-                        or f_group_admin_delete_messages
-                        and participant.delete_messages
-                        or f_group_admin_pin_messages
-                        and participant.pin_messages
-                        or f_group_admin_invite_users
-                        and participant.invite_users
-                    )
-                ):
-                    return True
-            return False
+                        and config & GROUP_ADMIN_ANY
+                        or config & GROUP_ADMIN
+                    ):
+                        allowed |= 1 << i
 
-        if message.is_group and (f_group_admin_any or f_group_owner):
-            chat_id = utils.get_chat_id(message)
-            cache_obj = f"{chat_id}/{user_id}"
+                return allowed
 
-            if (
-                cache_obj in self._cache
-                and self._cache[cache_obj]["exp"] >= time.time()
+            if not (
+                pending := [
+                    (i, config)
+                    for i, config in pending
+                    if config & (GROUP_ADMIN_ANY | GROUP_OWNER)
+                ]
             ):
-                participant = self._cache[cache_obj]["user"]
-            else:
-                full_chat = await message.client(GetFullChatRequest(message.chat_id))
-                participants = full_chat.full_chat.participants.participants
-                participant = next(
-                    (
-                        possible_participant
-                        for possible_participant in participants
-                        if possible_participant.user_id == message.sender_id
-                    ),
-                    None,
+                return allowed
+
+            cache_key = ("participant", utils.get_chat_id(message), user_id)
+            if (participant := self._cache.get(cache_key, MISSING)) is MISSING:
+                participant = await message.client.get_permissions(
+                    message.peer_id,
+                    user_id,
                 )
-                self._cache[cache_obj] = {
-                    "user": participant,
-                    "exp": time.time() + 5 * 60,
-                }
+                self._cache.set(cache_key, participant)
 
-            if not participant:
-                return
+            for i, config in pending:
+                if self._participant_allowed(participant, config):
+                    allowed |= 1 << i
 
-            if (
-                isinstance(participant, ChatParticipantCreator)
-                or isinstance(participant, ChatParticipantAdmin)
-                and f_group_admin_any
+            return allowed
+
+        if message.is_group and (
+            pending := [
+                (i, config)
+                for i, config in pending
+                if config & (GROUP_ADMIN_ANY | GROUP_OWNER)
+            ]
+        ):
+            if not (
+                participant := (await self._get_chat_admins(message)).get(user_id)
             ):
-                return True
+                return allowed
 
-        return False
+            for i, config in pending:
+                if (
+                    isinstance(participant, ChatParticipantCreator)
+                    or isinstance(participant, ChatParticipantAdmin)
+                    and config & GROUP_ADMIN_ANY
+                ):
+                    allowed |= 1 << i
+
+        return allowed
+
+    def _participant_allowed(self, participant: typing.Any, config: int) -> bool:
+        """Checks admin rights of supergroup participant against security flags"""
+        return bool(
+            participant.is_creator
+            or participant.is_admin
+            and (
+                self._any_admin
+                and config & GROUP_ADMIN_ANY
+                or config & GROUP_ADMIN
+                or config & GROUP_ADMIN_ADD_ADMINS
+                and participant.add_admins
+                or config & GROUP_ADMIN_CHANGE_INFO
+                and participant.change_info
+                or config & GROUP_ADMIN_BAN_USERS
+                and participant.ban_users
+                or config & GROUP_ADMIN_DELETE_MESSAGES
+                and participant.delete_messages
+                or config & GROUP_ADMIN_PIN_MESSAGES
+                and participant.pin_messages
+                or config & GROUP_ADMIN_INVITE_USERS
+                and participant.invite_users
+            )
+        )
+
+    async def _get_post_editor(self, message: Message) -> typing.Optional[int]:
+        """
+        Get admin, who made the current edit of channel post. Admin log is read
+        only past the last seen event, and checks of the same channel share
+        one request. Edit, which is not found in admin log, has no editor
+        """
+        chat_id = utils.get_chat_id(message)
+        # Editor of previous edit must never be taken for the current one
+        key = (chat_id, message.id, message.edit_date)
+        for _ in range(2):
+            if (editor := self._post_editors.get(key)) is not None:
+                return editor
+
+            if (fetch := self._admin_log_fetches.get(chat_id)) is None:
+                fetch = self._admin_log_fetches[chat_id] = asyncio.ensure_future(
+                    self._fetch_admin_log(chat_id)
+                )
+                fetch.add_done_callback(
+                    functools.partial(self._forget_admin_log_fetch, chat_id)
+                )
+                await asyncio.shield(fetch)
+                return self._post_editors.get(key)
+
+            # Fetch, which was already running, could miss this edit,
+            # so the next one is started, if needed
+            await asyncio.shield(fetch)
+
+        return None
+
+    def _forget_admin_log_fetch(self, chat_id: int, fetch: asyncio.Future):
+        if self._admin_log_fetches.get(chat_id) is fetch:
+            del self._admin_log_fetches[chat_id]
+
+    async def _fetch_admin_log(self, chat_id: int):
+        cursor = self._admin_log_cursors.get(chat_id)
+        editors = {}
+        last_event_id = cursor or 0
+        limit = ADMIN_LOG_LIMIT if cursor is None else ADMIN_LOG_MAX_NEW
+        events_count = 0
+
+        async for event in self._client.iter_admin_log(
+            chat_id,
+            limit=limit,
+            min_id=cursor or 0,
+            edit=True,
+        ):
+            events_count += 1
+            last_event_id = max(last_event_id, event.id)
+            if not (new_message := getattr(event.action, "new_message", None)):
+                continue
+
+            editors[(chat_id, new_message.id, new_message.edit_date)] = event.user_id
+
+        if cursor is not None and events_count >= limit:
+            # Older events past the cursor are skipped, so their edits
+            # will be misses
+            logger.debug("Admin log of %s has more new edits than fetched", chat_id)
+
+        self._admin_log_cursors.set(chat_id, last_event_id)
+        for key, editor in editors.items():
+            self._post_editors.set(key, editor)
+
+    async def _get_chat_admins(
+        self,
+        message: Message,
+    ) -> typing.Dict[int, typing.Union[ChatParticipantAdmin, ChatParticipantCreator]]:
+        """
+        Get admins of basic group. They are fetched in one request for all
+        users of chat, so other participants are not even stored
+        """
+        cache_key = ("admins", utils.get_chat_id(message))
+        if (admins := self._cache.get(cache_key)) is None:
+            full_chat = await message.client(GetFullChatRequest(message.chat_id))
+            admins = {
+                participant.user_id: participant
+                for participant in getattr(
+                    full_chat.full_chat.participants,
+                    "participants",
+                    [],
+                )
+                if isinstance(
+                    participant,
+                    (ChatParticipantAdmin, ChatParticipantCreator),
+                )
+            }
+            self._cache.set(cache_key, admins)
+
+        return admins
+
+    def cache_stats(self) -> typing.Dict[str, int]:
+        """
+        Gets counters of chats and participants cache
+
+        :return: size of cache and number of hits, misses, evictions and expirations
+        """
+
+        return self._cache.stats()
 
     _check = check  # Legacy
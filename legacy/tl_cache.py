@@ -4,9 +4,13 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import collections
 import copy
+import functools
 import inspect
 import logging
+import sys
 import time
 import typing
 
@@ -17,18 +21,37 @@ from legacytl.hints import EntityLike
 from legacytl.network import MTProtoSender
 from legacytl.tl import functions
 from legacytl.tl.alltlobjects import LAYER
+from legacytl.tl.custom import ParticipantPermissions
 from legacytl.tl.functions.channels import GetFullChannelRequest
 from legacytl.tl.functions.users import GetFullUserRequest
-from legacytl.tl.tlobject import TLRequest
+from legacytl.tl.tlobject import TLObject, TLRequest
 from legacytl.tl.types import (
+    Channel,
+    ChannelForbidden,
     ChannelFull,
+    Chat,
+    ChatForbidden,
+    PeerChannel,
+    PeerChat,
+    UpdateChannel,
+    UpdateChannelParticipant,
+    UpdateChat,
+    UpdateChatDefaultBannedRights,
+    UpdateChatParticipant,
+    UpdateChatParticipantAdmin,
+    UpdateChatParticipants,
     Updates,
     UpdatesCombined,
     UpdateShort,
+    UpdateUser,
+    UpdateUserName,
+    User,
     UserFull,
 )
-from legacytl.utils import is_list_like
+from legacytl.utils import get_peer_id, is_list_like, resolve_id
 
+from . import _tl_snapshot
+from ._cache import TTLCache
 from .types import (
     CacheRecordEntity,
     CacheRecordFullChannel,
@@ -39,6 +62,66 @@ from .types import (
 
 logger = logging.getLogger(__name__)
 
+# Max number of records in each cache of client
+ENTITY_CACHE_SIZE = 8192
+PERMS_CACHE_SIZE = 4096
+FULL_CACHE_SIZE = 1024
+# Records are dropped after this time (seconds), even if callers accept older ones
+CACHE_TTL = 6 * 60 * 60
+# Default max age of cached record (seconds). Updates invalidate changed records,
+# so it doesn't need to be short
+DEFAULT_EXP = 60 * 60
+# Lookups of entities by id, made within this time (seconds), are sent together
+BATCH_WINDOW = 0.005
+
+
+def _tl_size(value: typing.Any) -> int:
+    """Get size of TL object, as it's serialized"""
+    try:
+        return len(bytes(value))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def _peer_id(entity: typing.Any) -> typing.Optional[int]:
+    """Get marked id of entity, so users, chats and channels with the same id differ"""
+    try:
+        return get_peer_id(entity)
+    except Exception:
+        return None
+
+
+def _cache_keys(entity: EntityLike) -> typing.List[typing.Union[str, int]]:
+    """Get all keys, which entity can be looked up by"""
+    keys = []
+    if peer_id := _peer_id(entity):
+        keys.append(peer_id)
+
+    if getattr(entity, "username", None):
+        keys += [f"@{entity.username}", entity.username]
+
+    return keys
+
+
+def _detach(value: typing.Any, depth: int = 3) -> typing.Any:
+    """
+    Copy cached object together with its nested TL objects and lists
+    (photo, status, participant, admin rights, etc.), so caller can't change
+    the cached object by mutating the result
+    """
+    if isinstance(value, list):
+        return [_detach(item, depth) for item in value]
+
+    if not depth or not isinstance(value, (TLObject, ParticipantPermissions)):
+        return value
+
+    result = copy.copy(value)
+    for name, attr in list(getattr(result, "__dict__", {}).items()):
+        if isinstance(attr, (TLObject, ParticipantPermissions, list)):
+            setattr(result, name, _detach(attr, depth - 1))
+
+    return result
+
 
 def hashable(value: typing.Any) -> bool:
     """
@@ -59,25 +142,59 @@ class CustomTelegramClient(TelegramClient):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._legacy_entity_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordEntity,
-        ] = {}
-
-        self._legacy_perms_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordPerms,
-        ] = {}
-
-        self._legacy_fullchannel_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullChannel,
-        ] = {}
+        # Records are shared between all keys of entity (id, username, etc.)
+        self._legacy_entity_cache = TTLCache(
+            ENTITY_CACHE_SIZE,
+            CACHE_TTL,
+            lambda record: _tl_size(record.entity),
+        )
+        # Keyed by (entity, user)
+        self._legacy_perms_cache = TTLCache(
+            PERMS_CACHE_SIZE,
+            CACHE_TTL,
+            lambda record: _tl_size(record.perms),
+        )
+        self._legacy_fullchannel_cache = TTLCache(
+            FULL_CACHE_SIZE,
+            CACHE_TTL,
+            lambda record: _tl_size(record.full_channel),
+        )
+        self._legacy_fulluser_cache = TTLCache(
+            FULL_CACHE_SIZE,
+            CACHE_TTL,
+            lambda record: _tl_size(record.full_user),
+        )
 
-        self._legacy_fulluser_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullUser,
+        # Requests, which are in flight, so concurrent cache misses share them
+        self._legacy_inflight: typing.Dict[
+            typing.Tuple[str, typing.Hashable],
+            asyncio.Future,
         ] = {}
+        self._legacy_coalesced: typing.Counter[str] = collections.Counter()
+        # Number of records, dropped because updates changed them
+        self._legacy_invalidated: typing.Counter[str] = collections.Counter()
+        self._legacy_invalidators: typing.Dict[
+            typing.Type[TLObject],
+            typing.Callable[[TLObject], None],
+        ] = {
+            UpdateUser: self._invalidate_user,
+            UpdateUserName: self._patch_user_name,
+            UpdateChannel: self._invalidate_chat,
+            UpdateChat: self._invalidate_chat,
+            UpdateChatDefaultBannedRights: self._invalidate_chat,
+            UpdateChatParticipants: self._invalidate_chat_perms,
+            UpdateChannelParticipant: self._invalidate_participant,
+            UpdateChatParticipant: self._invalidate_participant,
+            UpdateChatParticipantAdmin: self._invalidate_participant,
+        }
+
+        # Ids of entities, which wait to be resolved by the next batch request
+        self._legacy_batch: typing.Dict[int, asyncio.Future] = {}
+        self._legacy_batch_handle: typing.Optional[asyncio.TimerHandle] = None
+
+        # Number of sent requests by their type
+        self._legacy_api_calls: typing.Counter[str] = collections.Counter()
+        self._legacy_snapshot_task: typing.Optional[asyncio.Task] = None
 
         self._forbidden_constructors: typing.List[int] = []
 
@@ -190,21 +307,237 @@ class CustomTelegramClient(TelegramClient):
         self._raw_updates_processor = value
 
     @property
-    def legacy_entity_cache(self) -> typing.Dict[int, CacheRecordEntity]:
+    def legacy_entity_cache(self) -> TTLCache:
         return self._legacy_entity_cache
 
     @property
-    def legacy_perms_cache(self) -> typing.Dict[int, CacheRecordPerms]:
+    def legacy_perms_cache(self) -> TTLCache:
         return self._legacy_perms_cache
 
     @property
-    def legacy_fullchannel_cache(self) -> typing.Dict[int, CacheRecordFullChannel]:
+    def legacy_fullchannel_cache(self) -> TTLCache:
         return self._legacy_fullchannel_cache
 
     @property
-    def legacy_fulluser_cache(self) -> typing.Dict[int, CacheRecordFullUser]:
+    def legacy_fulluser_cache(self) -> TTLCache:
         return self._legacy_fulluser_cache
 
+    def legacy_cache_stats(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """
+        Gets counters of client caches
+
+        :return: Cache name -> its size, `bytes` of cached objects and number
+            of `hits`, `misses`, `evictions`, `expirations`, `coalesced` requests
+            and records `invalidated` by updates
+        """
+        return {
+            name: {
+                **cache.stats(),
+                "coalesced": self._legacy_coalesced[name],
+                "invalidated": self._legacy_invalidated[name],
+            }
+            for name, cache in (
+                ("entity", self._legacy_entity_cache),
+                ("perms", self._legacy_perms_cache),
+                ("fullchannel", self._legacy_fullchannel_cache),
+                ("fulluser", self._legacy_fulluser_cache),
+            )
+        }
+
+    async def _single_flight(
+        self,
+        kind: str,
+        key: typing.Hashable,
+        request: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        """
+        Run request or join the same one, which is already in flight.
+        Errors are passed to every waiter and are not remembered
+
+        :param kind: Name of cache, which request fills
+        :param key: Key of requested record
+        :param request: Coroutine function, which makes the request
+        :return: Result of the request
+        """
+        if (future := self._legacy_inflight.get((kind, key))) is not None:
+            self._legacy_coalesced[kind] += 1
+            logger.debug("Joining in-flight %s request for %s", kind, key)
+        else:
+            future = self._legacy_inflight[(kind, key)] = asyncio.ensure_future(
+                request()
+            )
+            future.add_done_callback(
+                functools.partial(self._forget_flight, (kind, key))
+            )
+
+        # Cancellation of one waiter must not cancel request of others
+        return await asyncio.shield(future)
+
+    def _forget_flight(
+        self,
+        flight: typing.Tuple[str, typing.Hashable],
+        future: asyncio.Future,
+    ):
+        if self._legacy_inflight.get(flight) is future:
+            del self._legacy_inflight[flight]
+
+        # Mark error as retrieved, if all waiters were cancelled
+        if not future.cancelled():
+            future.exception()
+
+    @property
+    def legacy_api_calls(self) -> typing.Counter[str]:
+        """Number of requests, sent by client, by their type"""
+        return self._legacy_api_calls
+
+    def _snapshot_records(self) -> typing.Iterator[_tl_snapshot.Record]:
+        now = time.time()
+        # Only ids can be saved, usernames are taken from entities on load
+        for key, record, ttl, aliases in self._legacy_entity_cache.dump():
+            if not (
+                keys := [
+                    (entity_id, 0)
+                    for entity_id in (key, *aliases)
+                    if isinstance(entity_id, int)
+                ]
+            ):
+                continue
+
+            yield _tl_snapshot.Record(
+                _tl_snapshot.ENTITY,
+                record.ts,
+                now + ttl,
+                *keys[0],
+                record.entity,
+                tuple(keys[1:]),
+            )
+
+        for key, record, ttl, aliases in self._legacy_perms_cache.dump():
+            if getattr(record.perms, "participant", None) is None or not (
+                keys := [
+                    (entity_id, user_id)
+                    for entity_id, user_id in (key, *aliases)
+                    if isinstance(entity_id, int) and isinstance(user_id, int)
+                ]
+            ):
+                continue
+
+            yield _tl_snapshot.Record(
+                (
+                    _tl_snapshot.CHAT_PERMS
+                    if record.perms.is_chat
+                    else _tl_snapshot.PERMS
+                ),
+                record.ts,
+                now + ttl,
+                *keys[0],
+                record.perms.participant,
+                tuple(keys[1:]),
+            )
+
+        for kind, cache, attr in (
+            (_tl_snapshot.FULLCHANNEL, self._legacy_fullchannel_cache, "full_channel"),
+            (_tl_snapshot.FULLUSER, self._legacy_fulluser_cache, "full_user"),
+        ):
+            for key, record, ttl, _ in cache.dump():
+                if isinstance(key, int):
+                    yield _tl_snapshot.Record(
+                        kind,
+                        record.ts,
+                        now + ttl,
+                        key,
+                        0,
+                        getattr(record, attr),
+                    )
+
+    def legacy_save_cache(self):
+        """Save snapshot of caches, so they are warm after restart"""
+        if not getattr(self, "tg_id", None):
+            return
+
+        try:
+            _tl_snapshot.save(
+                _tl_snapshot.get_path(self.tg_id),
+                _tl_snapshot.pack(self._snapshot_records()),
+            )
+        except Exception:
+            logger.debug("Can't save snapshot of caches", exc_info=True)
+
+    async def _save_cache_periodically(self):
+        while True:
+            await asyncio.sleep(_tl_snapshot.SAVE_INTERVAL)
+            # Records are serialized in the loop, so caches don't change meanwhile
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    _tl_snapshot.save,
+                    _tl_snapshot.get_path(self.tg_id),
+                    _tl_snapshot.pack(self._snapshot_records()),
+                )
+            except Exception:
+                logger.debug("Can't save snapshot of caches", exc_info=True)
+
+    def legacy_load_cache(self) -> int:
+        """
+        Warm up caches with snapshot of account, saved before restart,
+        and start saving it periodically. Records keep their remaining TTL
+
+        :return: Number of restored records
+        """
+        if self._legacy_snapshot_task is None:
+            self._legacy_snapshot_task = asyncio.ensure_future(
+                self._save_cache_periodically()
+            )
+
+        now = time.time()
+        restored = 0
+        for record in _tl_snapshot.unpack(
+            _tl_snapshot.load(_tl_snapshot.get_path(self.tg_id))
+        ):
+            ttl = record.expires - now
+            if record.kind == _tl_snapshot.ENTITY:
+                cached = CacheRecordEntity(record.key, record.obj, ttl)
+                self._legacy_entity_cache.set(
+                    record.key,
+                    cached,
+                    ttl,
+                    aliases=[
+                        *_cache_keys(record.obj),
+                        *(entity_id for entity_id, _ in record.aliases),
+                    ],
+                )
+            elif record.kind in {_tl_snapshot.PERMS, _tl_snapshot.CHAT_PERMS}:
+                cached = CacheRecordPerms(
+                    record.key,
+                    record.subkey,
+                    ParticipantPermissions(
+                        record.obj,
+                        record.kind == _tl_snapshot.CHAT_PERMS,
+                    ),
+                    ttl,
+                )
+                self._legacy_perms_cache.set(
+                    (record.key, record.subkey),
+                    cached,
+                    ttl,
+                    aliases=record.aliases,
+                )
+            elif record.kind == _tl_snapshot.FULLCHANNEL:
+                cached = CacheRecordFullChannel(record.key, record.obj, ttl)
+                self._legacy_fullchannel_cache.set(record.key, cached, ttl)
+            elif record.kind == _tl_snapshot.FULLUSER:
+                cached = CacheRecordFullUser(record.key, record.obj, ttl)
+                self._legacy_fulluser_cache.set(record.key, cached, ttl)
+            else:
+                continue
+
+            # Age of record is kept, so callers' `exp` still applies to it
+            cached.ts = record.ts
+            restored += 1
+
+        logger.debug("Restored %s cached records of %s", restored, self.tg_id)
+        return restored
+
     @property
     def forbidden_constructors(self) -> typing.List[str]:
         return self._forbidden_constructors
@@ -216,7 +549,7 @@ class CustomTelegramClient(TelegramClient):
     async def get_entity(
         self,
         entity: EntityLike,
-        exp: int = 5 * 60,
+        exp: int = DEFAULT_EXP,
         force: bool = False,
     ):
         """
@@ -234,7 +567,7 @@ class CustomTelegramClient(TelegramClient):
 
         if not hashable(entity):
             try:
-                hashable_entity = next(
+                hashable_entity = _peer_id(entity) or next(
                     getattr(entity, attr)
                     for attr in {"user_id", "channel_id", "chat_id", "id"}
                     if getattr(entity, attr, None)
@@ -254,45 +587,146 @@ class CustomTelegramClient(TelegramClient):
         if (
             not force
             and hashable_entity
-            and hashable_entity in self._legacy_entity_cache
-            and (
-                not exp
-                or self._legacy_entity_cache[hashable_entity].ts + exp > time.time()
-            )
+            and (record := self._legacy_entity_cache.get(hashable_entity))
+            and (not exp or record.ts + exp > time.time())
         ):
             logger.debug(
                 "Using cached entity %s (%s)",
                 entity,
-                type(self._legacy_entity_cache[hashable_entity].entity).__name__,
+                type(record.entity).__name__,
+            )
+            # Cached object is shared, so caller gets its own copy
+            return _detach(record.entity)
+
+        async def resolve() -> EntityLike:
+            resolved_entity = await (
+                self._get_entity_batched(entity)
+                if isinstance(entity, int)
+                else super(CustomTelegramClient, self).get_entity(entity)
             )
-            return copy.deepcopy(self._legacy_entity_cache[hashable_entity].entity)
 
-        resolved_entity = await super().get_entity(entity)
+            if resolved_entity:
+                self._legacy_entity_cache.set(
+                    hashable_entity,
+                    CacheRecordEntity(hashable_entity, resolved_entity, exp),
+                    aliases=_cache_keys(resolved_entity),
+                )
+                logger.debug("Saved hashable_entity %s to cache", hashable_entity)
 
-        if resolved_entity:
-            cache_record = CacheRecordEntity(hashable_entity, resolved_entity, exp)
-            self._legacy_entity_cache[hashable_entity] = cache_record
-            logger.debug("Saved hashable_entity %s to cache", hashable_entity)
+            return resolved_entity
 
-            if getattr(resolved_entity, "id", None):
-                logger.debug("Saved resolved_entity id %s to cache", resolved_entity.id)
-                self._legacy_entity_cache[resolved_entity.id] = cache_record
+        return _detach(await self._single_flight("entity", hashable_entity, resolve))
 
-            if getattr(resolved_entity, "username", None):
-                logger.debug(
-                    "Saved resolved_entity username @%s to cache",
-                    resolved_entity.username,
+    async def get_entities(
+        self,
+        ids: typing.Iterable[int],
+        exp: int = DEFAULT_EXP,
+        force: bool = False,
+    ) -> typing.Dict[int, EntityLike]:
+        """
+        Gets the entities at once and cache them. Cached ones are taken from cache,
+        others are resolved with a single request of each type
+
+        :param ids: Ids of entities to fetch
+        :param exp: Expiration time of the cache record and maximum time of already cached record
+        :param force: Whether to force refresh the cache (make API request)
+        :return: Id -> :obj:`Entity`. Entities, which can't be resolved, are omitted
+        """
+        ids = list(dict.fromkeys(ids))
+        return {
+            entity_id: entity
+            for entity_id, entity in zip(
+                ids,
+                await asyncio.gather(
+                    *[self.get_entity(entity_id, exp, force) for entity_id in ids],
+                    return_exceptions=True,
+                ),
+            )
+            if entity and not isinstance(entity, Exception)
+        }
+
+    def _get_entity_batched(self, entity_id: int) -> asyncio.Future:
+        """
+        Resolve entity along with others, requested within `BATCH_WINDOW`
+
+        :param entity_id: Id of entity, marked one for chats and channels
+        :return: Future of entity
+        """
+        if (future := self._legacy_batch.get(entity_id)) is None:
+            loop = asyncio.get_running_loop()
+            future = self._legacy_batch[entity_id] = loop.create_future()
+            if self._legacy_batch_handle is None:
+                self._legacy_batch_handle = loop.call_later(
+                    BATCH_WINDOW,
+                    self._flush_batch,
                 )
-                self._legacy_entity_cache[f"@{resolved_entity.username}"] = cache_record
-                self._legacy_entity_cache[resolved_entity.username] = cache_record
 
-        return copy.deepcopy(resolved_entity)
+        return future
+
+    def _flush_batch(self):
+        batch, self._legacy_batch = self._legacy_batch, {}
+        self._legacy_batch_handle = None
+        asyncio.ensure_future(self._resolve_batch(batch)).add_done_callback(
+            functools.partial(self._fail_batch, batch)
+        )
+
+    @staticmethod
+    def _fail_batch(batch: typing.Dict[int, asyncio.Future], task: asyncio.Task):
+        # Nobody must wait forever, even if resolving batch crashed
+        error = (
+            asyncio.CancelledError() if task.cancelled() else task.exception()
+        ) or RuntimeError("Entity was not resolved by batch")
+        for future in batch.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _resolve_batch(self, batch: typing.Dict[int, asyncio.Future]):
+        # Access hashes are taken from session, so ids, which are unknown,
+        # fail on their own and don't break the whole batch
+        inputs = {}
+        for entity_id, future in batch.items():
+            try:
+                inputs[entity_id] = await self.get_input_entity(entity_id)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        if not inputs:
+            return
+
+        logger.debug("Resolving batch of %s entities", len(inputs))
+
+        try:
+            # Legacytl sends one request for each type of entities in list
+            entities = await super().get_entity(list(inputs.values()))
+        except Exception:
+            logger.debug("Batch failed, resolving its entities one by one")
+            entities = None
+
+        if not is_list_like(entities) or len(entities) != len(inputs):
+            # One broken entity must not fail the others
+            entities = await asyncio.gather(
+                *[
+                    super(CustomTelegramClient, self).get_entity(input_entity)
+                    for input_entity in inputs.values()
+                ],
+                return_exceptions=True,
+            )
+
+        for entity_id, entity in zip(inputs, entities):
+            if batch[entity_id].done():
+                continue
+
+            if isinstance(entity, Exception):
+                batch[entity_id].set_exception(entity)
+            else:
+                batch[entity_id].set_result(entity)
 
     async def get_perms_cached(
         self,
         entity: EntityLike,
         user: typing.Optional[EntityLike] = None,
-        exp: int = 5 * 60,
+        exp: int = DEFAULT_EXP,
         force: bool = False,
     ):
         """
@@ -352,63 +786,51 @@ class CustomTelegramClient(TelegramClient):
             not force
             and hashable_entity
             and hashable_user
-            and hashable_user in self._legacy_perms_cache.get(hashable_entity, {})
             and (
-                not exp
-                or self._legacy_perms_cache[hashable_entity][hashable_user].ts + exp
-                > time.time()
+                record := self._legacy_perms_cache.get((hashable_entity, hashable_user))
             )
+            and (not exp or record.ts + exp > time.time())
         ):
             logger.debug("Using cached perms %s (%s)", hashable_entity, hashable_user)
-            return copy.deepcopy(
-                self._legacy_perms_cache[hashable_entity][hashable_user].perms
-            )
-
-        resolved_perms = await self.get_permissions(entity, user)
-
-        if resolved_perms:
-            cache_record = CacheRecordPerms(
-                hashable_entity,
-                hashable_user,
-                resolved_perms,
-                exp,
-            )
-            self._legacy_perms_cache.setdefault(hashable_entity, {})[hashable_user] = (
-                cache_record
-            )
-            logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
-
-            def save_user(key: typing.Union[str, int]):
-                nonlocal self, cache_record, user, hashable_user
-                if getattr(user, "id", None):
-                    self._legacy_perms_cache.setdefault(key, {})[user.id] = cache_record
-
-                if getattr(user, "username", None):
-                    self._legacy_perms_cache.setdefault(key, {})[
-                        f"@{user.username}"
-                    ] = cache_record
-                    self._legacy_perms_cache.setdefault(key, {})[user.username] = (
-                        cache_record
-                    )
-
-            if getattr(entity, "id", None):
-                logger.debug("Saved resolved_entity id %s perms to cache", entity.id)
-                save_user(entity.id)
-
-            if getattr(entity, "username", None):
+            return _detach(record.perms)
+
+        async def resolve() -> typing.Any:
+            resolved_perms = await self.get_permissions(entity, user)
+
+            if resolved_perms:
+                self._legacy_perms_cache.set(
+                    (hashable_entity, hashable_user),
+                    CacheRecordPerms(
+                        hashable_entity,
+                        hashable_user,
+                        resolved_perms,
+                        exp,
+                    ),
+                    aliases=[
+                        (entity_key, user_key)
+                        for entity_key in [hashable_entity, *_cache_keys(entity)]
+                        for user_key in [hashable_user, *_cache_keys(user)]
+                    ],
+                )
                 logger.debug(
-                    "Saved resolved_entity username @%s perms to cache",
-                    entity.username,
+                    "Saved hashable_entity %s perms to cache",
+                    hashable_entity,
                 )
-                save_user(f"@{entity.username}")
-                save_user(entity.username)
 
-        return copy.deepcopy(resolved_perms)
+            return resolved_perms
+
+        return _detach(
+            await self._single_flight(
+                "perms",
+                (hashable_entity, hashable_user),
+                resolve,
+            )
+        )
 
     async def get_fullchannel(
         self,
         entity: EntityLike,
-        exp: int = 300,
+        exp: int = DEFAULT_EXP,
         force: bool = False,
     ) -> ChannelFull:
         """
@@ -443,24 +865,30 @@ class CustomTelegramClient(TelegramClient):
 
         if (
             not force
-            and self._legacy_fullchannel_cache.get(hashable_entity)
-            and not self._legacy_fullchannel_cache[hashable_entity].expired
-            and self._legacy_fullchannel_cache[hashable_entity].ts + exp > time.time()
+            and (record := self._legacy_fullchannel_cache.get(hashable_entity))
+            and not record.expired
+            and record.ts + exp > time.time()
         ):
-            return self._legacy_fullchannel_cache[hashable_entity].full_channel
+            return record.full_channel
 
-        result = await self._call(self._sender, GetFullChannelRequest(channel=entity))
-        self._legacy_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
-            hashable_entity,
-            result,
-            exp,
-        )
-        return result
+        async def resolve() -> ChannelFull:
+            result = await self._call(
+                self._sender,
+                GetFullChannelRequest(channel=entity),
+            )
+            self._legacy_fullchannel_cache.set(
+                hashable_entity,
+                CacheRecordFullChannel(hashable_entity, result, exp),
+                exp,
+            )
+            return result
+
+        return await self._single_flight("fullchannel", hashable_entity, resolve)
 
     async def get_fulluser(
         self,
         entity: EntityLike,
-        exp: int = 300,
+        exp: int = DEFAULT_EXP,
         force: bool = False,
     ) -> UserFull:
         """
@@ -495,19 +923,22 @@ class CustomTelegramClient(TelegramClient):
 
         if (
             not force
-            and self._legacy_fulluser_cache.get(hashable_entity)
-            and not self._legacy_fulluser_cache[hashable_entity].expired
-            and self._legacy_fulluser_cache[hashable_entity].ts + exp > time.time()
+            and (record := self._legacy_fulluser_cache.get(hashable_entity))
+            and not record.expired
+            and record.ts + exp > time.time()
         ):
-            return self._legacy_fulluser_cache[hashable_entity].full_user
+            return record.full_user
 
-        result = await self._call(self._sender, GetFullUserRequest(entity))
-        self._legacy_fulluser_cache[hashable_entity] = CacheRecordFullUser(
-            hashable_entity,
-            result,
-            exp,
-        )
-        return result
+        async def resolve() -> UserFull:
+            result = await self._call(self._sender, GetFullUserRequest(entity))
+            self._legacy_fulluser_cache.set(
+                hashable_entity,
+                CacheRecordFullUser(hashable_entity, result, exp),
+                exp,
+            )
+            return result
+
+        return await self._single_flight("fulluser", hashable_entity, resolve)
 
     async def _call(
         self,
@@ -569,6 +1000,8 @@ class CustomTelegramClient(TelegramClient):
         if not new_request:
             return
 
+        self._legacy_api_calls.update(type(item).__name__ for item in new_request)
+
         return await super()._call(
             sender,
             new_request[0] if not_tuple else tuple(new_request),
@@ -601,4 +1034,136 @@ class CustomTelegramClient(TelegramClient):
         if self._raw_updates_processor is not None:
             self._raw_updates_processor(update)
 
+        try:
+            self._invalidate_caches(update)
+        except Exception:
+            logger.debug("Can't invalidate caches by %s", update, exc_info=True)
+
         super()._handle_update(update)
+
+    def _invalidate_caches(
+        self,
+        update: typing.Union[Updates, UpdatesCombined, UpdateShort],
+    ):
+        """
+        Drop or patch cached records, which are changed by update,
+        so they don't live until expiration
+        """
+        for entity in [*getattr(update, "users", []), *getattr(update, "chats", [])]:
+            self._patch_entity(entity)
+
+        for item in getattr(update, "updates", None) or [
+            getattr(update, "update", None)
+        ]:
+            if (invalidator := self._legacy_invalidators.get(type(item))) is not None:
+                invalidator(item)
+
+    def _forget(self, kind: str, cache: TTLCache, key: typing.Hashable):
+        if cache.pop(key, None) is not None:
+            self._legacy_invalidated[kind] += 1
+
+    def _forget_perms(
+        self,
+        chat_id: int,
+        user_id: typing.Optional[int] = None,
+    ):
+        self._legacy_invalidated["perms"] += self._legacy_perms_cache.prune(
+            lambda key: key[0] == chat_id and (user_id is None or key[1] == user_id)
+        )
+
+    def _replace_entity(self, entity: EntityLike):
+        # Record is rekeyed by id, so it doesn't stay under the old username
+        peer_id = _peer_id(entity)
+        self._legacy_entity_cache.pop(peer_id)
+        self._legacy_entity_cache.set(
+            peer_id,
+            CacheRecordEntity(peer_id, entity, DEFAULT_EXP),
+            aliases=_cache_keys(entity),
+        )
+
+    def _patch_entity(self, entity: TLObject):
+        if isinstance(entity, (ChatForbidden, ChannelForbidden)) or getattr(
+            entity, "migrated_to", None
+        ):
+            self._invalidate_chat(entity)
+            return
+
+        # Entities, which are attached to updates, are up to date,
+        # unless they are `min` ones, which lack access hash and some fields
+        if (
+            isinstance(entity, (User, Chat, Channel))
+            and not getattr(entity, "min", False)
+            and (record := self._legacy_entity_cache.peek(_peer_id(entity))) is not None
+            and type(entity) is type(record.entity)
+        ):
+            self._replace_entity(entity)
+
+    def _invalidate_user(self, update: UpdateUser):
+        self._forget("entity", self._legacy_entity_cache, update.user_id)
+        self._forget("fulluser", self._legacy_fulluser_cache, update.user_id)
+
+    def _patch_user_name(self, update: UpdateUserName):
+        self._forget("fulluser", self._legacy_fulluser_cache, update.user_id)
+        if (record := self._legacy_entity_cache.peek(update.user_id)) is None:
+            return
+
+        # Cached object may be shared with callers, so it's replaced with a copy
+        user = copy.copy(record.entity)
+        user.first_name = update.first_name
+        user.last_name = update.last_name
+        user.usernames = update.usernames
+        user.username = next(
+            (
+                username.username
+                for username in update.usernames or []
+                if username.active and username.editable
+            ),
+            None,
+        )
+        self._replace_entity(user)
+
+    def _invalidate_chat(
+        self,
+        update: typing.Union[UpdateChannel, UpdateChat, UpdateChatDefaultBannedRights],
+    ):
+        if channel_id := getattr(update, "channel_id", None):
+            peer = PeerChannel(channel_id)
+        elif chat_id := getattr(update, "chat_id", None):
+            peer = PeerChat(chat_id)
+        else:
+            # Update of peer or entity itself
+            peer = getattr(update, "peer", None) or update
+
+        chat_id = _peer_id(peer)
+        self._forget("entity", self._legacy_entity_cache, chat_id)
+        self._forget_fullchannel(chat_id)
+        self._forget_perms(chat_id)
+
+    def _forget_fullchannel(self, chat_id: int):
+        # Full channels are cached by the id, caller passed, marked or not
+        self._forget("fullchannel", self._legacy_fullchannel_cache, chat_id)
+        self._forget(
+            "fullchannel",
+            self._legacy_fullchannel_cache,
+            resolve_id(chat_id)[0],
+        )
+
+    def _invalidate_chat_perms(self, update: UpdateChatParticipants):
+        self._forget_perms(_peer_id(PeerChat(update.participants.chat_id)))
+
+    def _invalidate_participant(
+        self,
+        update: typing.Union[
+            UpdateChannelParticipant,
+            UpdateChatParticipant,
+            UpdateChatParticipantAdmin,
+        ],
+    ):
+        chat_id = _peer_id(
+            PeerChannel(update.channel_id)
+            if getattr(update, "channel_id", None)
+            else PeerChat(update.chat_id)
+        )
+        self._forget_perms(chat_id, update.user_id)
+        # Full channel keeps counters of admins and participants
+        self._forget_fullchannel(chat_id)
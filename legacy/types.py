@@ -923,8 +923,9 @@ class CacheRecordEntity:
         resolved_entity: EntityLike,
         exp: int,
     ):
-        self.entity = copy.deepcopy(resolved_entity)
-        self._hashable_entity = copy.deepcopy(hashable_entity)
+        # Cache owns the object, callers get copies of it
+        self.entity = resolved_entity
+        self._hashable_entity = hashable_entity
         self._exp = round(time.time() + exp)
         self.ts = time.time()
 
@@ -956,9 +957,9 @@ class CacheRecordPerms:
         resolved_perms: EntityLike,
         exp: int,
     ):
-        self.perms = copy.deepcopy(resolved_perms)
-        self._hashable_entity = copy.deepcopy(hashable_entity)
-        self._hashable_user = copy.deepcopy(hashable_user)
+        self.perms = resolved_perms
+        self._hashable_entity = hashable_entity
+        self._hashable_user = hashable_user
         self._exp = round(time.time() + exp)
         self.ts = time.time()
 
@@ -605,6 +605,9 @@ async def answer(
         if name := kwargs.pop("filename", None):
             response.name = name
 
+        if (grep := getattr(message, "legacy_grep", None)) is not None:
+            response = grep.filter_file(response)
+
         if message.media is not None and edit:
             await message.edit(file=response, **kwargs)
         else:
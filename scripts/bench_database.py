@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of `Database.set` and full snapshot save.
+
+Usage: python scripts/bench_database.py [path to checkout]
+
+Path allows to measure other checkout (e.g. baseline) with the same script.
+Database consists of N owners x 10 keys x 100-int lists, `set` is measured
+as its synchronous part of 200 writes of one counter. Writes are flushed
+by event loop in background, so they run within it
+"""
+
+import asyncio
+import pathlib
+import sys
+import tempfile
+import time
+
+# Arguments are consumed before import, because main module parses them too
+ARGS, sys.argv[1:] = sys.argv[1:], []
+ROOT = pathlib.Path(ARGS[0] if ARGS else __file__).resolve()
+sys.path.insert(0, str(ROOT if ROOT.is_dir() else ROOT.parent.parent))
+
+import ujson  # noqa: E402
+
+# Main module must be imported first to resolve circular imports of package
+import legacy.main  # noqa: E402, F401
+from legacy import database  # noqa: E402
+
+SETS = 200
+SAVES = 5
+
+
+class FakeClient:
+    tg_id = 0
+
+
+def make_db(path: pathlib.Path, owners: int) -> database.Database:
+    db = database.Database(FakeClient())
+    db._db_file = path / f"config-{owners}.json"
+    db._journal_file = path / f"config-{owners}.journal"
+    for owner in range(owners):
+        dict.__setitem__(
+            db,
+            f"mod{owner}",
+            {f"k{key}": list(range(100)) for key in range(10)},
+        )
+
+    # Benchmark measures writes, not validation of the initial contents
+    if hasattr(db, "_dirty_owners"):
+        db._dirty_owners.clear()
+
+    return db
+
+
+def bench_set(db: database.Database) -> float:
+    start = time.perf_counter()
+    for i in range(SETS):
+        db.set("counter", "value", i)
+
+    return (time.perf_counter() - start) / SETS
+
+
+def bench_save(db: database.Database) -> float:
+    start = time.perf_counter()
+    for _ in range(SAVES):
+        db.save()
+        if hasattr(db, "flush"):
+            db.flush()
+
+    return (time.perf_counter() - start) / SAVES
+
+
+async def main():
+    path = pathlib.Path(tempfile.mkdtemp())
+    print(f"{'owners':>6} {'db size':>9} {'set()':>10} {'save()':>10}")
+    for owners in (10, 100, 1000):
+        db = make_db(path, owners)
+        size = len(ujson.dumps(dict(db)))
+        set_time = bench_set(db)
+        save_time = bench_save(db)
+        print(
+            f"{owners:>6} {size / 1024:>5.0f} KiB {set_time * 1e6:>7.1f} us"
+            f" {save_time * 1e3:>7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
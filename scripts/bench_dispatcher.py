@@ -0,0 +1,183 @@
+"""
+Benchmark of per-event cost of `CommandDispatcher` without network.
+
+Usage: python scripts/bench_dispatcher.py [path to checkout] [watchers]
+
+Path allows to measure other checkout (e.g. baseline) with the same script.
+Events are 90% plain group messages and 10% own commands, security checks
+are stubbed out, so only the routing itself is measured
+"""
+
+import asyncio
+import pathlib
+import sys
+import tempfile
+import time
+
+# Arguments are consumed before import, because main module parses them too
+ARGS, sys.argv[1:] = sys.argv[1:], []
+ROOT = pathlib.Path(ARGS[0] if ARGS else __file__).resolve()
+sys.path.insert(0, str(ROOT if ROOT.is_dir() else ROOT.parent.parent))
+WATCHERS = int(ARGS[1]) if len(ARGS) > 1 else 8
+
+from legacytl import events  # noqa: E402
+
+# Main module must be imported first to resolve circular imports of package
+import legacy.main  # noqa: E402, F401
+from legacy import database, dispatcher, security  # noqa: E402
+
+EVENTS = 20000
+TEXTS = ["hello there, a regular message in a big group"] * 9 + [".ping"]
+
+
+class FakeSecurity:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def check(self, *args, **kwargs) -> bool:
+        return True
+
+    async def check_many(self, *args, **kwargs) -> int:
+        return -1
+
+    def check_tsec(self, *args, **kwargs) -> bool:
+        return False
+
+
+class Peer:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+
+
+class FakeMessage(dispatcher.Message):
+    # Properties of real message are shadowed, so they can be set directly
+    text = raw_text = chat_id = sender_id = is_private = is_group = None
+    is_channel = sticker = document = reply_to_msg_id = None
+
+    def __init__(self, text: str):
+        self.id = 1
+        self.message = self.raw_text = self.text = text
+        self.out = False
+        self.chat_id = -1001234
+        self.sender_id = 42
+        self.mentioned = False
+        self.is_private = False
+        self.is_group = self.is_channel = True
+        self.fwd_from = self.media = self.reply_to = self.reply_to_msg_id = None
+        self.via_bot_id = self.sticker = self.document = self.date = None
+        self.entities = []
+        self.peer_id = Peer(1234)
+        self.from_id = Peer(42)
+        self._client = None
+
+    async def edit(self, *args, **kwargs):
+        pass
+
+
+class FakeEvent(events.NewMessage.Event):
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.out = message.out
+        self.sender_id = message.sender_id
+        self.chat_id = message.chat_id
+        self.mentioned = self.is_private = False
+
+
+class Module:
+    strings = {"name": "Bench"}
+
+    async def ping(self, message):
+        pass
+
+
+def make_watchers(module: Module) -> list:
+    tags = [
+        {"no_commands": True},
+        {"no_commands": True},
+        {"only_commands": True},
+        {"only_messages": True},
+        {"contains": "zzz"},
+        {"only_messages": True},
+        {"no_commands": True, "only_groups": True},
+        {},
+    ]
+    watchers = []
+    for i in range(WATCHERS):
+
+        async def watcher(self, message):
+            pass
+
+        watcher.__name__ = f"watcher{i}"
+        for tag, value in tags[i % len(tags)].items():
+            setattr(watcher, tag, value)
+
+        setattr(Module, watcher.__name__, watcher)
+        watchers.append(getattr(module, watcher.__name__))
+
+    return watchers
+
+
+class Modules:
+    def __init__(self, module: Module):
+        self.watchers = make_watchers(module)
+        self._module = module
+        if hasattr(sys.modules["legacy._watchers"], "WatcherRegistry"):
+            from legacy._watchers import WatcherRegistry
+
+            self.watcher_registry = WatcherRegistry()
+            self.watcher_registry.rebuild(self.watchers)
+
+    def dispatch(self, command: str) -> tuple:
+        return (command, self._module.ping if command == "ping" else None)
+
+
+class Me:
+    id = 1
+    username = "me"
+    usernames = []
+
+
+class FakeClient:
+    tg_id = 1
+    legacy_me = Me()
+
+    def add_event_handler(self, *args, **kwargs):
+        pass
+
+
+async def run(d: dispatcher.CommandDispatcher, count: int) -> float:
+    batch = [FakeEvent(FakeMessage(TEXTS[i % len(TEXTS)])) for i in range(count)]
+    start = time.perf_counter()
+    for event in batch:
+        if hasattr(d, "handle_event"):
+            await d.handle_event(event)
+        else:
+            await d.handle_incoming(event)
+            await d.handle_command(event)
+
+    # Commands are resolved in chat lanes, which must be counted too
+    while len(getattr(d, "command_lanes", ())):
+        await asyncio.sleep(0)
+
+    elapsed = time.perf_counter() - start
+    # Let scheduled handlers finish, so they don't pile up between runs
+    await asyncio.sleep(0.1)
+    return elapsed / count
+
+
+async def main():
+    security.SecurityManager = FakeSecurity
+    db = database.Database(FakeClient())
+    path = pathlib.Path(tempfile.mkdtemp())
+    db._db_file = path / "config.json"
+    db._journal_file = path / "config.journal"
+    d = dispatcher.CommandDispatcher(Modules(Module()), FakeClient(), db)
+    d.client = FakeClient()
+
+    await run(d, EVENTS // 10)
+    best = min([await run(d, EVENTS) for _ in range(3)])
+    print(f"{WATCHERS} watchers: {best * 1e6:.1f} us per event")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
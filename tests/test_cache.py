@@ -0,0 +1,114 @@
+import pytest
+
+from legacy import _cache
+from legacy._cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_aliases_share_entry(clock):
+    cache = TTLCache(10, 60)
+    cache.set(42, "durov", aliases=["@durov", "durov"])
+
+    assert cache.get("@durov") == cache.get("durov") == cache[42] == "durov"
+    assert len(cache) == 1
+
+    assert cache.pop("durov") == "durov"
+    assert 42 not in cache
+    assert "@durov" not in cache
+
+
+def test_alias_moves_to_new_entry(clock):
+    cache = TTLCache(10, 60)
+    cache.set(1, "old", aliases=["name"])
+    cache.set(2, "new", aliases=["name"])
+
+    assert cache.get("name") == "new"
+    assert cache.get(1) == "old"
+    # Dropping the old entry must not drop alias, which belongs to the new one
+    cache.pop(1)
+    assert cache.get("name") == "new"
+
+
+def test_key_replaces_alias(clock):
+    cache = TTLCache(10, 60)
+    cache.set(1, "entity", aliases=["name"])
+    cache.set("name", "other")
+
+    assert cache.get("name") == "other"
+    assert cache.get(1) == "entity"
+
+
+def test_expiration(clock):
+    cache = TTLCache(10, 60)
+    cache.set(1, "a")
+    cache.set(2, "b", ttl=120)
+
+    clock[0] += 61
+    assert cache.get(1) is None
+    assert cache.get(2) == "b"
+    assert cache.peek(1) is None
+    assert cache.stats()["expirations"] == 1
+    assert [key for key, *_ in cache.dump()] == [2]
+
+
+def test_lru_eviction(clock):
+    cache = TTLCache(2, 60, len)
+    cache.set(1, "aaa", aliases=["one"])
+    cache.set(2, "bb")
+    # Makes 1 recently used, so 2 is evicted
+    cache.get("one")
+    cache.set(3, "c")
+
+    assert 2 not in cache
+    assert cache.get(1) == "aaa"
+    assert cache.get(3) == "c"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 4
+
+
+def test_peek_doesnt_touch_entry(clock):
+    cache = TTLCache(2, 60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    hits = cache.hits
+
+    assert cache.peek(1) == "a"
+    cache.set(3, "c")
+
+    assert cache.hits == hits
+    assert 1 not in cache
+
+
+def test_prune_matches_aliases(clock):
+    cache = TTLCache(10, 60)
+    cache.set((1, 5), "a", aliases=[("@chat", 5)])
+    cache.set(("@chat", 6), "b")
+    cache.set((2, 5), "c")
+
+    assert cache.prune(lambda key: key[0] == "@chat") == 2
+    assert list(cache._aliases) == []
+    assert cache.get((2, 5)) == "c"
+
+
+def test_dump(clock):
+    cache = TTLCache(10, 60)
+    cache.set(1, "a", aliases=["x"])
+    clock[0] += 10
+
+    assert cache.dump() == [(1, "a", 50.0, ("x",))]
+
+
+def test_clear(clock):
+    cache = TTLCache(10, 60, len)
+    cache.set(1, "a", aliases=["x"])
+    cache.clear()
+
+    assert len(cache) == 0
+    assert "x" not in cache
+    assert cache.stats()["bytes"] == 0
@@ -0,0 +1,447 @@
+import asyncio
+import sys
+import typing
+
+import pytest
+import ujson
+
+pytest.importorskip("legacytl")
+
+# Main module must be imported first to resolve circular imports of package,
+# and it parses command line on import
+argv, sys.argv = sys.argv, sys.argv[:1]
+try:
+    import legacy.main  # noqa: E402, F401
+finally:
+    sys.argv = argv
+
+from legacy import database  # noqa: E402
+
+
+class Client:
+    tg_id = 1
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    def make() -> database.Database:
+        db = database.Database(Client())
+        db._db_file = tmp_path / "config-1.json"
+        db._journal_file = tmp_path / "config-1.journal"
+        db.read()
+        return db
+
+    return make
+
+
+def journal(db: database.Database) -> list:
+    return [
+        ujson.loads(line)
+        for line in db._journal_file.read_text().splitlines()
+        if line
+    ]
+
+
+def test_set_appends_journal(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    db.set("mod", "b", {"c": [1, 2]})
+
+    assert journal(db) == [
+        {"o": "mod", "k": "a", "v": 1},
+        {"o": "mod", "k": "b", "v": {"c": [1, 2]}},
+    ]
+    assert not db._db_file.exists()
+    assert db.pending_writes == 0
+
+
+def test_journal_is_replayed_and_compacted(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    db.set("mod", "a", 2)
+    db.set("other", "b", "x")
+
+    restored = make_db()
+
+    assert restored.get("mod", "a") == 2
+    assert restored.get("other", "b") == "x"
+    # Replayed journal is merged into snapshot
+    assert ujson.loads(restored._db_file.read_text()) == {
+        "mod": {"a": 2},
+        "other": {"b": "x"},
+    }
+    assert restored._journal_file.read_text() == ""
+
+
+def test_journal_replays_on_top_of_snapshot(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    db.save()
+    db.flush()
+    db.set("mod", "b", 2)
+
+    assert ujson.loads(db._db_file.read_text()) == {"mod": {"a": 1}}
+    assert make_db()["mod"] == {"a": 1, "b": 2}
+
+
+def test_broken_journal_tail_is_dropped(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    with db._journal_file.open("a") as f:
+        f.write('{"o":"mod","k":"b","v":2}\n{"o":"mod","k":\n')
+        f.write('{"o":"mod","k":"c","v":3}\n')
+
+    assert make_db()["mod"] == {"a": 1, "b": 2}
+
+
+def test_journal_is_compacted_when_too_big(make_db, monkeypatch):
+    monkeypatch.setattr(database, "JOURNAL_MAX_SIZE", 100)
+    db = make_db()
+    for i in range(10):
+        db.set("mod", str(i), "x" * 20)
+
+    # Snapshot is written instead of journal records, which don't fit
+    assert db._db_file.exists()
+    assert len(db._journal_file.read_text()) <= 100
+    assert make_db()["mod"] == {str(i): "x" * 20 for i in range(10)}
+
+
+def test_save_writes_snapshot_and_truncates_journal(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    db["mod"]["b"] = 2
+    db.save()
+    db.flush()
+
+    assert ujson.loads(db._db_file.read_text()) == {"mod": {"a": 1, "b": 2}}
+    assert db._journal_file.read_text() == ""
+
+
+def test_save_mutated_journals_only_changed_keys(make_db):
+    db = make_db()
+    db.set("mod", "a", [1])
+    db.set("mod", "b", 2)
+    db["mod"]["a"].append(2)
+
+    assert db.save_mutated() == 1
+    db.flush()
+
+    assert journal(db)[-1] == {"o": "mod", "k": "a", "v": [1, 2]}
+    assert make_db()["mod"] == {"a": [1, 2], "b": 2}
+
+
+@pytest.fixture
+def make_sqlite_db(tmp_path):
+    def make() -> database.Database:
+        db = database.Database(Client())
+        db._db_file = tmp_path / "config-1.json"
+        db._journal_file = tmp_path / "config-1.journal"
+        db._sqlite = database.SQLiteStorage(tmp_path / "config-1.db")
+        db.read()
+        return db
+
+    return make
+
+
+def test_sqlite_snapshot_writes_only_changed_keys(make_sqlite_db):
+    db = make_sqlite_db()
+    db.set("a", "x", 1)
+    db.set("a", "l", [1])
+    db.set("b", "y", 2)
+
+    db = make_sqlite_db()
+    db["a"]["l"].append(2)
+    del db["a"]["x"]
+    written = []
+    write = db._sqlite.write
+
+    def spy(rows, removed=()):
+        written.append((list(rows), list(removed)))
+        write(*written[-1])
+
+    db._sqlite.write = spy
+    db.save()
+    db.flush()
+
+    assert written == [([("a", "l", "[1,2]")], [("a", "x")])]
+    # Owners, which were not accessed, are not loaded
+    assert db._unloaded_owners == {"b"}
+    assert make_sqlite_db()["a"] == {"l": [1, 2]}
+    assert make_sqlite_db()["b"] == {"y": 2}
+
+
+def test_sqlite_rollback_is_persisted(make_sqlite_db):
+    db = make_sqlite_db()
+    db.set("mod", "a", 1)
+    # Each change starts its own revision
+    db._next_revision_call = 0
+    db.set("mod", "a", 2)
+    db._next_revision_call = 0
+    db.set("mod", "new", 3)
+
+    assert db.rollback(2) == 2
+    db.flush()
+
+    assert db["mod"] == {"a": 1}
+    assert make_sqlite_db()["mod"] == {"a": 1}
+
+
+def test_sqlite_rollback_overrides_pending_writes(make_sqlite_db):
+    db = make_sqlite_db()
+    db.set("mod", "a", 1)
+    db.flush()
+
+    async def run():
+        # Writes are deferred while loop is running
+        db._next_revision_call = 0
+        db.set("mod", "a", 2)
+        db.rollback()
+        db.flush()
+
+    asyncio.run(run())
+
+    assert make_sqlite_db()["mod"] == {"a": 1}
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def make_any_db(request):
+    return request.getfixturevalue(
+        "make_db" if request.param == "json" else "make_sqlite_db"
+    )
+
+
+def new_revision(db: database.Database):
+    db._next_revision_call = 0
+
+
+def test_rollback_of_in_place_mutation(make_any_db):
+    db = make_any_db()
+    db.set("mod", "l", [1])
+    new_revision(db)
+    value = db.get("mod", "l")
+    value.append(2)
+    db.set("mod", "l", value)
+
+    assert [revision["keys"] for revision in db.revisions()] == [
+        [("mod", "l")],
+        [("mod", "l")],
+    ]
+    assert db.rollback() == 1
+    db.flush()
+
+    assert db["mod"] == {"l": [1]}
+    assert make_any_db()["mod"] == {"l": [1]}
+
+
+def test_revision_keeps_value_before_its_first_change(make_any_db):
+    db = make_any_db()
+    db.set("mod", "a", 1)
+    new_revision(db)
+    db.set("mod", "a", 2)
+    db.set("mod", "a", 3)
+
+    assert db.rollback() == 1
+    db.flush()
+
+    assert make_any_db()["mod"] == {"a": 1}
+
+
+def test_rollback_of_new_key(make_any_db):
+    db = make_any_db()
+    db.set("mod", "a", 1)
+    new_revision(db)
+    db.set("mod", "b", 2)
+    db.set("other", "c", 3)
+
+    assert db.rollback() == 1
+    db.flush()
+
+    assert db["mod"] == {"a": 1}
+    assert not db.get("other", "c")
+    restored = make_any_db()
+    assert restored["mod"] == {"a": 1}
+    assert restored.get("other", "c") is None
+
+
+def test_rollback_more_revisions_than_exist(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    new_revision(db)
+    db.set("mod", "a", 2)
+
+    with pytest.raises(ValueError):
+        db.rollback(0)
+
+    assert db.rollback(5) == 2
+    assert db.revisions() == []
+    assert db.rollback() == 0
+    assert "a" not in db["mod"]
+
+
+def test_revisions_are_bounded_by_size(make_db, monkeypatch):
+    monkeypatch.setattr(database, "MAX_REVISIONS_SIZE", 100)
+    db = make_db()
+    for i in range(5):
+        new_revision(db)
+        db.set("mod", "a", str(i) * 30)
+
+    # The first revision had no previous value, so it's the smallest one
+    sizes = [revision["size"] for revision in db.revisions()]
+    assert sizes == [36, 36]
+    assert db._revisions_size == 72
+
+    # Oversized revision is still kept, so the last change can be reverted
+    new_revision(db)
+    db.set("mod", "a", "x" * 500)
+    new_revision(db)
+    db.set("mod", "a", "y")
+    assert [revision["size"] for revision in db.revisions()] == [506]
+    assert db.rollback() == 1
+    assert db.get("mod", "a") == "x" * 500
+
+
+def test_revisions_are_bounded_by_count(make_db, monkeypatch):
+    monkeypatch.setattr(database, "MAX_REVISIONS", 3)
+    db = make_db()
+    for i in range(5):
+        new_revision(db)
+        db.set("mod", "a", i)
+
+    assert len(db.revisions()) == 3
+    assert db.rollback(3) == 3
+    assert db.get("mod", "a") == 1
+
+
+def test_transaction_defers_persistence(make_db):
+    db = make_db()
+    with db.transaction():
+        db.set("mod", "a", 1)
+        db.set("mod", "a", 2)
+        db.set("mod", "b", 3)
+
+        # Changes are visible, but not written
+        assert db.get("mod", "a") == 2
+        assert not db._journal_file.exists()
+
+    assert sorted(journal(db), key=lambda record: record["k"]) == [
+        {"o": "mod", "k": "a", "v": 2},
+        {"o": "mod", "k": "b", "v": 3},
+    ]
+
+
+def test_nested_transaction_is_part_of_outer_one(make_db):
+    db = make_db()
+    with db.transaction():
+        with db.transaction():
+            db.set("mod", "a", 1)
+
+        assert not db._journal_file.exists()
+        db.set("mod", "b", 2)
+
+    assert make_db()["mod"] == {"a": 1, "b": 2}
+
+
+def test_transaction_is_reverted_on_error(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    with pytest.raises(KeyError):
+        with db.transaction():
+            db.set("mod", "a", 2)
+            db.set("mod", "new", 3)
+            raise KeyError("interrupted")
+
+    assert db["mod"] == {"a": 1}
+    assert journal(db) == [{"o": "mod", "k": "a", "v": 1}]
+    assert make_db()["mod"] == {"a": 1}
+
+
+def test_transaction_reverts_broken_values(make_db):
+    db = make_db()
+    db.set("mod", "a", 1)
+    with pytest.raises(RuntimeError, match="mod.b"):
+        with db.transaction():
+            db.set("mod", "a", 2)
+            db.set("mod", "b", object())
+
+    assert db["mod"] == {"a": 2}
+    assert make_db()["mod"] == {"a": 2}
+
+
+def test_batch_doesnt_defer_writes_of_other_tasks(make_db):
+    db = make_db()
+
+    started = asyncio.Event()
+
+    async def other():
+        # Spawned before the batch, so it doesn't inherit it
+        await started.wait()
+        db.set("other", "b", 2)
+        db.flush()
+
+    async def run():
+        task = asyncio.ensure_future(other())
+        async with db.batch():
+            db.set("mod", "a", 1)
+            started.set()
+            await task
+            assert journal(db) == [{"o": "other", "k": "b", "v": 2}]
+
+        db.flush()
+
+    asyncio.run(run())
+    assert journal(db)[-1] == {"o": "mod", "k": "a", "v": 1}
+
+
+def test_pointers_participate_in_transaction(make_db):
+    db = make_db()
+    items = db.pointer("mod", "list", [])
+    mapping = db.pointer("mod", "dict", {})
+    with db.transaction():
+        for i in range(10):
+            items.append(i)
+            mapping[str(i)] = i
+
+        items.remove(0)
+        del mapping["0"]
+        assert not db._journal_file.exists()
+
+    assert [record["k"] for record in journal(db)].count("list") == 1
+    restored = make_db()
+    assert restored.get("mod", "list") == list(range(1, 10))
+    assert restored.get("mod", "dict") == {str(i): i for i in range(1, 10)}
+
+
+def test_middleware_participates_in_transaction(make_db):
+    class Rule(typing.NamedTuple):
+        target: int
+        expires: int
+
+    db = make_db()
+    rules = db.pointer("mod", "rules", [], item_type=Rule)
+    named = db.pointer("mod", "named", {}, item_type=Rule)
+    with db.transaction():
+        rules.append(Rule(1, 0))
+        rules.extend([Rule(2, 0), Rule(3, 5)])
+        rules.remove(Rule(2, 0))
+        named["x"] = Rule(4, 0)
+        assert not db._journal_file.exists()
+
+    assert len(journal(db)) == 2
+    restored = make_db()
+    assert list(restored.pointer("mod", "rules", [], item_type=Rule)) == [
+        Rule(1, 0),
+        Rule(3, 5),
+    ]
+    assert restored.pointer("mod", "named", {}, item_type=Rule)["x"] == Rule(4, 0)
+
+
+def test_pointer_changes_are_reverted_with_transaction(make_db):
+    db = make_db()
+    items = db.pointer("mod", "list", [])
+    items.append(1)
+    with pytest.raises(ValueError):
+        with db.transaction():
+            items.append(2)
+            raise ValueError
+
+    assert db.get("mod", "list") == [1]
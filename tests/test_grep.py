@@ -0,0 +1,150 @@
+import io
+
+import pytest
+
+pytest.importorskip("legacytl")
+
+from legacy._grep import GrepFilter, iter_lines  # noqa: E402
+
+LINES = ["one", "two error", "three", "four", "five error", "six", "seven"]
+
+
+def select(grep: GrepFilter, lines=LINES) -> list:
+    return list(grep._select(lines))
+
+
+@pytest.mark.parametrize(
+    "args, include, exclude",
+    [
+        ("error", "error", None),
+        ("error -v debug", "error", "debug"),
+        ("-v debug", None, "debug"),
+        ("two words", "two words", None),
+    ],
+)
+def test_parse_patterns(args, include, exclude):
+    grep = GrepFilter.parse(args)
+
+    assert (grep.include, grep.exclude) == (include, exclude)
+
+
+def test_parse_options():
+    grep = GrepFilter.parse("-ic -E -C 2 -A3 err(or)? -v debug")
+
+    assert grep.ignore_case and grep.count and grep.regex
+    assert (grep.before, grep.after) == (2, 3)
+    assert (grep.include, grep.exclude) == ("err(or)?", "debug")
+
+
+def test_parse_option_like_pattern():
+    # Only leading options are parsed, the rest is pattern
+    assert GrepFilter.parse("error -i").include == "error -i"
+
+
+@pytest.mark.parametrize("args", ["", "  ", "-i", "-E ("])
+def test_parse_nothing_to_filter(args):
+    assert GrepFilter.parse(args) is None
+
+
+def test_select_without_context():
+    assert select(GrepFilter("error")) == [("two error", True), ("five error", True)]
+    assert select(GrepFilter("e", "error")) == [
+        ("one", True),
+        ("three", True),
+        ("seven", True),
+    ]
+
+
+def test_select_ignore_case_and_regex():
+    assert select(GrepFilter("ERROR", ignore_case=True)) == [
+        ("two error", True),
+        ("five error", True),
+    ]
+    assert select(GrepFilter("^f", regex=True)) == [
+        ("four", True),
+        ("five error", True),
+    ]
+
+
+def test_select_context_separates_groups():
+    assert select(GrepFilter("error", before=1, after=1)) == [
+        ("one", False),
+        ("two error", True),
+        ("three", False),
+        ("four", False),
+        ("five error", True),
+        ("six", False),
+    ]
+    assert select(GrepFilter("error", after=1)) == [
+        ("two error", True),
+        ("three", False),
+        None,
+        ("five error", True),
+        ("six", False),
+    ]
+    assert select(GrepFilter("one|seven", regex=True, before=1)) == [
+        ("one", True),
+        None,
+        ("six", False),
+        ("seven", True),
+    ]
+
+
+def test_call_highlights_and_counts():
+    assert GrepFilter("error")("<b>two error</b>\nthree").endswith(
+        "two <u>error</u>"
+    )
+    assert "2 lines" in GrepFilter("error", count=True)("\n".join(LINES))
+    assert "No lines" in GrepFilter("missing")("\n".join(LINES))
+
+
+def test_iter_lines_joins_chunks():
+    assert list(iter_lines(["on", "e\ntw", "o\n", "three"])) == ["one", "two", "three"]
+
+
+def test_filter_file():
+    file = io.BytesIO("\n".join(LINES).encode())
+    file.name = "log.txt"
+    result = GrepFilter("error", after=1).filter_file(file)
+
+    assert result.name == "log.txt"
+    assert result.read().decode() == "two error\nthree\n--\nfive error\nsix\n"
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-32", "utf-8-sig"])
+def test_filter_file_detects_encoding(encoding):
+    file = io.BytesIO("\n".join(LINES).encode(encoding))
+    result = GrepFilter("error").filter_file(file)
+
+    assert result is not file
+    assert result.read().decode() == "two error\nfive error\n"
+
+
+def test_filter_file_with_encoding():
+    file = io.BytesIO("one\nдва error\n".encode("cp1251"))
+
+    assert GrepFilter("error").filter_file(file, "cp1251").read().decode() == (
+        "два error\n"
+    )
+
+
+def test_filter_file_matches_plain_text():
+    file = io.BytesIO(b"a &amp; b\na & b\n<b>tag</b>\n")
+
+    assert GrepFilter("&").filter_file(file).read() == b"a &amp; b\na & b\n"
+
+
+def test_regex_matches_unescaped_text():
+    text = "a &lt;b&gt; c &amp; d\nnothing"
+
+    assert GrepFilter("a <b", regex=True)(text).endswith(
+        "<u>a &lt;b</u>&gt; c &amp; d"
+    )
+    assert GrepFilter("a|t", regex=True)(text).endswith(
+        "<u>a</u> &lt;b&gt; c &amp; d\nno<u>t</u>hing"
+    )
+
+
+def test_literal_matches_unescaped_text():
+    assert GrepFilter("amp")("a &amp; b").startswith("💬 <i>No lines")
+    assert GrepFilter("&")("a &amp; b\nc").endswith("a <u>&amp;</u> b")
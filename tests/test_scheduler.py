@@ -0,0 +1,121 @@
+import asyncio
+
+from legacy._scheduler import COALESCE, DROP_NEW, DROP_OLD, ChatLanes, WatcherPool
+
+
+def watcher():
+    pass
+
+
+async def run_pool(policy, events):
+    """
+    Submit events while the only running job of watcher is blocked
+    :return: Events, jobs of which ran, results of `submit` and stats
+    """
+    pool = WatcherPool(max_running_per_watcher=1, max_queued=2)
+    gate = asyncio.Event()
+    seen = []
+
+    def job(chat_id, event):
+        async def run():
+            if event == "first":
+                await gate.wait()
+
+            seen.append(event)
+
+        return run
+
+    submitted = [
+        pool.submit(watcher, "mod", chat_id, job(chat_id, event), policy=policy)
+        for chat_id, event in [(0, "first"), *events]
+    ]
+    await asyncio.sleep(0)
+    stats = pool.stats()["mod"]
+    gate.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    return seen, submitted, stats, pool.stats()["mod"]
+
+
+def test_drop_new():
+    seen, submitted, stats, total = asyncio.run(
+        run_pool(DROP_NEW, [(1, "a"), (2, "b"), (3, "c")])
+    )
+
+    assert seen == ["first", "a", "b"]
+    assert submitted == [True, True, True, False]
+    assert stats["queued"] == 2
+    assert stats["running"] == 1
+    assert total == {
+        "queued": 0,
+        "running": 0,
+        "done": 3,
+        "dropped": 1,
+        "coalesced": 0,
+    }
+
+
+def test_drop_old():
+    seen, submitted, _, total = asyncio.run(
+        run_pool(DROP_OLD, [(1, "a"), (2, "b"), (3, "c")])
+    )
+
+    assert seen == ["first", "b", "c"]
+    assert all(submitted)
+    assert total["dropped"] == 1
+
+
+def test_coalesce_overflow():
+    seen, submitted, _, total = asyncio.run(
+        run_pool(COALESCE, [(1, "a"), (2, "b"), (1, "a2"), (3, "c")])
+    )
+
+    # Latest event of chat replaces the queued one in its place,
+    # so it's the oldest one, when the queue overflows
+    assert seen == ["first", "b", "c"]
+    assert all(submitted)
+    assert total["coalesced"] == 1
+    assert total["dropped"] == 1
+
+
+def test_coalesce_keeps_latest_event_of_chat():
+    seen, _, _, total = asyncio.run(
+        run_pool(COALESCE, [(1, "a"), (2, "b"), (1, "a2")])
+    )
+
+    assert seen == ["first", "a2", "b"]
+    assert total["coalesced"] == 1
+    assert total["dropped"] == 0
+
+
+def test_unknown_policy_drops_new():
+    seen, submitted, _, _ = asyncio.run(
+        run_pool("unknown", [(1, "a"), (2, "b"), (3, "c")])
+    )
+
+    assert seen == ["first", "a", "b"]
+    assert submitted[-1] is False
+
+
+def test_lanes_keep_order_of_chat():
+    async def run():
+        lanes = ChatLanes()
+        seen = []
+
+        def job(event, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                seen.append(event)
+
+            return run
+
+        lanes.submit(1, job("1a", 0.02))
+        lanes.submit(1, job("1b", 0))
+        lanes.submit(2, job("2a", 0))
+        await asyncio.sleep(0.05)
+        return seen, len(lanes)
+
+    seen, lanes = asyncio.run(run())
+    assert seen == ["2a", "1a", "1b"]
+    assert lanes == 0
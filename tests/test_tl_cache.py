@@ -0,0 +1,220 @@
+import asyncio
+import collections
+
+import pytest
+
+pytest.importorskip("legacytl")
+
+from legacytl import TelegramClient  # noqa: E402
+
+from legacy.tl_cache import CustomTelegramClient  # noqa: E402
+
+
+def make_client() -> CustomTelegramClient:
+    # Client is never connected, so only state of coalescing and batching is set
+    client = CustomTelegramClient.__new__(CustomTelegramClient)
+    client._legacy_inflight = {}
+    client._legacy_coalesced = collections.Counter()
+    client._legacy_batch = {}
+    client._legacy_batch_handle = None
+    return client
+
+
+class FakeRequest:
+    """Request, which is blocked until the gate is opened"""
+
+    def __init__(self, result="result"):
+        self.result = result
+        self.gate = asyncio.Event()
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+        if isinstance(self.result, Exception):
+            raise self.result
+
+        return self.result
+
+
+def test_single_flight_coalesces_requests():
+    async def run():
+        client = make_client()
+        request, other = FakeRequest(), FakeRequest("other")
+        waiters = [
+            asyncio.ensure_future(client._single_flight("entity", 1, request))
+            for _ in range(3)
+        ]
+        waiters.append(
+            asyncio.ensure_future(client._single_flight("entity", 2, other))
+        )
+        await asyncio.sleep(0)
+        request.gate.set()
+        other.gate.set()
+        results = await asyncio.gather(*waiters)
+        return client, request, other, results
+
+    client, request, other, results = asyncio.run(run())
+    assert results == ["result"] * 3 + ["other"]
+    assert request.calls == other.calls == 1
+    assert client._legacy_coalesced == {"entity": 2}
+    assert client._legacy_inflight == {}
+
+
+def test_single_flight_error_reaches_every_waiter():
+    async def run():
+        client = make_client()
+        request = FakeRequest(ValueError("failed"))
+        waiters = [
+            asyncio.ensure_future(client._single_flight("entity", 1, request))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        request.gate.set()
+        errors = await asyncio.gather(*waiters, return_exceptions=True)
+
+        # Error is not remembered, so the next call makes a new request
+        request.result = "result"
+        return errors, request, await client._single_flight("entity", 1, request)
+
+    errors, request, result = asyncio.run(run())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert len(errors) == 3
+    assert result == "result"
+    assert request.calls == 2
+
+
+def test_single_flight_cancelled_waiter_doesnt_cancel_request():
+    async def run():
+        client = make_client()
+        request = FakeRequest()
+        cancelled = asyncio.ensure_future(client._single_flight("entity", 1, request))
+        waiter = asyncio.ensure_future(client._single_flight("entity", 1, request))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        request.gate.set()
+        return cancelled, request, await waiter
+
+    cancelled, request, result = asyncio.run(run())
+    assert cancelled.cancelled()
+    assert not request.cancelled
+    assert result == "result"
+    assert request.calls == 1
+
+
+class FakeEntity:
+    def __init__(self, entity_id: int):
+        self.id = entity_id
+
+    def __eq__(self, other):
+        return isinstance(other, FakeEntity) and other.id == self.id
+
+
+@pytest.fixture
+def batching(monkeypatch):
+    """
+    Client, which resolves ids of known entities
+    :return: Client and list of requests of `get_entity`
+    """
+    client = make_client()
+    requests = []
+
+    async def get_input_entity(entity_id):
+        if entity_id == 13:
+            raise ValueError("Unknown entity")
+
+        return ("input", entity_id)
+
+    async def get_entity(self, entity):
+        requests.append(entity)
+        if isinstance(entity, list):
+            return [FakeEntity(input_entity[1]) for input_entity in entity]
+
+        if entity[1] == 7:
+            raise ValueError("Broken entity")
+
+        return FakeEntity(entity[1])
+
+    client.get_input_entity = get_input_entity
+    monkeypatch.setattr(TelegramClient, "get_entity", get_entity, raising=False)
+    return client, requests
+
+
+async def resolve(client, ids):
+    return await asyncio.gather(
+        *[client._get_entity_batched(entity_id) for entity_id in ids],
+        return_exceptions=True,
+    )
+
+
+def test_batch_window(batching):
+    client, requests = batching
+
+    async def run():
+        first = client._get_entity_batched(1)
+        assert client._get_entity_batched(1) is first
+        client._get_entity_batched(2)
+        await asyncio.sleep(0)
+        assert requests == []
+
+        return await resolve(client, [1, 2, 13]), await resolve(client, [3])
+
+    (first, second, unknown), (third,) = asyncio.run(run())
+    assert (first, second, third) == (FakeEntity(1), FakeEntity(2), FakeEntity(3))
+    assert isinstance(unknown, ValueError)
+    # Ids, requested after the window, are resolved by the next batch
+    assert requests == [[("input", 1), ("input", 2)], [("input", 3)]]
+    assert client._legacy_batch == {}
+
+
+@pytest.mark.parametrize("result", [ValueError("Batch failed"), [], None])
+def test_batch_falls_back_to_one_by_one(batching, monkeypatch, result):
+    client, requests = batching
+    resolve_one = TelegramClient.get_entity
+
+    async def get_entity(self, entity):
+        if not isinstance(entity, list):
+            return await resolve_one(self, entity)
+
+        requests.append(entity)
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    monkeypatch.setattr(TelegramClient, "get_entity", get_entity)
+    first, broken, second = asyncio.run(resolve(client, [1, 7, 2]))
+
+    assert (first, second) == (FakeEntity(1), FakeEntity(2))
+    assert isinstance(broken, ValueError)
+    assert requests == [
+        [("input", 1), ("input", 7), ("input", 2)],
+        ("input", 1),
+        ("input", 7),
+        ("input", 2),
+    ]
+
+
+class Crash(BaseException):
+    pass
+
+
+def test_crashed_batch_fails_all_futures(batching, monkeypatch):
+    client, _ = batching
+
+    async def get_entity(self, entity):
+        raise Crash
+
+    monkeypatch.setattr(TelegramClient, "get_entity", get_entity)
+    first, unknown, second = asyncio.run(resolve(client, [1, 13, 2]))
+
+    assert isinstance(first, Crash) and first is second
+    # Futures, which were already failed, keep their errors
+    assert isinstance(unknown, ValueError)
@@ -0,0 +1,96 @@
+import os
+import struct
+import time
+
+import pytest
+
+pytest.importorskip("legacytl")
+
+from legacytl.tl.types import PeerChannel, PeerUser  # noqa: E402
+
+from legacy import _tl_snapshot  # noqa: E402
+from legacy._tl_snapshot import ENTITY, PERMS, Record  # noqa: E402
+
+
+def test_pack_unpack_roundtrip():
+    now = time.time()
+    records = [
+        Record(ENTITY, now - 10, now + 60, 42, 0, PeerUser(42)),
+        Record(
+            PERMS,
+            now,
+            now + 60,
+            -1001234,
+            42,
+            PeerChannel(1234),
+            ((1234, 42), (-1001234, 7)),
+        ),
+    ]
+
+    restored = list(_tl_snapshot.unpack(_tl_snapshot.pack(records)))
+
+    assert restored == records
+
+
+def test_expired_records_are_skipped():
+    now = time.time()
+    data = _tl_snapshot.pack(
+        [
+            Record(ENTITY, now, now - 1, 1, 0, PeerUser(1), ((7, 0),)),
+            Record(ENTITY, now, now + 60, 2, 0, PeerUser(2)),
+        ]
+    )
+
+    assert [record.key for record in _tl_snapshot.unpack(data)] == [2]
+
+
+def test_unserializable_records_are_skipped():
+    now = time.time()
+    data = _tl_snapshot.pack(
+        [
+            Record(ENTITY, now, now + 60, 1, 0, object()),
+            Record(ENTITY, now, now + 60, 2, 0, PeerUser(2)),
+        ]
+    )
+
+    assert [record.key for record in _tl_snapshot.unpack(data)] == [2]
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        b"",
+        b"XXXX",
+        struct.pack("<4sHI", b"LTLC", _tl_snapshot.VERSION + 1, _tl_snapshot.LAYER),
+        struct.pack("<4sHI", b"LTLC", _tl_snapshot.VERSION, _tl_snapshot.LAYER - 1),
+    ],
+)
+def test_outdated_snapshot_is_ignored(header):
+    now = time.time()
+    data = _tl_snapshot.pack([Record(ENTITY, now, now + 60, 1, 0, PeerUser(1))])
+
+    assert list(_tl_snapshot.unpack(header + data[_tl_snapshot._HEADER.size :])) == []
+
+
+def test_truncated_snapshot():
+    now = time.time()
+    data = _tl_snapshot.pack(
+        [
+            Record(ENTITY, now, now + 60, 1, 0, PeerUser(1)),
+            Record(ENTITY, now, now + 60, 2, 0, PeerUser(2)),
+        ]
+    )
+
+    assert [record.key for record in _tl_snapshot.unpack(data[:-1])] == [1]
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / "cache" / "1.bin")
+    assert _tl_snapshot.load(path) == b""
+
+    _tl_snapshot.save(path, b"data")
+    _tl_snapshot.save(path, b"new data")
+
+    assert _tl_snapshot.load(path) == b"new data"
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(tmp_path / "cache") == ["1.bin"]
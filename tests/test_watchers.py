@@ -0,0 +1,118 @@
+import re
+import types
+
+import pytest
+
+pytest.importorskip("legacytl")
+
+from legacytl.tl.types import Message  # noqa: E402
+
+from legacy._watchers import TAG_BITS, TagFilter, TextMatcher  # noqa: E402
+
+
+class FakeMessage(Message):
+    # Properties of real message are shadowed, so they can be set directly
+    raw_text = sender_id = is_private = is_group = is_channel = None
+    sticker = document = reply_to_msg_id = None
+
+    def __init__(self, text: str = "", **kwargs):
+        self.raw_text = text
+        self.out = False
+        self.sender_id = 42
+        self.is_private = False
+        self.is_group = True
+        self.is_channel = True
+        self.fwd_from = self.via_bot_id = self.media = None
+        self.__dict__.update(kwargs)
+
+
+def context(message, chat_id: int = 1234):
+    return types.SimpleNamespace(
+        message=message,
+        chat_id=chat_id,
+        tags_evaluated=0,
+        tags_passed=0,
+    )
+
+
+def watcher(**tags):
+    def func(message):
+        pass
+
+    for tag, value in tags.items():
+        setattr(func, tag, value)
+
+    return func
+
+
+def test_simple_tags_are_bits():
+    tags = TagFilter(watcher(out=True, only_groups=True, no_commands=True))
+
+    assert tags.mask == TAG_BITS["out"] | TAG_BITS["only_groups"]
+    assert tags.no_commands and not tags.only_commands
+    assert not tags.checks and not tags.text
+
+
+def test_failed_returns_first_failed_tag_in_order():
+    tags = TagFilter(watcher(contains="hi", out=True, only_groups=True))
+    ctx = context(FakeMessage("hi there"))
+
+    assert tags.failed(ctx) == "out"
+    assert ctx.tags_evaluated == tags.mask
+    assert ctx.tags_passed == TAG_BITS["only_groups"]
+
+    assert tags.failed(context(FakeMessage("hi", out=True))) is None
+    assert tags.failed(context(FakeMessage("bye", out=True))) == "contains"
+
+
+def test_text_tags_are_matched_separately():
+    tags = TagFilter(watcher(startswith="a", regex=r"\d", filter=bool, from_id=42))
+
+    assert tags.text == [("startswith", "a"), ("regex", re.compile(r"\d"))]
+    assert [tag for tag, _ in tags.checks] == ["filter", "from_id"]
+    assert tags.from_id == 42
+    assert tags.check(context(FakeMessage("b")))
+    assert not tags.check(context(FakeMessage("a1", sender_id=7)))
+
+
+def test_chat_id_is_normalized():
+    tags = TagFilter(watcher(chat_id=-1001234))
+
+    assert tags.chat_id == 1234
+    assert tags.failed(context(FakeMessage(), chat_id=1234)) is None
+    assert tags.failed(context(FakeMessage(), chat_id=5)) == "chat_id"
+
+
+def test_invalid_regex_never_matches():
+    tags = TagFilter(watcher(regex="("))
+
+    assert tags.text == []
+    assert tags.failed(context(FakeMessage("("))) == "regex"
+
+
+def test_text_matcher():
+    keys = [
+        ("startswith", "/start"),
+        ("startswith", ""),
+        ("endswith", "!"),
+        ("contains", "cat"),
+        ("regex", re.compile(r"\bdo+g\b")),
+        ("regex", re.compile(r"(a)\1")),
+        ("regex", re.compile("HELLO", re.IGNORECASE)),
+    ]
+    matcher = TextMatcher(keys + keys[:1])
+    bit = {key: matcher.mask([key]) for key in keys}
+
+    assert len(matcher.bits) == len(keys)
+    assert matcher.match("/start cat!") == matcher.mask(keys[:4])
+    assert matcher.match("a dooog") == bit[keys[1]] | bit[keys[4]]
+    assert matcher.match("aa") == bit[keys[1]] | bit[keys[5]]
+    assert matcher.match("hello") == bit[keys[1]] | bit[keys[6]]
+    assert matcher.match("") == bit[keys[1]]
+
+
+def test_text_matcher_uncombinable_regexes():
+    named = re.compile(r"(?P<word>\w+) (?P=word)")
+    matcher = TextMatcher([("regex", named), ("regex", re.compile("x"))])
+
+    assert matcher.match("hi hi") == matcher.mask([("regex", named)])